@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""Federation aggregator: one dashboard and API over several masters.
+
+Each master owns a subset of the fleet in its own database. The aggregator keeps
+no state of its own beyond a worker -> master ownership cache; it fans requests
+out to all masters concurrently, merges the answers and reports which masters
+did not answer within the timeout instead of failing the whole request:
+
+    python aggregator.py --masters http://site-a:5000,http://site-b:5000 --port 5100
+
+Configuration can also come from the environment: MASTER_URLS (comma
+separated), AGGREGATOR_TIMEOUT (seconds per fan-out, default 5) and
+AGGREGATOR_PORT.
+"""
+import os
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Flask, request, jsonify, render_template, redirect, Response
+
+# How long the worker -> master ownership map is trusted before re-fetching it
+OWNER_CACHE_SECONDS = 30
+
+app = Flask(__name__)
+
+
+class Federation:
+    """Concurrent fan-out to a set of masters with per-call timeouts"""
+
+    def __init__(self, master_urls, timeout=5.0):
+        self.masters = [url.strip().rstrip('/') for url in master_urls if url.strip()]
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max(10, len(self.masters) * 4))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max(4, len(self.masters) * 4))
+        self.lock = threading.Lock()
+        self.owners = {}
+        # worker_id -> every master listing it, freshest first; several after a failover
+        self.copies = {}
+        self.owners_expire = 0.0
+
+    def call(self, master, method, path, **kwargs):
+        """Make one request to a master, returning a result record instead of raising"""
+        started = time.perf_counter()
+        result = {'url': master, 'ok': False, 'status': None, 'error': None, 'response': None}
+        try:
+            response = self.session.request(method, f"{master}{path}", timeout=self.timeout,
+                                            allow_redirects=False, **kwargs)
+            result['status'] = response.status_code
+            result['response'] = response
+            result['ok'] = response.status_code < 400
+            if not result['ok']:
+                result['error'] = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            result['error'] = str(e)
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def fan_out(self, method, path, masters=None, extra_params=None, **kwargs):
+        """Call every master concurrently; masters that miss the deadline are reported as timed out.
+        extra_params maps a master to query parameters only sent to it."""
+        masters = self.masters if masters is None else masters
+        futures = {}
+        for master in masters:
+            call_kwargs = kwargs
+            if extra_params and extra_params.get(master):
+                call_kwargs = dict(kwargs, params=dict(kwargs.get('params') or {}, **extra_params[master]))
+            futures[master] = self.pool.submit(self.call, master, method, path, **call_kwargs)
+        wait(futures.values(), timeout=self.timeout + 1)
+        results = []
+        for master, future in futures.items():
+            if future.done():
+                results.append(future.result())
+            else:
+                results.append({'url': master, 'ok': False, 'status': None, 'error': 'timed out',
+                                'response': None, 'elapsed_ms': (self.timeout + 1) * 1000})
+        return results
+
+    def workers(self):
+        """Return every worker across the federation and the per-master results"""
+        results = self.fan_out('GET', '/api/workers')
+        merged = {}
+        copies = {}
+        for result in results:
+            if not result['ok']:
+                continue
+            for data in result['response'].json():
+                # A worker that failed over between masters is listed by both; the freshest wins
+                copies.setdefault(data['worker_id'], []).append((data['last_seen'], result['url']))
+                current = merged.get(data['worker_id'])
+                if current is None or data['last_seen'] > current[0]['last_seen']:
+                    merged[data['worker_id']] = (data, result['url'])
+        with self.lock:
+            self.owners = {worker_id: master for worker_id, (_, master) in merged.items()}
+            self.copies = {worker_id: [master for _, master in sorted(listed, reverse=True)]
+                           for worker_id, listed in copies.items()}
+            self.owners_expire = time.monotonic() + OWNER_CACHE_SECONDS
+        return sorted(merged.values(), key=lambda item: item[0]['worker_id']), results
+
+    def owner(self, worker_id):
+        """Return the URL of the master that owns worker_id, or None"""
+        with self.lock:
+            fresh = time.monotonic() < self.owners_expire
+            master = self.owners.get(worker_id)
+        if master is None or not fresh:
+            self.workers()
+            with self.lock:
+                master = self.owners.get(worker_id)
+        return master
+
+    def holders(self, worker_id):
+        """Return the URLs of every master that knows worker_id, freshest first.
+
+        After a failover the worker's history and commands are split between its old
+        master and its new one, so reads of them have to ask both.
+        """
+        with self.lock:
+            fresh = time.monotonic() < self.owners_expire
+            masters = self.copies.get(worker_id)
+        if masters is None or not fresh:
+            self.workers()
+            with self.lock:
+                masters = self.copies.get(worker_id)
+        return masters or []
+
+    def stale_copies(self):
+        """Map each master to the workers it still lists but that now report to another master"""
+        with self.lock:
+            fresh = time.monotonic() < self.owners_expire
+        if not fresh:
+            self.workers()
+        with self.lock:
+            copies = self.copies
+        stale = {}
+        for worker_id, masters in copies.items():
+            for master in masters[1:]:
+                stale.setdefault(master, []).append(worker_id)
+        return stale
+
+    def group_by_owner(self, worker_ids):
+        """Split worker IDs by owning master; unknown workers are returned separately"""
+        with self.lock:
+            fresh = time.monotonic() < self.owners_expire
+            owners = self.owners
+        if not fresh or any(worker_id not in owners for worker_id in worker_ids):
+            self.workers()
+            with self.lock:
+                owners = self.owners
+        groups = {}
+        unknown = []
+        for worker_id in worker_ids:
+            if worker_id in owners:
+                groups.setdefault(owners[worker_id], []).append(worker_id)
+            else:
+                unknown.append(worker_id)
+        return groups, unknown
+
+
+def summarize(results):
+    """Per-master status for a response body, and whether any master was missing"""
+    masters = [{key: result[key] for key in ('url', 'ok', 'status', 'error', 'elapsed_ms')} for result in results]
+    return masters, any(not result['ok'] for result in results)
+
+
+federation = Federation(os.environ.get('MASTER_URLS', '').split(','),
+                        timeout=float(os.environ.get('AGGREGATOR_TIMEOUT', 5)))
+
+
+def proxy(result):
+    """Relay a master's response to the client"""
+    if result['response'] is None:
+        return jsonify({'status': 'error', 'message': f"Master {result['url']} unavailable: {result['error']}"}), 502
+    response = result['response']
+    return Response(response.content, status=response.status_code,
+                    content_type=response.headers.get('Content-Type', 'application/json'))
+
+
+@app.route('/')
+def index():
+    # The dashboard loads the fleet from /api/fleet/summary and /api/fleet/workers below
+    return render_template('index.html')
+
+
+@app.route('/api/fleet/summary')
+def get_fleet_summary():
+    top = min(max(request.args.get('top', 10, type=int), 0), 100)
+    # A master still listing a worker that failed over to another master leaves it out,
+    # so the worker is counted once, by the master it reports to now
+    stale = {master: {'exclude': worker_ids} for master, worker_ids in federation.stale_copies().items()}
+    results = federation.fan_out('GET', '/api/fleet/summary', params={'top': top}, extra_params=stale)
+    summaries = [dict(result['response'].json(), master=result['url']) for result in results if result['ok']]
+    masters, partial = summarize(results)
+    return jsonify(dict(merge_summaries(summaries, top), masters=masters, partial=partial))
+
+
+def gpu_key(gpu):
+    return gpu['worker_id'], gpu['gpu_index']
+
+
+def merge_summaries(summaries, top):
+    """Combine per-master fleet summaries; model means are weighted by GPU count"""
+    models = {}
+    for summary in summaries:
+        for model in summary['models']:
+            merged = models.setdefault(model['model'], {'model': model['model'], 'gpus': 0, 'memory_used': 0.0,
+                                                        'memory_total': 0.0, 'temperature': [0.0, 0], 'utilization': [0.0, 0]})
+            merged['gpus'] += model['gpus']
+            merged['memory_used'] += model['memory_used']
+            merged['memory_total'] += model['memory_total']
+            for key in ('temperature', 'utilization'):
+                if model[f'{key}_mean'] is not None:
+                    merged[key][0] += model[f'{key}_mean'] * model['gpus']
+                    merged[key][1] += model['gpus']
+    for merged in models.values():
+        for key in ('temperature', 'utilization'):
+            total, weight = merged.pop(key)
+            merged[f'{key}_mean'] = round(total / weight, 1) if weight else None
+
+    def tagged(key, identity):
+        # Should the ownership map lag a failover, a worker listed by two masters is kept once
+        items = {}
+        for summary in summaries:
+            for item in summary[key]:
+                items.setdefault(identity(item), dict(item, master=summary['master']))
+        return list(items.values())
+
+    return {
+        'generated_at': datetime.utcnow().isoformat(),
+        'workers': {key: sum(s['workers'][key] for s in summaries) for key in ('total', 'active', 'inactive')},
+        'gpus': {key: sum(s['gpus'][key] for s in summaries) for key in ('total', 'active')},
+        'models': sorted(models.values(), key=lambda m: (-m['gpus'], m['model'])),
+        'hottest': sorted(tagged('hottest', gpu_key), key=lambda g: g['temperature'], reverse=True)[:top],
+        'idlest': sorted(tagged('idlest', gpu_key), key=lambda g: g['utilization'])[:top],
+        'stale_workers': sorted(tagged('stale_workers', lambda w: w['worker_id']),
+                                key=lambda w: w['age_seconds'])[:50],
+    }
+
+
+@app.route('/api/fleet/workers')
+def get_fleet_workers():
+    # Every master returns its first page after the cursor; the merged page is the first
+    # limit of their union, so paging by worker ID works across masters too
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    params = dict(request.args.items(), limit=limit)
+    results = federation.fan_out('GET', '/api/fleet/workers', params=params)
+    merged = {}
+    more = False
+    for result in results:
+        if not result['ok']:
+            continue
+        body = result['response'].json()
+        more = more or body.get('next_after') is not None
+        for worker in body['workers']:
+            # A worker that failed over between masters is listed by both; the freshest wins
+            current = merged.get(worker['worker_id'])
+            if current is None or worker['last_seen'] > current['last_seen']:
+                merged[worker['worker_id']] = dict(worker, master=result['url'])
+    workers = sorted(merged.values(), key=lambda w: w['worker_id'])
+    next_after = workers[limit - 1]['worker_id'] if len(workers) > limit or (more and len(workers) >= limit) else None
+    masters, partial = summarize(results)
+    return jsonify({'workers': workers[:limit], 'next_after': next_after, 'masters': masters, 'partial': partial})
+
+
+@app.route('/worker/<worker_id>')
+def worker_details(worker_id):
+    # The detail page and its charts are served by the owning master
+    master = federation.owner(worker_id)
+    if not master:
+        return jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404
+    return redirect(f"{master}/worker/{worker_id}")
+
+
+@app.route('/api/workers')
+def get_workers():
+    workers, results = federation.workers()
+    masters, partial = summarize(results)
+    return jsonify({
+        'workers': [dict(data, master=master) for data, master in workers],
+        'masters': masters,
+        'partial': partial,
+    })
+
+
+@app.route('/api/alerts')
+def get_alerts():
+    return merged_list('/api/alerts', 'alerts')
+
+
+@app.route('/api/anomalies')
+def get_anomalies():
+    return merged_list('/api/anomalies', 'anomalies')
+
+
+def merged_list(path, key):
+    results = federation.fan_out('GET', path)
+    items = []
+    for result in results:
+        if result['ok']:
+            items.extend(dict(item, master=result['url']) for item in result['response'].json().get(key, []))
+    masters, partial = summarize(results)
+    return jsonify({key: items, 'masters': masters, 'partial': partial})
+
+
+def worker_reads(worker_id, path, params=None):
+    """GET path from every master that knows worker_id, freshest first.
+
+    Returns (results, response): response is set when there is nothing to merge, i.e. the
+    worker is unknown or only one master answered, and is what the client should get.
+    """
+    masters = federation.holders(worker_id)
+    if not masters:
+        return None, (jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404)
+    results = federation.fan_out('GET', path, masters=masters, params=params)
+    answered = [result for result in results if result['ok']]
+    if len(answered) == 1:
+        return None, proxy(answered[0])
+    if not answered:
+        return None, proxy(next((result for result in results if result['response'] is not None), results[0]))
+    return answered, None
+
+
+@app.route('/api/metrics/history/<worker_id>/<int:gpu_index>')
+def get_metrics_history(worker_id, gpu_index):
+    answered, response = worker_reads(worker_id, f"/api/metrics/history/{worker_id}/{gpu_index}", request.args)
+    if response is not None:
+        return response
+    start_time = datetime.utcnow() - timedelta(hours=request.args.get('hours', 24, type=int))
+    return jsonify(merge_history([result['response'].json() for result in answered], start_time.isoformat()))
+
+
+def merge_history(bodies, start):
+    """Merge history series from several masters by timestamp; a sample both hold is kept once.
+
+    A master with no samples in the window answers with its latest ones instead, so samples
+    before start are dropped unless the window holds none at all.
+    """
+    series = [key for key, value in bodies[0].items() if isinstance(value, list) and key != 'timestamps']
+    samples = {}
+    for body in bodies:
+        for i, timestamp in enumerate(body['timestamps']):
+            if timestamp not in samples:
+                samples[timestamp] = [body[key][i] if key in body else None for key in series]
+    timestamps = sorted(samples)
+    if timestamps and timestamps[-1] >= start:
+        timestamps = [timestamp for timestamp in timestamps if timestamp >= start]
+    merged = {'timestamps': timestamps}
+    for position, key in enumerate(series):
+        merged[key] = [samples[timestamp][position] for timestamp in timestamps]
+    return merged
+
+
+@app.route('/api/processes/<worker_id>')
+def get_process_accounting(worker_id):
+    answered, response = worker_reads(worker_id, f"/api/processes/{worker_id}", request.args)
+    if response is not None:
+        return response
+    bodies = [result['response'].json() for result in answered]
+    processes = {}
+    for body in bodies:
+        for process in body['processes']:
+            key = (process['gpu_index'], process['pid'], process['name'])
+            merged = processes.get(key)
+            if merged is None:
+                processes[key] = dict(process)
+                continue
+            merged['first_seen'] = min(merged['first_seen'], process['first_seen'])
+            merged['last_seen'] = max(merged['last_seen'], process['last_seen'])
+            for total in ('samples', 'gpu_seconds', 'sm_seconds'):
+                merged[total] = round(merged[total] + process[total], 1)
+            if process['max_memory_used'] is not None:
+                merged['max_memory_used'] = max(merged['max_memory_used'] or 0, process['max_memory_used'])
+    return jsonify({'worker_id': worker_id, 'hours': bodies[0]['hours'],
+                    'processes': sorted(processes.values(), key=lambda p: p['sm_seconds'], reverse=True)})
+
+
+def parse_command_cursor(before):
+    """Per-master positions of a merged command page cursor: {master: command ID or None for newest}"""
+    positions = {}
+    for part in before.split(','):
+        index, _, command_id = part.partition(':')
+        if index.isdigit() and int(index) < len(federation.masters):
+            positions[federation.masters[int(index)]] = int(command_id) if command_id.isdigit() else None
+    return positions
+
+
+@app.route('/api/commands/<worker_id>')
+def get_commands(worker_id):
+    # Command IDs are per master, so after a failover the pages of every master that knows the
+    # worker are merged by creation time and next_before holds each master's position
+    masters = federation.holders(worker_id)
+    if not masters:
+        return jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404
+    params = request.args.to_dict()
+    before = params.pop('before', '')
+    if len(masters) == 1 and not before.count(':'):
+        return proxy(federation.call(masters[0], 'GET', f"/api/commands/{worker_id}", params=request.args))
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    params['limit'] = limit
+    if before.isdigit():
+        # A plain command ID, as a master hands out, continues on the current master
+        positions = {masters[0]: int(before)}
+    else:
+        positions = parse_command_cursor(before) if before else dict.fromkeys(masters)
+
+    results = federation.fan_out('GET', f"/api/commands/{worker_id}", masters=list(positions), params=params,
+                                 extra_params={master: {'before': position}
+                                               for master, position in positions.items() if position})
+    pages = {result['url']: result['response'].json() for result in results if result['ok']}
+    commands = sorted((dict(command, master=master) for master, page in pages.items() for command in page['commands']),
+                      key=lambda command: command['created_at'], reverse=True)[:limit]
+
+    cursor = []
+    for result in results:
+        master = result['url']
+        if master not in pages:
+            # A master that did not answer is asked again from the same place; one that no longer knows the worker is not
+            if result['status'] != 404:
+                cursor.append((master, positions[master]))
+            continue
+        shown = [command['id'] for command in commands if command['master'] == master]
+        if len(shown) < len(pages[master]['commands']):
+            cursor.append((master, shown[-1] if shown else positions[master]))
+        elif pages[master]['next_before'] is not None:
+            cursor.append((master, pages[master]['next_before']))
+    next_before = ','.join(f"{federation.masters.index(master)}:{position or ''}" for master, position in cursor)
+    masters_status, partial = summarize(results)
+    return jsonify({'worker_id': worker_id, 'commands': commands, 'next_before': next_before or None,
+                    'masters': masters_status, 'partial': partial})
+
+
+@app.route('/api/command_output/<worker_id>/<int:command_id>')
+def get_command_output(worker_id, command_id):
+    # Command IDs are only unique per master: the worker picks its current master unless
+    # ?master= names the one a listed command came from
+    params = request.args.to_dict()
+    master = params.pop('master', None)
+    if master not in federation.masters:
+        master = federation.owner(worker_id)
+    if not master:
+        return jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404
+    return proxy(federation.call(master, 'GET', f"/command_output/{command_id}", params=params))
+
+
+def submit_commands(worker_ids, command_text):
+    """Queue a command on workers across masters, returning (commands, missing, results)"""
+    groups, missing = federation.group_by_owner(worker_ids)
+    futures = [
+        federation.pool.submit(federation.call, master, 'POST', '/api/submit_command',
+                               json={'worker_ids': ids, 'command': command_text})
+        for master, ids in groups.items()
+    ]
+    wait(futures)
+    results = [future.result() for future in futures]
+    commands = []
+    for result in results:
+        if result['ok']:
+            body = result['response'].json()
+            commands.extend(dict(command, master=result['url']) for command in body.get('commands', []))
+            missing.extend(body.get('missing', []))
+    return commands, missing, results
+
+
+@app.route('/api/submit_command', methods=['POST'])
+def api_submit_command():
+    data = request.get_json(silent=True) or {}
+    worker_ids = data.get('worker_ids') or ([data['worker_id']] if data.get('worker_id') else [])
+    command_text = data.get('command')
+    if not worker_ids or not command_text:
+        return jsonify({'status': 'error', 'message': 'worker_ids and command are required'}), 400
+    commands, missing, results = submit_commands(worker_ids, command_text)
+    masters, partial = summarize(results)
+    return jsonify({'status': 'success', 'commands': commands, 'missing': missing,
+                    'masters': masters, 'partial': partial})
+
+
+@app.route('/submit_command', methods=['POST'])
+def submit_command():
+    if request.form.get('command'):
+        submit_commands([request.form['worker_id']], request.form['command'])
+    return redirect('/')
+
+
+@app.route('/submit_multi_command', methods=['POST'])
+def submit_multi_command():
+    worker_ids = request.form.getlist('worker_ids')
+    if worker_ids and request.form.get('command'):
+        submit_commands(worker_ids, request.form['command'])
+    return redirect('/')
+
+
+@app.route('/delete_worker/<worker_id>', methods=['POST'])
+def delete_worker(worker_id):
+    master = federation.owner(worker_id)
+    if master:
+        federation.call(master, 'POST', f"/delete_worker/{worker_id}")
+    return redirect('/')
+
+
+@app.route('/delete_workers', methods=['POST'])
+def delete_workers():
+    groups, _ = federation.group_by_owner(request.form.getlist('worker_ids'))
+    wait([
+        federation.pool.submit(federation.call, master, 'POST', '/delete_workers', data={'worker_ids': ids})
+        for master, ids in groups.items()
+    ])
+    return redirect('/')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve one dashboard and API over several GPU monitor masters')
+    parser.add_argument('--masters', default=os.environ.get('MASTER_URLS'),
+                        help='Comma separated master URLs (e.g., http://site-a:5000,http://site-b:5000)')
+    parser.add_argument('--timeout', type=float, default=float(os.environ.get('AGGREGATOR_TIMEOUT', 5)),
+                        help='Seconds to wait for the masters on each request')
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('AGGREGATOR_PORT', 5100)),
+                        help='Port to listen on')
+    args = parser.parse_args()
+
+    if not args.masters:
+        parser.error('Master URLs must be provided either via --masters or the MASTER_URLS environment variable')
+
+    global federation
+    federation = Federation(args.masters.split(','), timeout=args.timeout)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
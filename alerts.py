@@ -0,0 +1,367 @@
+"""Streaming alert rules evaluated on every metrics upload.
+
+Each (worker, GPU) series gets a slot in compact per-rule arrays, so evaluating
+a sample is O(rules) with no database access. Offline detection sweeps the
+in-memory last-seen times from a background thread, and alert notifications are
+delivered to sinks (log, file, webhook) from a background queue.
+
+Rules are read from the JSON file named by ALERT_RULES_FILE:
+
+    {
+        "rules": [
+            {"name": "gpu_hot", "type": "threshold", "metric": "temperature", "op": ">", "value": 85, "for": 60},
+            {"name": "temp_climb", "type": "rate", "metric": "temperature", "op": ">", "value": 0.5},
+            {"name": "worker_offline", "type": "offline", "for": 120}
+        ],
+        "sinks": ["log", {"type": "file", "path": "alerts.log"}, {"type": "webhook", "url": "http://..."}]
+    }
+"""
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from array import array
+from datetime import datetime
+
+from fleet_state import to_epoch
+
+logger = logging.getLogger('gpu_master.alerts')
+
+# Per-GPU metrics rules can refer to, in the order they are stored per series
+METRICS = ('temperature', 'utilization', 'memory_utilization', 'power_usage', 'sm_clock', 'fan_speed',
+           'ecc_uncorrected')
+
+OPERATORS = {
+    '>': lambda value, threshold: value > threshold,
+    '>=': lambda value, threshold: value >= threshold,
+    '<': lambda value, threshold: value < threshold,
+    '<=': lambda value, threshold: value <= threshold,
+}
+
+DEFAULT_CONFIG = {
+    "rules": [
+        {"name": "gpu_overheating", "type": "threshold", "metric": "temperature", "op": ">", "value": 85,
+         "for": 60, "severity": "critical"},
+        {"name": "gpu_temperature_spike", "type": "rate", "metric": "temperature", "op": ">", "value": 1.0,
+         "severity": "warning"},
+        {"name": "worker_offline", "type": "offline", "for": 120, "severity": "critical"},
+    ],
+    "sinks": ["log"],
+}
+
+# Samples closer together than this are not used for rate rules
+MIN_RATE_SECONDS = 1.0
+
+# Notifications waiting for delivery; further alerts are dropped when full
+QUEUE_SIZE = 10000
+
+
+def gpu_values(gpu):
+    """Extract the rule metrics from one GPU entry of a metrics upload"""
+    memory = gpu.get('memory') or {}
+    memory_utilization = None
+    if memory.get('total'):
+        memory_utilization = (memory.get('used') or 0) / memory['total'] * 100
+    return (gpu.get('temp'), gpu.get('util'), memory_utilization, gpu.get('power_usage'),
+            (gpu.get('clocks') or {}).get('sm'), gpu.get('fan'), (gpu.get('ecc') or {}).get('uncorrected'))
+
+
+class Rule:
+    """One alert rule with its per-series state held in flat arrays"""
+
+    def __init__(self, config):
+        self.name = config['name']
+        self.type = config.get('type', 'threshold')
+        self.severity = config.get('severity', 'warning')
+        self.for_seconds = float(config.get('for', 0))
+        if self.type not in ('threshold', 'rate', 'offline'):
+            raise ValueError(f"Unknown rule type '{self.type}' in rule '{self.name}'")
+        if self.type != 'offline':
+            self.metric = config['metric']
+            if self.metric not in METRICS:
+                raise ValueError(f"Unknown metric '{self.metric}' in rule '{self.name}'")
+            self.metric_index = METRICS.index(self.metric)
+            self.op = config.get('op', '>')
+            self.compare = OPERATORS[self.op]
+            self.threshold = float(config['value'])
+        # since[slot]: when the condition first held (0 = not holding); firing[slot]: 1 while firing
+        self.since = array('d')
+        self.firing = bytearray()
+
+    def grow(self, capacity):
+        self.since.extend([0.0] * (capacity - len(self.since)))
+        self.firing.extend(bytes(capacity - len(self.firing)))
+
+    def reset(self, slot):
+        self.since[slot] = 0.0
+        self.firing[slot] = 0
+
+
+class LogSink:
+    def send(self, alert):
+        level = logging.WARNING if alert['state'] == 'firing' else logging.INFO
+        logger.log(level, "Alert %s %s: %s", alert['rule'], alert['state'], alert['message'])
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(alert) + "\n")
+
+
+class WebhookSink:
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert):
+        import requests
+        requests.post(self.url, json=alert, timeout=self.timeout)
+
+
+def build_sink(config):
+    if config == 'log' or (isinstance(config, dict) and config.get('type') == 'log'):
+        return LogSink()
+    if isinstance(config, dict) and config.get('type') == 'file':
+        return FileSink(config['path'])
+    if isinstance(config, dict) and config.get('type') == 'webhook':
+        return WebhookSink(config['url'], config.get('timeout', 5))
+    raise ValueError(f"Unknown alert sink: {config}")
+
+
+def load_config(path=None):
+    """Load the rules file, falling back to the built-in defaults"""
+    path = path or os.environ.get('ALERT_RULES_FILE')
+    if not path:
+        return DEFAULT_CONFIG
+    with open(path) as f:
+        return json.load(f)
+
+
+class AlertEngine:
+    """Incrementally evaluates alert rules and dispatches notifications"""
+
+    def __init__(self, config=None):
+        config = config or DEFAULT_CONFIG
+        rules = [Rule(rule) for rule in config.get('rules', [])]
+        self.series_rules = [rule for rule in rules if rule.type != 'offline']
+        self.offline_rules = [rule for rule in rules if rule.type == 'offline']
+        self.sinks = [build_sink(sink) for sink in config.get('sinks', ['log'])]
+
+        self.lock = threading.Lock()
+        # (worker_id, gpu_index) -> series slot, plus the previous sample for rate rules
+        self.series_slots = {}
+        self.free_series = []
+        self.last_time = array('d')
+        self.last_values = array('d')
+        # worker_id -> worker slot, with the worker's last-seen time
+        self.worker_slots = {}
+        self.free_workers = []
+        self.last_seen = array('d')
+        # (rule, worker_id, gpu_index) -> alert, for everything currently firing
+        self.active = {}
+
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.started = False
+        self.stopped = threading.Event()
+
+    def start(self, last_seen=None):
+        """Start the delivery and offline-sweep threads, seeding known workers.
+
+        Workers that were already offline for longer than a rule allows are listed as firing
+        without a notification, so a master restart does not announce every long-dead worker again.
+        """
+        now = time.time()
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            for worker_id, seen in (last_seen or {}).items():
+                slot = self.worker_slot(worker_id)
+                self.last_seen[slot] = seen
+                for rule in self.offline_rules:
+                    if now - seen >= rule.for_seconds:
+                        rule.firing[slot] = 1
+                        self.fire(rule, worker_id, None, now - seen, seen, now)
+        threading.Thread(target=self.deliver, daemon=True).start()
+        if self.offline_rules:
+            threading.Thread(target=self.sweep_offline, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def series_slot(self, key):
+        slot = self.series_slots.get(key)
+        if slot is None:
+            if self.free_series:
+                slot = self.free_series.pop()
+            else:
+                slot = len(self.last_time)
+                self.last_time.append(0.0)
+                self.last_values.extend([float('nan')] * len(METRICS))
+                for rule in self.series_rules:
+                    rule.grow(slot + 1)
+            self.series_slots[key] = slot
+        return slot
+
+    def worker_slot(self, worker_id):
+        slot = self.worker_slots.get(worker_id)
+        if slot is None:
+            if self.free_workers:
+                slot = self.free_workers.pop()
+            else:
+                slot = len(self.last_seen)
+                self.last_seen.append(0.0)
+                for rule in self.offline_rules:
+                    rule.grow(slot + 1)
+            self.worker_slots[worker_id] = slot
+        return slot
+
+    def evaluate(self, worker_id, timestamp, gpus):
+        """Evaluate every series rule against one metrics upload"""
+        now = to_epoch(timestamp) if isinstance(timestamp, datetime) else timestamp
+        events = []
+        with self.lock:
+            worker_slot = self.worker_slot(worker_id)
+            self.last_seen[worker_slot] = now
+            for rule in self.offline_rules:
+                rule.since[worker_slot] = 0.0
+                if rule.firing[worker_slot]:
+                    rule.firing[worker_slot] = 0
+                    events.append(self.resolve(rule, worker_id, None, now))
+
+            for gpu_index, gpu in enumerate(gpus or []):
+                slot = self.series_slot((worker_id, gpu_index))
+                values = gpu_values(gpu)
+                previous_time = self.last_time[slot]
+                base = slot * len(METRICS)
+
+                for rule in self.series_rules:
+                    value = values[rule.metric_index]
+                    if value is None:
+                        continue
+                    if rule.type == 'rate':
+                        previous = self.last_values[base + rule.metric_index]
+                        # Skip until there is a previous sample far enough back for a stable rate
+                        if previous != previous or now - previous_time < MIN_RATE_SECONDS:
+                            continue
+                        value = (value - previous) / (now - previous_time)
+
+                    if rule.compare(value, rule.threshold):
+                        if rule.since[slot] == 0.0:
+                            rule.since[slot] = now
+                        if not rule.firing[slot] and now - rule.since[slot] >= rule.for_seconds:
+                            rule.firing[slot] = 1
+                            events.append(self.fire(rule, worker_id, gpu_index, value, rule.since[slot], now))
+                    else:
+                        rule.since[slot] = 0.0
+                        if rule.firing[slot]:
+                            rule.firing[slot] = 0
+                            events.append(self.resolve(rule, worker_id, gpu_index, now, value))
+
+                self.last_time[slot] = now
+                for i, value in enumerate(values):
+                    self.last_values[base + i] = float('nan') if value is None else float(value)
+
+        for event in events:
+            self.enqueue(event)
+
+    def sweep_offline(self):
+        """Periodically fire offline alerts for workers that stopped reporting"""
+        interval = max(1.0, min(30.0, min(rule.for_seconds for rule in self.offline_rules) / 4))
+        while not self.stopped.wait(interval):
+            now = time.time()
+            events = []
+            with self.lock:
+                for worker_id, slot in self.worker_slots.items():
+                    silent_for = now - self.last_seen[slot]
+                    for rule in self.offline_rules:
+                        if silent_for >= rule.for_seconds and not rule.firing[slot]:
+                            rule.firing[slot] = 1
+                            events.append(self.fire(rule, worker_id, None, silent_for, self.last_seen[slot], now))
+            for event in events:
+                self.enqueue(event)
+
+    def fire(self, rule, worker_id, gpu_index, value, since, now):
+        if rule.type == 'offline':
+            message = f"Worker {worker_id} has not reported for {value:.0f}s"
+        else:
+            kind = f"{rule.metric} rate" if rule.type == 'rate' else rule.metric
+            message = (f"Worker {worker_id} GPU {gpu_index} {kind} is {value:.2f} "
+                       f"({rule.op} {rule.threshold:g})")
+        alert = {
+            'rule': rule.name,
+            'severity': rule.severity,
+            'state': 'firing',
+            'worker_id': worker_id,
+            'gpu_index': gpu_index,
+            'value': round(value, 3),
+            'since': datetime.utcfromtimestamp(since).isoformat(),
+            'timestamp': datetime.utcfromtimestamp(now).isoformat(),
+            'message': message,
+        }
+        self.active[(rule.name, worker_id, gpu_index)] = alert
+        return alert
+
+    def resolve(self, rule, worker_id, gpu_index, now, value=None):
+        alert = dict(self.active.pop((rule.name, worker_id, gpu_index), None) or {
+            'rule': rule.name, 'severity': rule.severity, 'worker_id': worker_id, 'gpu_index': gpu_index,
+        })
+        alert.update({
+            'state': 'resolved',
+            'timestamp': datetime.utcfromtimestamp(now).isoformat(),
+            'message': f"{rule.name} resolved for worker {worker_id}" +
+                       (f" GPU {gpu_index}" if gpu_index is not None else ""),
+        })
+        if value is not None:
+            alert['value'] = round(value, 3)
+        return alert
+
+    def enqueue(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            logger.warning("Alert queue full, dropping %s for %s", alert['rule'], alert['worker_id'])
+
+    def deliver(self):
+        """Send queued notifications to every sink"""
+        while not self.stopped.is_set():
+            try:
+                alert = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            for sink in self.sinks:
+                try:
+                    sink.send(alert)
+                except Exception:
+                    logger.exception("Failed to deliver alert %s via %s", alert['rule'], type(sink).__name__)
+
+    def active_alerts(self):
+        """Return the currently firing alerts"""
+        with self.lock:
+            return sorted(self.active.values(), key=lambda alert: alert['since'])
+
+    def forget(self, worker_id):
+        """Release a deleted worker's slots and drop its alerts"""
+        with self.lock:
+            for key in [key for key in self.series_slots if key[0] == worker_id]:
+                slot = self.series_slots.pop(key)
+                self.last_time[slot] = 0.0
+                for i in range(len(METRICS)):
+                    self.last_values[slot * len(METRICS) + i] = float('nan')
+                for rule in self.series_rules:
+                    rule.reset(slot)
+                self.free_series.append(slot)
+            slot = self.worker_slots.pop(worker_id, None)
+            if slot is not None:
+                self.last_seen[slot] = 0.0
+                for rule in self.offline_rules:
+                    rule.reset(slot)
+                self.free_workers.append(slot)
+            for key in [key for key in self.active if key[1] == worker_id]:
+                del self.active[key]
@@ -0,0 +1,244 @@
+"""Fleet-wide aggregates over GPU metrics history computed with NumPy.
+
+A query loads the requested window from gpu_metrics_history once into columnar
+arrays and computes group-by aggregates, percentiles, top-k GPUs and optional
+time buckets in vectorized passes. Results are cached per query.
+
+Workers with adaptive sampling report idle GPUs less often than busy ones, so
+means and percentiles are weighted by the time each sample stands for rather
+than counting samples.
+"""
+import time
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, func
+
+# Metrics that can be aggregated, mapped to the history column they come from
+METRICS = ('temperature', 'utilization', 'memory_utilization', 'power_usage', 'sm_clock', 'fan_speed',
+           'pcie_tx', 'pcie_rx', 'nvlink_tx', 'nvlink_rx')
+GROUP_BY = ('model', 'worker', 'gpu')
+PERCENTILES = (50, 95, 99)
+
+# Rows fetched from the database per batch while loading a window
+LOAD_BATCH_SIZE = 50000
+
+# Weight of samples stored without a sample interval (the worker's default interval)
+DEFAULT_SAMPLE_INTERVAL = 5.0
+
+
+def epoch_seconds(db, column):
+    """SQL expression for a timestamp column in seconds since the epoch"""
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(column) - 2440587.5) * 86400.0
+    return func.extract('epoch', column)
+
+
+class FleetAnalytics:
+    """Vectorized aggregate queries with a small TTL result cache"""
+
+    def __init__(self, db, Worker, GPUMetricsHistory, cache_seconds=60):
+        self.db = db
+        self.Worker = Worker
+        self.GPUMetricsHistory = GPUMetricsHistory
+        self.cache_seconds = cache_seconds
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def metric_column(self, metric):
+        history = self.GPUMetricsHistory
+        if metric == 'memory_utilization':
+            return history.memory_used * 100.0 / func.nullif(history.memory_total, 0)
+        return getattr(history, metric)
+
+    def load_window(self, metric, start_time):
+        """Load (worker, gpu, timestamp, value, weight) columns for the window as arrays"""
+        history = self.GPUMetricsHistory
+        stmt = select(
+            history.worker_id,
+            history.gpu_index,
+            epoch_seconds(self.db, history.timestamp),
+            self.metric_column(metric),
+            func.coalesce(history.sample_interval, DEFAULT_SAMPLE_INTERVAL)
+        ).where(history.timestamp >= start_time)
+
+        # Row objects are slow to convert to arrays, so read plain tuples from
+        # the DB-API cursor; every bound value here is generated server-side
+        sql = str(stmt.compile(dialect=self.db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        cursor = self.db.session.connection().connection.cursor()
+        chunks = []
+        try:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.float64))
+        finally:
+            cursor.close()
+        if not chunks:
+            return np.empty((0, 5))
+        data = np.concatenate(chunks)
+        # Drop samples where the metric was not reported
+        return data[~np.isnan(data[:, 3])]
+
+    def series_labels(self):
+        """Map worker database ids to (worker_id, [gpu models])"""
+        labels = {}
+        for worker in self.Worker.query.filter(self.Worker.deleted_at.is_(None)):
+            metrics = worker.get_metrics_json() or {}
+            labels[worker.id] = (worker.worker_id, [gpu.get('model', 'unknown') for gpu in metrics.get('gpus', [])])
+        return labels
+
+    def query(self, hours=6, metric='utilization', group_by='model', granularity=None, top=20, order='desc'):
+        """Run an aggregate query, serving repeated queries from the cache"""
+        key = (hours, metric, group_by, granularity, top, order)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        result = self.compute(hours, metric, group_by, granularity, top, order)
+        with self.lock:
+            # Drop expired entries so the cache cannot grow without bound
+            self.cache = {k: v for k, v in self.cache.items() if v[0] > now}
+            self.cache[key] = (now + self.cache_seconds, result)
+        return result
+
+    def compute(self, hours, metric, group_by, granularity, top, order):
+        end_time = datetime.utcnow()
+        start_time = end_time - timedelta(hours=hours)
+        data = self.load_window(metric, start_time)
+        labels = self.series_labels()
+        # Samples of deleted workers still waiting to be purged are left out
+        data = data[np.isin(data[:, 0], list(labels))]
+
+        result = {
+            'metric': metric,
+            'group_by': group_by,
+            'hours': hours,
+            'start': start_time.isoformat(),
+            'end': end_time.isoformat(),
+            'samples': int(len(data)),
+            'groups': [],
+            'top': [],
+        }
+        if len(data) == 0:
+            return result
+
+        worker_ids = data[:, 0].astype(np.int64)
+        gpu_indexes = data[:, 1].astype(np.int64)
+        timestamps = data[:, 2]
+        values = data[:, 3]
+        weights = data[:, 4]
+        weighted = values * weights
+
+        # One code per (worker, gpu) series; rows point at their series
+        series_keys, series_of_row = np.unique(worker_ids * 4096 + gpu_indexes, return_inverse=True)
+        series_workers = series_keys // 4096
+        series_gpus = series_keys % 4096
+
+        def series_model(i):
+            _, models = labels.get(int(series_workers[i]), (None, []))
+            gpu = int(series_gpus[i])
+            return models[gpu] if gpu < len(models) else 'unknown'
+
+        def series_worker(i):
+            return labels.get(int(series_workers[i]), (str(int(series_workers[i])), []))[0]
+
+        def series_group(i):
+            if group_by == 'model':
+                return series_model(i)
+            if group_by == 'worker':
+                return series_worker(i)
+            return f"{series_worker(i)}/{int(series_gpus[i])}"
+
+        # Collapse series into groups, then rows into groups
+        group_names, group_of_series = np.unique(
+            np.array([series_group(i) for i in range(len(series_keys))], dtype=str),
+            return_inverse=True
+        )
+        group_of_row = group_of_series[series_of_row]
+        group_count = len(group_names)
+
+        counts = np.bincount(group_of_row, minlength=group_count)
+        seconds = np.bincount(group_of_row, weights=weights, minlength=group_count)
+        sums = np.bincount(group_of_row, weights=weighted, minlength=group_count)
+        minimums = np.full(group_count, np.inf)
+        maximums = np.full(group_count, -np.inf)
+        np.minimum.at(minimums, group_of_row, values)
+        np.maximum.at(maximums, group_of_row, values)
+
+        # Time-weighted percentiles: sort by (group, value) once, then find where each
+        # group's running weight crosses the percentile of its total
+        order_idx = np.lexsort((values, group_of_row))
+        sorted_values = values[order_idx]
+        cumulative = np.cumsum(weights[order_idx])
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        weight_before = np.concatenate(([0.0], cumulative))[starts]
+        percentiles = {}
+        for pct in PERCENTILES:
+            positions = np.searchsorted(cumulative, weight_before + seconds * pct / 100.0, side='left')
+            percentiles[pct] = sorted_values[np.clip(positions, starts, ends - 1)]
+
+        series_per_group = np.bincount(group_of_series, minlength=group_count)
+        for g in range(group_count):
+            group = {
+                'name': str(group_names[g]),
+                'gpus': int(series_per_group[g]),
+                'samples': int(counts[g]),
+                'seconds': round(float(seconds[g]), 1),
+                'mean': round(float(sums[g] / seconds[g]), 3),
+                'min': round(float(minimums[g]), 3),
+                'max': round(float(maximums[g]), 3),
+            }
+            for pct in PERCENTILES:
+                group[f'p{pct}'] = round(float(percentiles[pct][g]), 3)
+            result['groups'].append(group)
+        result['groups'].sort(key=lambda group: group['mean'], reverse=True)
+
+        # Top-k GPUs by their mean over the window
+        series_count = len(series_keys)
+        series_means = (np.bincount(series_of_row, weights=weighted, minlength=series_count) /
+                        np.bincount(series_of_row, weights=weights, minlength=series_count))
+        series_max = np.full(series_count, -np.inf)
+        np.maximum.at(series_max, series_of_row, values)
+        ranking = -series_means if order == 'desc' else series_means
+        k = min(top, series_count)
+        if k > 0:
+            best = np.argpartition(ranking, k - 1)[:k]
+            best = best[np.argsort(ranking[best])]
+            for i in best:
+                result['top'].append({
+                    'worker_id': series_worker(i),
+                    'gpu_index': int(series_gpus[i]),
+                    'model': series_model(i),
+                    'mean': round(float(series_means[i]), 3),
+                    'max': round(float(series_max[i]), 3),
+                })
+
+        # Optional per-group time series in fixed-width buckets
+        if granularity:
+            bucket_count = int(np.ceil(hours * 3600 / granularity)) or 1
+            window_start = (start_time - datetime(1970, 1, 1)).total_seconds()
+            buckets = np.clip(((timestamps - window_start) // granularity).astype(np.int64), 0, bucket_count - 1)
+            cell = group_of_row * bucket_count + buckets
+            cell_seconds = np.bincount(cell, weights=weights,
+                                       minlength=group_count * bucket_count).reshape(group_count, bucket_count)
+            cell_sums = np.bincount(cell, weights=weighted,
+                                    minlength=group_count * bucket_count).reshape(group_count, bucket_count)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cell_means = cell_sums / cell_seconds
+            result['granularity'] = granularity
+            result['buckets'] = [
+                (start_time + timedelta(seconds=b * granularity)).isoformat() for b in range(bucket_count)
+            ]
+            result['series'] = {
+                str(group_names[g]): [None if np.isnan(v) else round(float(v), 3) for v in cell_means[g]]
+                for g in range(group_count)
+            }
+
+        return result
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Online anomaly detection over per-GPU metric series.
+
+Two detectors run incrementally on every metrics upload:
+
+- EWMA z-score: each (worker, GPU, metric) series keeps an exponentially
+  weighted mean and variance, and a sample far outside it is anomalous.
+- Peer comparison: a GPU's temperature is compared with GPUs of the same model
+  on the same worker running at a similar utilization; a smoothed excess above
+  its peers (e.g. 8 degrees hotter at the same load) is anomalous.
+
+State per series is a fixed number of floats in flat arrays, so memory is
+bounded by the number of GPUs. Run this file directly to replay stored history
+through the detector:
+
+    python anomaly.py --days 30
+"""
+import sys
+import math
+import time
+import argparse
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+from fleet_state import to_epoch
+
+# Metrics tracked per series, with the smallest standard deviation assumed for
+# each so that a perfectly flat series does not turn tiny changes into huge z-scores
+METRICS = ('temperature', 'utilization', 'memory_utilization', 'power_usage')
+MIN_STD = (1.0, 5.0, 2.0, 5.0)
+
+# An anomaly only clears once its score falls below this fraction of the threshold,
+# so a series hovering around the threshold does not flap
+CLEAR_RATIO = 0.8
+
+# GPUs whose utilization differs by at most this many points count as peers
+PEER_UTILIZATION_BAND = 15.0
+
+
+class AnomalyDetector:
+    """EWMA z-score and peer-comparison detector with bounded per-series state"""
+
+    def __init__(self, span=60, z_threshold=4.0, warmup=30, peer_threshold=5.0, peer_span=30):
+        self.alpha = 2.0 / (span + 1)
+        self.peer_alpha = 2.0 / (peer_span + 1)
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.peer_threshold = peer_threshold
+
+        self.lock = threading.Lock()
+        # (worker_id, gpu_index) -> slot; per-metric state lives at slot * len(METRICS) + metric
+        self.slots = {}
+        self.free_slots = []
+        self.count = array('l')
+        self.mean = array('d')
+        self.var = array('d')
+        self.peer_excess = array('d')
+        self.peer_count = array('l')
+        # (worker_id, gpu_index, kind, metric) -> anomaly, for everything currently anomalous
+        self.active = {}
+
+    def slot(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = len(self.peer_excess)
+                self.count.extend([0] * len(METRICS))
+                self.mean.extend([0.0] * len(METRICS))
+                self.var.extend([0.0] * len(METRICS))
+                self.peer_excess.append(0.0)
+                self.peer_count.append(0)
+            self.slots[key] = slot
+        return slot
+
+    def observe(self, worker_id, timestamp, gpus):
+        """Feed one upload of a worker's GPUs, returning newly detected anomalies"""
+        now = to_epoch(timestamp) if isinstance(timestamp, datetime) else timestamp
+        samples = []
+        for gpu_index, gpu in enumerate(gpus or []):
+            memory = gpu.get('memory') or {}
+            memory_utilization = None
+            if memory.get('total'):
+                memory_utilization = (memory.get('used') or 0) / memory['total'] * 100
+            samples.append((gpu_index, gpu.get('model'),
+                            (gpu.get('temp'), gpu.get('util'), memory_utilization, gpu.get('power_usage'))))
+        return self.observe_samples(worker_id, now, samples)
+
+    def observe_samples(self, worker_id, now, samples):
+        """Feed (gpu_index, model, metric values) tuples taken at the same time"""
+        onsets = []
+        metric_count = len(METRICS)
+        with self.lock:
+            slots = [self.slot((worker_id, gpu_index)) for gpu_index, _, _ in samples]
+
+            # EWMA z-score per metric; score against the state before updating it
+            for (gpu_index, _, values), slot in zip(samples, slots):
+                base = slot * metric_count
+                for m in range(metric_count):
+                    value = values[m]
+                    if value is None:
+                        continue
+                    i = base + m
+                    if self.count[i] >= self.warmup:
+                        std = max(math.sqrt(self.var[i]), MIN_STD[m])
+                        z = (value - self.mean[i]) / std
+                        self.track(onsets, abs(z) > self.z_threshold, abs(z) < self.z_threshold * CLEAR_RATIO,
+                                   worker_id, gpu_index, 'zscore', METRICS[m], now, value,
+                                   {'z': round(z, 2), 'expected': round(self.mean[i], 2)})
+                    diff = value - self.mean[i]
+                    if self.count[i] == 0:
+                        self.mean[i] = value
+                    else:
+                        increment = self.alpha * diff
+                        self.mean[i] += increment
+                        self.var[i] = (1 - self.alpha) * (self.var[i] + diff * increment)
+                    self.count[i] += 1
+
+            # Peer comparison of temperature among same-model GPUs at similar load
+            for (gpu_index, model, values), slot in zip(samples, slots):
+                temp, util = values[0], values[1]
+                if temp is None or util is None:
+                    continue
+                peer_temps = [
+                    other[0] for other_index, other_model, other in samples
+                    if other_index != gpu_index and other_model == model
+                    and other[0] is not None and other[1] is not None
+                    and abs(other[1] - util) <= PEER_UTILIZATION_BAND
+                ]
+                if not peer_temps:
+                    continue
+                excess = temp - sum(peer_temps) / len(peer_temps)
+                if self.peer_count[slot] == 0:
+                    self.peer_excess[slot] = excess
+                else:
+                    self.peer_excess[slot] += self.peer_alpha * (excess - self.peer_excess[slot])
+                self.peer_count[slot] += 1
+                if self.peer_count[slot] >= self.warmup:
+                    excess = self.peer_excess[slot]
+                    self.track(onsets, excess > self.peer_threshold, excess < self.peer_threshold * CLEAR_RATIO,
+                               worker_id, gpu_index, 'peer', 'temperature', now, temp,
+                               {'excess': round(self.peer_excess[slot], 2), 'peers': len(peer_temps)})
+        return onsets
+
+    def track(self, onsets, anomalous, cleared, worker_id, gpu_index, kind, metric, now, value, details):
+        key = (worker_id, gpu_index, kind, metric)
+        current = self.active.get(key)
+        if cleared:
+            if current is not None:
+                del self.active[key]
+        elif anomalous or current is not None:
+            is_new = current is None
+            if is_new:
+                current = {
+                    'worker_id': worker_id,
+                    'gpu_index': gpu_index,
+                    'kind': kind,
+                    'metric': metric,
+                    'since': datetime.utcfromtimestamp(now).isoformat(),
+                }
+                self.active[key] = current
+            current['value'] = round(float(value), 2)
+            current['last_seen'] = datetime.utcfromtimestamp(now).isoformat()
+            current.update(details)
+            if is_new:
+                onsets.append(dict(current))
+
+    def current_anomalies(self):
+        """Return the anomalies that are currently ongoing"""
+        with self.lock:
+            return sorted((dict(anomaly) for anomaly in self.active.values()), key=lambda a: a['since'])
+
+    def forget(self, worker_id):
+        """Release a deleted worker's series"""
+        with self.lock:
+            for key in [key for key in self.slots if key[0] == worker_id]:
+                slot = self.slots.pop(key)
+                for i in range(slot * len(METRICS), (slot + 1) * len(METRICS)):
+                    self.count[i] = 0
+                    self.mean[i] = 0.0
+                    self.var[i] = 0.0
+                self.peer_excess[slot] = 0.0
+                self.peer_count[slot] = 0
+                self.free_slots.append(slot)
+            for key in [key for key in self.active if key[0] == worker_id]:
+                del self.active[key]
+
+
+def replay(db, Worker, GPUMetricsHistory, detector, start_time, worker_id=None, batch_size=50000):
+    """Run stored history through the detector in timestamp order, returning all onsets"""
+    from sqlalchemy import select, func
+    from analytics import epoch_seconds
+
+    workers = Worker.query.filter_by(worker_id=worker_id).all() if worker_id else Worker.query.all()
+    names = {}
+    models = {}
+    for worker in workers:
+        names[worker.id] = worker.worker_id
+        metrics = worker.get_metrics_json() or {}
+        models[worker.id] = [gpu.get('model') for gpu in metrics.get('gpus', [])]
+
+    history = GPUMetricsHistory
+    stmt = select(
+        history.worker_id, history.gpu_index, epoch_seconds(db, history.timestamp), history.temperature, history.utilization,
+        history.memory_used * 100.0 / func.nullif(history.memory_total, 0), history.power_usage
+    ).where(history.timestamp >= start_time).order_by(history.timestamp, history.worker_id, history.gpu_index)
+    if worker_id:
+        stmt = stmt.where(history.worker_id.in_(list(names)))
+
+    # Plain DB-API tuples are much cheaper than ORM rows for a month of history
+    sql = str(stmt.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    cursor = db.session.connection().connection.cursor()
+    onsets = []
+    rows_seen = 0
+    group_key = None
+    group = []
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            rows_seen += len(rows)
+            for row in rows:
+                key = (row[0], row[2])
+                if key != group_key:
+                    if group:
+                        onsets.extend(detector.observe_samples(names.get(group_key[0]), group_key[1], group))
+                    group_key = key
+                    group = []
+                gpu_models = models.get(row[0], [])
+                model = gpu_models[row[1]] if row[1] < len(gpu_models) else None
+                group.append((row[1], model, row[3:7]))
+        if group:
+            onsets.extend(detector.observe_samples(names.get(group_key[0]), group_key[1], group))
+    finally:
+        cursor.close()
+    return onsets, rows_seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay stored GPU metrics history through the anomaly detector')
+    parser.add_argument('--days', type=float, default=30, help='How far back to replay')
+    parser.add_argument('--worker-id', help='Only replay this worker')
+    parser.add_argument('--span', type=int, default=60, help='EWMA span in samples')
+    parser.add_argument('--z-threshold', type=float, default=4.0, help='Z-score that counts as anomalous')
+    parser.add_argument('--peer-threshold', type=float, default=5.0,
+                        help='Degrees above same-model peers that count as anomalous')
+    parser.add_argument('--warmup', type=int, default=30, help='Samples per series before scoring')
+    args = parser.parse_args()
+
+    from master import app, db, Worker, GPUMetricsHistory
+
+    detector = AnomalyDetector(span=args.span, z_threshold=args.z_threshold, warmup=args.warmup,
+                               peer_threshold=args.peer_threshold)
+    start_time = datetime.utcnow() - timedelta(days=args.days)
+    started = time.perf_counter()
+    with app.app_context():
+        onsets, rows = replay(db, Worker, GPUMetricsHistory, detector, start_time, args.worker_id)
+    elapsed = time.perf_counter() - started
+
+    for onset in onsets:
+        details = f"z={onset['z']}" if onset['kind'] == 'zscore' else f"+{onset['excess']} vs peers"
+        print(f"{onset['since']}  {onset['worker_id']} GPU {onset['gpu_index']}  "
+              f"{onset['kind']} {onset['metric']}={onset['value']} ({details})")
+    print(f"Replayed {rows} samples in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} samples/s), "
+          f"{len(onsets)} anomalies detected", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""Cold archive of old GPU metrics history in compressed segment files.
+
+Whole days of history older than a threshold are moved out of the database into
+one segment file per day per worker:
+
+    archive/
+        index.json               {"version": 1, "archived_until": ..., "days": [...]}
+        2024-01-01/index.json    worker_id -> segment file and per-GPU block offsets
+        2024-01-01/17.seg        one zlib-compressed block per GPU
+
+A GPU block holds its timestamps as delta-encoded int64 microseconds followed by
+one float32 column per metric and the sample interval (NaN where the value was
+not reported); the worker's entry in the day index lists the columns. Readers
+memory-map a segment and decompress only the blocks of the GPUs they need.
+
+Run this file directly (e.g. daily from cron) to archive everything older than
+N days:
+
+    python archive.py --older-than 30
+"""
+import os
+import sys
+import json
+import mmap
+import zlib
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, func, text
+
+INDEX_VERSION = 1
+COLUMNS = ('temperature', 'utilization', 'memory_used', 'memory_total', 'power_usage', 'sample_interval',
+           'sm_clock', 'memory_clock', 'fan_speed', 'throttle_reasons', 'ecc_corrected', 'ecc_uncorrected',
+           'pcie_tx', 'pcie_rx', 'nvlink_tx', 'nvlink_rx')
+# Columns of segments written before the index recorded them
+LEGACY_COLUMNS = COLUMNS[:5]
+
+# Workers loaded from the database per pass over a day of history
+WORKER_BATCH_SIZE = 50
+LOAD_BATCH_SIZE = 50000
+COMPRESSION_LEVEL = 6
+
+
+def day_start(value):
+    return datetime(value.year, value.month, value.day)
+
+
+def later(boundary, value):
+    """Move an archived_until boundary forward, never back"""
+    if boundary and datetime.fromisoformat(boundary) >= value:
+        return boundary
+    return value.isoformat()
+
+
+def read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(path, data):
+    """Replace a JSON file atomically so readers never see a partial index"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def encode_block(timestamps, values):
+    """Compress one GPU's (timestamps in us, metric columns) into a block"""
+    deltas = np.diff(timestamps, prepend=np.int64(0)).astype('<i8')
+    payload = deltas.tobytes() + np.ascontiguousarray(values, dtype='<f4').tobytes()
+    return zlib.compress(payload, COMPRESSION_LEVEL)
+
+
+def decode_block(block, rows, columns=COLUMNS):
+    """Decompress a block, returning its values laid out as COLUMNS"""
+    data = zlib.decompress(block)
+    timestamps = np.cumsum(np.frombuffer(data, dtype='<i8', count=rows))
+    values = np.frombuffer(data, dtype='<f4', offset=rows * 8).reshape(len(columns), rows)
+    if tuple(columns) != COLUMNS:
+        # Older segments lack newer columns; those read as not reported
+        padded = np.full((len(COLUMNS), rows), np.nan, dtype=np.float32)
+        for i, name in enumerate(columns):
+            if name in COLUMNS:
+                padded[COLUMNS.index(name)] = values[i]
+        values = padded
+    return timestamps, values
+
+
+def read_segment_blocks(path, gpus, columns=COLUMNS):
+    """Decode every GPU block of a segment into {gpu_index: (timestamps, values)}"""
+    blocks = {}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for gpu, (offset, length, rows, _, _) in gpus.items():
+            blocks[int(gpu)] = decode_block(mm[offset:offset + length], rows, columns)
+    return blocks
+
+
+def write_segment(path, blocks):
+    """Write {gpu_index: (timestamps, values)} as a segment, returning its block index"""
+    gpus = {}
+    offset = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for gpu in sorted(blocks):
+            timestamps, values = blocks[gpu]
+            block = encode_block(timestamps, values)
+            f.write(block)
+            gpus[str(gpu)] = [offset, len(block), int(len(timestamps)), int(timestamps[0]), int(timestamps[-1])]
+            offset += len(block)
+    os.replace(tmp_path, path)
+    return gpus
+
+
+def merge_blocks(existing, new):
+    """Merge two sets of GPU blocks, dropping samples already archived"""
+    for gpu, (timestamps, values) in existing.items():
+        if gpu not in new:
+            new[gpu] = (timestamps, values)
+            continue
+        merged_timestamps = np.concatenate((timestamps, new[gpu][0]))
+        merged_values = np.concatenate((values, new[gpu][1]), axis=1)
+        merged_timestamps, first = np.unique(merged_timestamps, return_index=True)
+        new[gpu] = (merged_timestamps, merged_values[:, first])
+    return new
+
+
+def load_day(db, GPUMetricsHistory, worker_ids, start, end):
+    """Load a day of history for some workers as {worker db id: {gpu_index: (timestamps, values)}}"""
+    history = GPUMetricsHistory
+    stmt = select(
+        history.worker_id, history.gpu_index, history.timestamp, *(getattr(history, c) for c in COLUMNS)
+    ).where(history.timestamp >= start, history.timestamp < end, history.worker_id.in_(worker_ids))
+
+    # Plain DB-API tuples, as in analytics; every bound value is generated here
+    sql = str(stmt.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    cursor = db.session.connection().connection.cursor()
+    chunks = []
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            # Convert each batch to typed columns right away so the tuples can be freed
+            columns = list(zip(*rows))
+            chunks.append((
+                np.array(columns[0], dtype=np.int64),
+                np.array(columns[1], dtype=np.int64),
+                np.array(columns[2], dtype='datetime64[us]').astype(np.int64),
+                np.array(columns[3:], dtype=np.float32),
+            ))
+    finally:
+        cursor.close()
+    if not chunks:
+        return {}
+
+    workers, gpus, timestamps = (np.concatenate([chunk[i] for chunk in chunks]) for i in range(3))
+    values = np.concatenate([chunk[3] for chunk in chunks], axis=1)
+    chunks = None
+
+    order = np.lexsort((timestamps, gpus, workers))
+    workers, gpus, timestamps, values = workers[order], gpus[order], timestamps[order], values[:, order]
+    # Runs of equal (worker, gpu) are one block each
+    boundaries = np.flatnonzero((np.diff(workers) != 0) | (np.diff(gpus) != 0)) + 1
+    result = {}
+    for lo, hi in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(order)]))):
+        result.setdefault(int(workers[lo]), {})[int(gpus[lo])] = (timestamps[lo:hi], values[:, lo:hi])
+    return result
+
+
+def archive_history(db, Worker, GPUMetricsHistory, archive_dir, older_than_days, log=print):
+    """Move whole days of history older than older_than_days into segment files"""
+    history = GPUMetricsHistory
+    cutoff = day_start(datetime.utcnow() - timedelta(days=older_than_days))
+    os.makedirs(archive_dir, exist_ok=True)
+    index_path = os.path.join(archive_dir, 'index.json')
+    index = read_json(index_path, {'version': INDEX_VERSION, 'archived_until': None, 'days': []})
+
+    oldest = db.session.query(func.min(history.timestamp)).filter(history.timestamp < cutoff).scalar()
+    if oldest is None:
+        log("Nothing to archive")
+        return 0
+
+    # Deleted workers' rows are being purged; they are dropped with the day instead of archived
+    names = {worker.id: worker.worker_id for worker in Worker.query.filter(Worker.deleted_at.is_(None))}
+    archived_rows = 0
+    day = day_start(oldest)
+    while day < cutoff:
+        next_day = day + timedelta(days=1)
+        day_name = day.strftime('%Y-%m-%d')
+        day_dir = os.path.join(archive_dir, day_name)
+        day_index_path = os.path.join(day_dir, 'index.json')
+        worker_ids = [row[0] for row in db.session.query(history.worker_id).filter(
+            history.timestamp >= day, history.timestamp < next_day).distinct() if row[0] in names]
+
+        if worker_ids:
+            started = time.perf_counter()
+            os.makedirs(day_dir, exist_ok=True)
+            day_index = read_json(day_index_path, {'workers': {}})
+            day_rows = 0
+            for i in range(0, len(worker_ids), WORKER_BATCH_SIZE):
+                loaded = load_day(db, history, worker_ids[i:i + WORKER_BATCH_SIZE], day, next_day)
+                for worker_db_id, blocks in loaded.items():
+                    name = names.get(worker_db_id, str(worker_db_id))
+                    day_rows += sum(len(timestamps) for timestamps, _ in blocks.values())
+                    # A day archived before (e.g. an interrupted run) is merged, not overwritten
+                    entry = day_index['workers'].get(name)
+                    if entry:
+                        existing = read_segment_blocks(os.path.join(day_dir, entry['file']), entry['gpus'],
+                                                       entry.get('columns', LEGACY_COLUMNS))
+                        blocks = merge_blocks(existing, blocks)
+                    filename = f"{worker_db_id}.seg"
+                    gpus = write_segment(os.path.join(day_dir, filename), blocks)
+                    if entry and entry['file'] != filename:
+                        os.remove(os.path.join(day_dir, entry['file']))
+                    day_index['workers'][name] = {'file': filename, 'gpus': gpus, 'columns': list(COLUMNS)}
+            write_json(day_index_path, day_index)
+            if day_name not in index['days']:
+                index['days'].append(day_name)
+                index['days'].sort()
+
+            # Readers switch to the archive for this day before the rows disappear
+            index['archived_until'] = later(index['archived_until'], next_day)
+            write_json(index_path, index)
+            history.query.filter(history.timestamp >= day, history.timestamp < next_day).delete(
+                synchronize_session=False)
+            db.session.commit()
+            archived_rows += day_rows
+            log(f"Archived {day_name}: {day_rows} samples from {len(worker_ids)} workers "
+                f"in {time.perf_counter() - started:.1f}s")
+        day = next_day
+
+    index['archived_until'] = later(index['archived_until'], cutoff)
+    write_json(index_path, index)
+    return archived_rows
+
+
+def purge_worker(archive_dir, worker_db_id, log=print):
+    """Remove a deleted worker's entries and segment files from every archived day.
+
+    Entries are found by segment file, which is named after the worker's database id:
+    the worker ID they are listed under may already belong to a new worker.
+    """
+    index = read_json(os.path.join(archive_dir, 'index.json'), None)
+    if not index:
+        return 0
+    filename = f"{worker_db_id}.seg"
+    removed = 0
+    for day_name in index['days']:
+        day_dir = os.path.join(archive_dir, day_name)
+        day_index_path = os.path.join(day_dir, 'index.json')
+        day_index = read_json(day_index_path, None)
+        names = [name for name, entry in (day_index or {}).get('workers', {}).items() if entry['file'] == filename]
+        if not names:
+            continue
+        for name in names:
+            del day_index['workers'][name]
+        # Readers stop using the segment before it disappears
+        write_json(day_index_path, day_index)
+        try:
+            os.remove(os.path.join(day_dir, filename))
+        except FileNotFoundError:
+            pass
+        removed += 1
+    if removed:
+        log(f"Removed {removed} archived days of worker {worker_db_id}")
+    return removed
+
+
+class ArchiveReader:
+    """Reads archived history for one GPU through memory-mapped segment files"""
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.lock = threading.Lock()
+        # path -> (mtime, parsed JSON); indexes are only re-read when they change
+        self.indexes = {}
+
+    def read_index(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            cached = self.indexes.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        data = read_json(path, None)
+        with self.lock:
+            self.indexes[path] = (mtime, data)
+        return data
+
+    def archived_until(self):
+        """Return the time before which history lives in the archive, or None"""
+        index = self.read_index(os.path.join(self.archive_dir, 'index.json'))
+        if not index or not index.get('archived_until'):
+            return None
+        return datetime.fromisoformat(index['archived_until'])
+
+    def read(self, worker_id, gpu_index, start_time, end_time, worker_db_id=None):
+        """Return (timestamps as datetime64[us], {metric: float32 values}) within [start_time, end_time).
+
+        With worker_db_id, only that worker's segments are read: a deleted worker's ID can be
+        registered again while its archived days are still being purged.
+        """
+        start = np.datetime64(start_time, 'us').astype(np.int64)
+        end = np.datetime64(end_time, 'us').astype(np.int64)
+        timestamps = []
+        values = []
+        day = day_start(start_time)
+        while day < end_time:
+            day_dir = os.path.join(self.archive_dir, day.strftime('%Y-%m-%d'))
+            day = day + timedelta(days=1)
+            day_index = self.read_index(os.path.join(day_dir, 'index.json'))
+            entry = day_index and day_index['workers'].get(worker_id)
+            if entry and worker_db_id is not None and entry['file'] != f"{worker_db_id}.seg":
+                continue
+            block = entry and entry['gpus'].get(str(gpu_index))
+            if not block or block[4] < start or block[3] >= end:
+                continue
+            try:
+                with open(os.path.join(day_dir, entry['file']), 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    block_timestamps, block_values = decode_block(mm[block[0]:block[0] + block[1]], block[2],
+                                                                  entry.get('columns', LEGACY_COLUMNS))
+            except FileNotFoundError:
+                # Purged along with its deleted worker since the day index was read
+                continue
+            keep = (block_timestamps >= start) & (block_timestamps < end)
+            timestamps.append(block_timestamps[keep])
+            values.append(block_values[:, keep])
+
+        if not timestamps:
+            return np.empty(0, dtype='datetime64[us]'), {name: np.empty(0, dtype=np.float32) for name in COLUMNS}
+        merged = np.concatenate(values, axis=1)
+        return (np.concatenate(timestamps).astype('datetime64[us]'),
+                {name: merged[i] for i, name in enumerate(COLUMNS)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old GPU metrics history into compressed archive segments')
+    parser.add_argument('--older-than', type=float, default=float(os.environ.get('ARCHIVE_AFTER_DAYS', 30)),
+                        help='Archive whole days older than this many days')
+    parser.add_argument('--archive-dir', default=os.environ.get('ARCHIVE_DIR', 'archive'),
+                        help='Directory the segment files are written to')
+    parser.add_argument('--vacuum', action='store_true', help='Reclaim the freed space in a SQLite database')
+    args = parser.parse_args()
+
+    from master import app, db, Worker, GPUMetricsHistory
+
+    started = time.perf_counter()
+    with app.app_context():
+        rows = archive_history(db, Worker, GPUMetricsHistory, args.archive_dir, args.older_than)
+        if args.vacuum and rows and db.engine.dialect.name == 'sqlite':
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(text('VACUUM'))
+    print(f"Archived {rows} samples in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Repeatable benchmarks for the master's hot paths.
+
+Seeds a scratch database with a configurable fleet and history depth, drives
+each endpoint through the Flask test client and writes a JSON report that can
+be compared against a report from another commit. The startup scenario restarts
+a real master process on the seeded database and times it to its first answer.
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import platform
+import tempfile
+import resource
+import tracemalloc
+import subprocess
+import contextlib
+import urllib.request
+from datetime import datetime, timedelta
+
+from simulate import GPU_MODELS, find_free_port, summarize_latencies
+
+# Default relative change in p50 latency or throughput that counts as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def seed_database(db, Worker, Command, GPUMetricsHistory, args, rng):
+    """Fill the database with workers, latest metrics, history and commands"""
+    now = datetime.utcnow()
+    workers = []
+    for i in range(args.workers):
+        model, memory_total, idle_power, tdp = rng.choice(GPU_MODELS)
+        gpus = []
+        for _ in range(args.gpus):
+            used = rng.uniform(0, memory_total)
+            gpus.append({
+                "model": model,
+                "temp": rng.randint(30, 85),
+                "util": rng.randint(0, 100),
+                "power_usage": round(rng.uniform(idle_power, tdp), 2),
+                "memory": {
+                    "total": float(memory_total),
+                    "used": round(used, 2),
+                    "free": round(memory_total - used, 2),
+                    "percent_used": round(used / memory_total * 100, 2)
+                }
+            })
+        workers.append(Worker(
+            worker_id=f"bench-{i:05d}",
+            token=f"token-{i:05d}",
+            last_seen=now,
+            metrics=json.dumps({"gpus": gpus})
+        ))
+    db.session.add_all(workers)
+    db.session.commit()
+
+    # Bulk insert history in batches to keep seeding fast for deep histories
+    batch = []
+    for worker in workers:
+        for step in range(args.history):
+            timestamp = now - timedelta(seconds=args.interval * (args.history - step))
+            for gpu_index in range(args.gpus):
+                batch.append({
+                    "worker_id": worker.id,
+                    "gpu_index": gpu_index,
+                    "timestamp": timestamp,
+                    "temperature": rng.uniform(30, 85),
+                    "utilization": rng.uniform(0, 100),
+                    "memory_used": rng.uniform(0, 40000),
+                    "memory_total": 81920.0,
+                    "power_usage": rng.uniform(50, 400),
+                })
+            if len(batch) >= 50000:
+                db.session.execute(GPUMetricsHistory.__table__.insert(), batch)
+                batch = []
+    if batch:
+        db.session.execute(GPUMetricsHistory.__table__.insert(), batch)
+
+    commands = []
+    for worker in workers:
+        for c in range(args.commands):
+            # Keep a few pending commands per worker so get_command finds work
+            status = "pending" if c >= args.commands - 2 else "completed"
+            commands.append({
+                "worker_id": worker.id,
+                "command_text": "nvidia-smi",
+                "status": status,
+                "output": "synthetic output\n" * 20 if status == "completed" else None,
+                "created_at": now,
+                "updated_at": now,
+            })
+    if commands:
+        db.session.execute(Command.__table__.insert(), commands)
+    db.session.commit()
+
+
+def build_scenarios(args, rng):
+    """Map scenario names to callables issuing one request through a test client"""
+    metrics_payload = {"metrics": {"gpus": [{
+        "model": "NVIDIA A100-SXM4-80GB",
+        "temp": 55,
+        "util": 80,
+        "power_usage": 250.0,
+        "memory": {"total": 81920.0, "used": 40000.0, "free": 41920.0, "percent_used": 48.83}
+    }] * args.gpus}}
+
+    def worker_number():
+        return rng.randrange(args.workers)
+
+    def receive_metrics(client):
+        return client.post('/metrics', json=metrics_payload,
+                           headers={"Authorization": f"Bearer token-{worker_number():05d}"})
+
+    def get_metrics_history(client):
+        return client.get(f'/api/metrics/history/bench-{worker_number():05d}/'
+                          f'{rng.randrange(args.gpus)}?hours={args.hours}')
+
+    def index(client):
+        return client.get('/')
+
+    def fleet_summary(client):
+        return client.get('/api/fleet/summary')
+
+    def fleet_workers(client):
+        return client.get('/api/fleet/workers?limit=50')
+
+    def get_command(client):
+        return client.get('/commands', headers={"Authorization": f"Bearer token-{worker_number():05d}"})
+
+    return {
+        "receive_metrics": receive_metrics,
+        "get_metrics_history": get_metrics_history,
+        "index": index,
+        "fleet_summary": fleet_summary,
+        "fleet_workers": fleet_workers,
+        "get_command": get_command,
+    }
+
+
+def run_scenario(client, request, iterations, memory_iterations):
+    """Time a scenario, then measure its peak memory in a separate pass"""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = request(client)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc slows everything down, so it gets its own shorter pass
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        request(client)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = summarize_latencies(latencies)
+    result["errors"] = errors
+    result["throughput_rps"] = round(iterations / elapsed, 2)
+    result["peak_memory_kb"] = round(peak / 1024, 1)
+    return result
+
+
+def measure_startup(db_uri, runs, timeout=60):
+    """Start `python master.py` on the seeded database runs times, timing each start
+    to its first fleet summary and then to its first accepted metrics upload"""
+    master = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'master.py')
+    first_request, first_upload = [], []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        port = find_free_port()
+        env = dict(os.environ, SQLALCHEMY_DATABASE_URI=db_uri, PORT=str(port), FLASK_DEBUG='0')
+        url = f"http://127.0.0.1:{port}"
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, master], env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    urllib.request.urlopen(f"{url}/api/fleet/summary", timeout=timeout).read()
+                    break
+                except OSError:
+                    if process.poll() is not None or time.perf_counter() - start > timeout:
+                        raise
+                    time.sleep(0.005)
+            first_request.append(time.perf_counter() - start)
+            upload = urllib.request.Request(f"{url}/metrics", data=json.dumps({"metrics": {"gpus": []}}).encode(),
+                                            headers={"Authorization": "Bearer token-00000",
+                                                     "Content-Type": "application/json"})
+            urllib.request.urlopen(upload, timeout=timeout).read()
+            first_upload.append(time.perf_counter() - start)
+        except OSError:
+            errors += 1
+        finally:
+            process.terminate()
+            process.wait()
+    elapsed = time.perf_counter() - started
+
+    result = summarize_latencies(first_request)
+    result["errors"] = errors
+    result["throughput_rps"] = round(runs / elapsed, 2)
+    # Peak resident memory of the largest master process started
+    result["peak_memory_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    result["first_upload_p50_ms"] = summarize_latencies(first_upload)["p50_ms"] if first_upload else None
+    return result
+
+
+def git_commit():
+    """Return the current commit hash, if running inside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare_reports(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print per-scenario changes against a baseline report, returning regressions"""
+    regressions = []
+    print(f"\nComparison against {baseline.get('commit') or 'baseline'}:")
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            print(f"  {name}: no baseline")
+            continue
+        p50_change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0.0
+        rps_change = ((result["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"]
+                      if before["throughput_rps"] else 0.0)
+        flag = ""
+        if p50_change > threshold or rps_change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name}: p50 {before['p50_ms']} -> {result['p50_ms']} ms ({p50_change:+.1%}), "
+              f"throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s ({rps_change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the master hot paths')
+    parser.add_argument('--workers', type=int, default=200, help='Number of seeded workers')
+    parser.add_argument('--gpus', type=int, default=8, help='GPUs per worker')
+    parser.add_argument('--history', type=int, default=720, help='History samples per GPU')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between seeded history samples')
+    parser.add_argument('--commands', type=int, default=20, help='Commands per worker')
+    parser.add_argument('--hours', type=int, default=1, help='Window requested from the history endpoint')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed requests per scenario')
+    parser.add_argument('--memory-iterations', type=int, default=20, help='Requests per scenario in the memory pass')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Master restarts timed by the startup scenario')
+    parser.add_argument('--scenario', action='append', help='Only run the named scenario (repeatable)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--output', default='benchmark.json', help='File to write the JSON report to')
+    parser.add_argument('--compare', help='Baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='Relative slowdown that counts as a regression (e.g. 0.1 for 10%%)')
+
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # The master reads its database URI at import time
+        os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(scratch, 'benchmark.db')}"
+        from master import app, db, Worker, Command, GPUMetricsHistory, create_tables
+
+        with app.app_context():
+            create_tables()
+            print(f"Seeding {args.workers} workers x {args.gpus} GPUs x {args.history} samples...")
+            started = time.perf_counter()
+            seed_database(db, Worker, Command, GPUMetricsHistory, args, rng)
+            print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+        scenarios = build_scenarios(args, rng)
+        selected = args.scenario or list(scenarios) + ["startup"]
+        client = app.test_client()
+        results = {}
+        for name in selected:
+            # Keep the master's debug output out of the measurements' console
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                if name == "startup":
+                    results[name] = measure_startup(os.environ['SQLALCHEMY_DATABASE_URI'], args.startup_runs)
+                else:
+                    results[name] = run_scenario(client, scenarios[name], args.iterations, args.memory_iterations)
+            r = results[name]
+            print(f"{name:<22} {r['throughput_rps']:>9} req/s  p50 {r['p50_ms']:>9} ms  "
+                  f"p99 {r['p99_ms']:>9} ms  peak {r['peak_memory_kb']:>9} KB  errors {r['errors']}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "workers": args.workers,
+            "gpus": args.gpus,
+            "history": args.history,
+            "commands": args.commands,
+            "hours": args.hours,
+            "iterations": args.iterations,
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("Warning: baseline was recorded with a different configuration")
+        if compare_reports(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,99 @@
 #!/usr/bin/env python3
 
 import os
-import sys
-import json
+import threading
+from collections import OrderedDict
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
-# Add the parent directory to the path so we can import from the main app
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-
-# Import from the main app
-from master import Worker, Command, db, app as master_app
+# The master whose versioned read API the bridge serves to Cockpit
+MASTER_URL = os.environ.get('MASTER_URL', 'http://localhost:5000').rstrip('/')
+MASTER_TIMEOUT = float(os.environ.get('MASTER_TIMEOUT', 10))
+# Read URLs whose last body and ETag are kept; the least recently used ones are dropped first
+READ_CACHE_SIZE = int(os.environ.get('READ_CACHE_SIZE', 256))
 
 # Create a new Flask app for the Cockpit bridge
 app = Flask(__name__)
 
+# One keep-alive session to the master, and the last body and ETag seen for each read URL,
+# so unchanged state is revalidated with If-None-Match instead of transferred again
+session = requests.Session()
+read_cache = OrderedDict()
+read_cache_lock = threading.Lock()
+
 # Enable CORS for Cockpit
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
     return response
 
-# API endpoint to get all workers
+def master_read(path, params=None):
+    """Relay a GET of the master's read API, revalidating the cached copy and answering
+    304 when the Cockpit client already has the current version"""
+    key = (path, tuple(sorted((params or {}).items())))
+    with read_cache_lock:
+        cached = read_cache.get(key)
+        if cached:
+            read_cache.move_to_end(key)
+    headers = {'If-None-Match': cached[0]} if cached else {}
+    try:
+        upstream = session.get(f"{MASTER_URL}{path}", params=params, headers=headers, timeout=MASTER_TIMEOUT)
+    except requests.RequestException as e:
+        return jsonify({'success': False, 'message': f"GPU Monitor master unavailable: {e}"}), 502
+
+    if upstream.status_code == 304 and cached:
+        etag, body = cached
+    elif upstream.status_code == 200 and upstream.headers.get('ETag'):
+        etag, body = upstream.headers['ETag'], upstream.content
+        with read_cache_lock:
+            read_cache[key] = (etag, body)
+            read_cache.move_to_end(key)
+            while len(read_cache) > READ_CACHE_SIZE:
+                read_cache.popitem(last=False)
+    else:
+        return Response(upstream.content, status=upstream.status_code,
+                        content_type=upstream.headers.get('Content-Type', 'application/json'))
+
+    response = Response(body, content_type='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def master_submit(worker_ids, command_text):
+    """Queue a command on workers through the master, returning its JSON answer or an error response"""
+    try:
+        upstream = session.post(f"{MASTER_URL}/api/submit_command", timeout=MASTER_TIMEOUT,
+                                json={'worker_ids': worker_ids, 'command': command_text})
+    except requests.RequestException as e:
+        return None, (jsonify({'success': False, 'message': f"GPU Monitor master unavailable: {e}"}), 502)
+    if upstream.ok:
+        try:
+            return upstream.json(), None
+        except ValueError:
+            pass
+    # Error pages from the master or a proxy in front of it need not be JSON
+    try:
+        message = upstream.json().get('message')
+    except (ValueError, AttributeError):
+        message = None
+    message = message or upstream.text or f"HTTP {upstream.status_code}"
+    return None, (jsonify({'success': False, 'message': message}), upstream.status_code if not upstream.ok else 502)
+
+# API endpoint to get all workers: status and GPU models only, 304 while nothing changed
 @app.route('/api/workers', methods=['GET'])
 def get_workers():
-    with master_app.app_context():
-        workers = Worker.query.all()
-        result = []
-        for worker in workers:
-            result.append({
-                'id': worker.id,
-                'worker_id': worker.worker_id,
-                'last_seen': worker.last_seen.isoformat(),
-                'metrics': worker.metrics
-            })
-        return jsonify(result)
-
-# API endpoint to get a specific worker
+    return master_read('/api/v1/workers')
+
+# API endpoint to get a specific worker with a page of its commands (newest first, without
+# output; pass next_before as ?before= for older ones)
 @app.route('/api/worker/<worker_id>', methods=['GET'])
 def get_worker(worker_id):
-    with master_app.app_context():
-        worker = Worker.query.filter_by(worker_id=worker_id).first()
-        if not worker:
-            return jsonify({'error': 'Worker not found'}), 404
-        
-        commands = Command.query.filter_by(worker_id=worker.id).order_by(Command.created_at.desc()).all()
-        commands_json = []
-        for cmd in commands:
-            commands_json.append({
-                'id': cmd.id,
-                'command_text': cmd.command_text,
-                'status': cmd.status,
-                'output': cmd.output,
-                'created_at': cmd.created_at.isoformat(),
-                'updated_at': cmd.updated_at.isoformat()
-            })
-        
-        return jsonify({
-            'id': worker.id,
-            'worker_id': worker.worker_id,
-            'last_seen': worker.last_seen.isoformat(),
-            'metrics': worker.metrics,
-            'commands': commands_json
-        })
+    # Only the parameters the master accepts, so arbitrary query strings do not add cache entries
+    params = {name: request.args[name] for name in ('before', 'limit') if request.args.get(name)}
+    return master_read(f'/api/v1/workers/{worker_id}', params)
 
 # API endpoint to submit a command to a worker
 @app.route('/api/submit_command', methods=['POST'])
@@ -72,20 +101,17 @@ def submit_command():
     data = request.json
     worker_id = data.get('worker_id')
     command_text = data.get('command')
-    
+
     if not worker_id or not command_text:
         return jsonify({'success': False, 'message': 'Worker ID and command are required'}), 400
-    
-    with master_app.app_context():
-        worker = Worker.query.filter_by(worker_id=worker_id).first()
-        if not worker:
-            return jsonify({'success': False, 'message': 'Worker not found'}), 404
-        
-        command = Command(worker_id=worker.id, command_text=command_text)
-        db.session.add(command)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'command_id': command.id})
+
+    result, error = master_submit([worker_id], command_text)
+    if error:
+        return error
+    if not result['commands']:
+        return jsonify({'success': False, 'message': 'Worker not found'}), 404
+
+    return jsonify({'success': True, 'command_id': result['commands'][0]['command_id']})
 
 # API endpoint to submit a command to multiple workers
 @app.route('/api/submit_multi_command', methods=['POST'])
@@ -93,26 +119,20 @@ def submit_multi_command():
     data = request.json
     worker_ids = data.get('worker_ids', [])
     command_text = data.get('command')
-    
+
     if not worker_ids or not command_text:
         return jsonify({'success': False, 'message': 'Worker IDs and command are required'}), 400
-    
-    with master_app.app_context():
-        command_ids = []
-        for worker_id in worker_ids:
-            worker = Worker.query.filter_by(worker_id=worker_id).first()
-            if worker:
-                command = Command(worker_id=worker.id, command_text=command_text)
-                db.session.add(command)
-                command_ids.append(command.id)
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True, 
-            'message': f'Command sent to {len(command_ids)} workers',
-            'command_ids': command_ids
-        })
+
+    result, error = master_submit(worker_ids, command_text)
+    if error:
+        return error
+    command_ids = [command['command_id'] for command in result['commands']]
+
+    return jsonify({
+        'success': True,
+        'message': f'Command sent to {len(command_ids)} workers',
+        'command_ids': command_ids
+    })
 
 # Main entry point
 if __name__ == '__main__':
@@ -1,9 +1,12 @@
 // GPU Monitor Cockpit Plugin
 
 // Configuration
-const API_BASE_URL = "http://localhost:5000"; // URL to your Flask API
+const API_BASE_URL = "http://localhost:8000"; // URL of the GPU Monitor Cockpit bridge
 const REFRESH_INTERVAL = 30000; // Refresh data every 30 seconds
 
+// ETag of the workers list last rendered; the bridge answers 304 while it is current
+let workersEtag = null;
+
 // Initialize when document is ready
 $(document).ready(function() {
     // Initial data load
@@ -16,13 +19,48 @@ $(document).ready(function() {
     setupEventHandlers();
 });
 
-// Load workers data from API
+// Split a `curl -i` response into its status, headers and body
+function parseHttpResponse(data) {
+    let headerEnd = data.indexOf("\r\n\r\n");
+    // Skip interim responses such as "100 Continue"
+    while (/^HTTP\/[\d.]+ 1\d\d/.test(data) && headerEnd !== -1) {
+        data = data.substring(headerEnd + 4);
+        headerEnd = data.indexOf("\r\n\r\n");
+    }
+    const lines = (headerEnd === -1 ? data : data.substring(0, headerEnd)).split("\r\n");
+    const headers = {};
+    lines.slice(1).forEach(function(line) {
+        const separator = line.indexOf(":");
+        if (separator > 0) {
+            headers[line.substring(0, separator).trim().toLowerCase()] = line.substring(separator + 1).trim();
+        }
+    });
+    return {
+        status: parseInt(lines[0].split(" ")[1], 10),
+        headers: headers,
+        body: headerEnd === -1 ? "" : data.substring(headerEnd + 4)
+    };
+}
+
+// Load workers data from API, leaving the table (and the selection) alone when nothing changed
 function loadWorkers() {
-    cockpit.spawn(["curl", "-s", `${API_BASE_URL}/api/workers`])
+    const request = ["curl", "-s", "-i"];
+    if (workersEtag) {
+        request.push("-H", `If-None-Match: ${workersEtag}`);
+    }
+    request.push(`${API_BASE_URL}/api/workers`);
+    cockpit.spawn(request)
         .then(function(data) {
             try {
-                const workers = JSON.parse(data);
-                updateWorkersTable(workers);
+                const response = parseHttpResponse(data);
+                if (response.status === 304) {
+                    return;
+                }
+                if (response.status !== 200) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                updateWorkersTable(JSON.parse(response.body).workers);
+                workersEtag = response.headers["etag"] || null;
             } catch (error) {
                 console.error("Error parsing workers data:", error);
                 showError("Failed to parse workers data");
@@ -48,27 +86,28 @@ function updateWorkersTable(workers) {
         return;
     }
     
-    const now = new Date();
+    // Keep the selection across refreshes
+    const selected = new Set($(".worker-checkbox:checked").map(function() {
+        return $(this).val();
+    }).get());
     
-    workers.forEach(function(worker) {
-        const lastSeen = new Date(worker.last_seen);
-        const isActive = (now - lastSeen) / 1000 < 60;
-        const metrics = worker.metrics ? JSON.parse(worker.metrics) : null;
-        const gpuCount = metrics && metrics.gpus ? metrics.gpus.length : 0;
+    workers.forEach(function(worker, index) {
+        const isActive = worker.active;
+        const gpuCount = worker.gpu_count;
         
         let gpuTypeHtml = "-";
-        if (metrics && metrics.gpus && metrics.gpus.length > 0) {
+        if (worker.models.length > 0) {
             const uniqueModels = {};
             
-            metrics.gpus.forEach(function(gpu) {
+            worker.models.forEach(function(gpu) {
                 const shortModel = gpu.model.replace("NVIDIA ", "").substring(0, 15);
                 if (uniqueModels[shortModel]) {
-                    uniqueModels[shortModel].count++;
+                    uniqueModels[shortModel].count += gpu.count;
                 } else {
                     uniqueModels[shortModel] = {
-                        count: 1,
+                        count: gpu.count,
                         fullModel: gpu.model,
-                        memory: gpu.memory && gpu.memory.total ? Math.round(gpu.memory.total / 1024) : null
+                        memory: gpu.memory_total ? Math.round(gpu.memory_total / 1024) : null
                     };
                 }
             });
@@ -101,7 +140,7 @@ function updateWorkersTable(workers) {
                 <td class="pf-c-table__check">
                     <input class="pf-c-check__input worker-checkbox" type="checkbox" 
                            name="worker_select" value="${worker.worker_id}" 
-                           id="worker${worker.id}">
+                           id="worker${index}" ${selected.has(worker.worker_id) ? "checked" : ""}>
                 </td>
                 <td><a href="#" class="worker-details" data-worker-id="${worker.worker_id}">${worker.worker_id}</a></td>
                 <td>
@@ -111,7 +150,7 @@ function updateWorkersTable(workers) {
                 </td>
                 <td>${gpuCount}</td>
                 <td>${gpuTypeHtml}</td>
-                <td>${formatDate(lastSeen)}</td>
+                <td>${isActive ? "Now" : formatDate(new Date(worker.inactive_since + "Z"))}</td>
                 <td>
                     <div class="pf-c-input-group">
                         <input type="text" class="pf-c-form-control command-input" 
@@ -128,6 +167,7 @@ function updateWorkersTable(workers) {
     $(".worker-checkbox").on("change", updateSelectedCount);
     $(".run-command-btn").on("click", runSingleCommand);
     $(".worker-details").on("click", showWorkerDetails);
+    updateSelectedCount();
 }
 
 // Set up event handlers
@@ -0,0 +1,112 @@
+"""Request and response compression for the master.
+
+Uploads with a Content-Encoding of gzip, deflate or zstd are decompressed by
+request_json(), and responses larger than COMPRESS_MIN_BYTES are compressed with
+the best encoding the client accepts. zstd needs the optional zstandard package.
+
+Configuration is read from the environment:
+
+- COMPRESS_MIN_BYTES: smallest response body worth compressing (default 1024)
+- MAX_UPLOAD_BYTES: largest decompressed upload accepted (default 64 MB)
+"""
+import os
+import gzip
+import json
+import zlib
+
+from flask import request, jsonify
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response types worth compressing; images and archives are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/openmetrics-text')
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class ContentEncodingError(Exception):
+    """An upload that cannot be decoded; carries the HTTP status to answer with"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def supported_encodings():
+    """Content encodings this master can decode and produce, in order of preference"""
+    return ('zstd', 'gzip', 'deflate') if zstandard else ('gzip', 'deflate')
+
+
+def decompress(data, encoding, max_size):
+    """Decode a request body, refusing anything that inflates beyond max_size"""
+    if encoding == 'zstd' and zstandard:
+        try:
+            body = zstandard.ZstdDecompressor().stream_reader(data).read(max_size + 1)
+        except zstandard.ZstdError as e:
+            raise ContentEncodingError(f"Invalid zstd body: {e}", 400)
+    elif encoding in ('gzip', 'deflate'):
+        # wbits 47 accepts both gzip and zlib headers
+        decompressor = zlib.decompressobj(47)
+        try:
+            body = decompressor.decompress(data, max_size + 1)
+        except zlib.error as e:
+            raise ContentEncodingError(f"Invalid {encoding} body: {e}", 400)
+    else:
+        raise ContentEncodingError(f"Unsupported Content-Encoding {encoding}", 415)
+    if len(body) > max_size:
+        raise ContentEncodingError("Decompressed body is too large", 413)
+    return body
+
+
+def request_json():
+    """Return the request's JSON body, decoding its Content-Encoding first"""
+    encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding in ('', 'identity'):
+        return request.get_json()
+    max_size = int(os.environ.get('MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+    body = decompress(request.get_data(cache=False), encoding, max_size)
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise ContentEncodingError("Body is not valid JSON", 400)
+
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == 'deflate':
+        return zlib.compress(data, GZIP_LEVEL)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def init_app(app):
+    """Install upload error handling and response compression on app"""
+    min_size = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
+    @app.errorhandler(ContentEncodingError)
+    def content_encoding_error(e):
+        return jsonify({"status": "error", "message": str(e)}), e.status
+
+    @app.after_request
+    def compress_response(response):
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+                or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+        if response.content_length is not None and response.content_length < min_size:
+            return response
+        encoding = request.accept_encodings.best_match(supported_encodings())
+        if not encoding:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
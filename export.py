@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Bulk export of GPU metrics history as CSV or Parquet.
+
+Rows are read through a streaming cursor in fixed-size batches and written out
+one batch at a time, so an export of any size runs in constant memory. The same
+generators back the master's /api/metrics/export endpoint and this CLI:
+
+    python export.py --format parquet --output history.parquet --start 2024-01-01
+
+Parquet output needs pyarrow (pip install pyarrow); CSV has no extra dependencies.
+"""
+import io
+import csv
+import sys
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+FORMATS = ('csv', 'parquet')
+COLUMNS = ('worker_id', 'gpu_index', 'timestamp', 'temperature', 'utilization',
+           'memory_used', 'memory_total', 'power_usage', 'sample_interval', 'sm_clock', 'memory_clock',
+           'fan_speed', 'throttle_reasons', 'ecc_corrected', 'ecc_uncorrected', 'pcie_tx', 'pcie_rx',
+           'nvlink_tx', 'nvlink_rx')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Rows fetched per batch; also the size of each Parquet row group
+EXPORT_BATCH_SIZE = 50000
+
+
+def parse_time(value):
+    """Parse an ISO 8601 date or datetime as naive UTC, returning None for an empty value"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        # History timestamps are stored as naive UTC
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def export_query(Worker, GPUMetricsHistory, worker_ids=None, gpu_indexes=None, start_time=None, end_time=None):
+    """Select history rows matching the filters in timestamp order"""
+    history = GPUMetricsHistory
+    stmt = select(
+        Worker.worker_id, *(getattr(history, column) for column in COLUMNS[1:])
+    ).join(Worker, Worker.id == history.worker_id).where(Worker.deleted_at.is_(None))
+    if worker_ids:
+        stmt = stmt.where(Worker.worker_id.in_(worker_ids))
+    if gpu_indexes:
+        stmt = stmt.where(history.gpu_index.in_(gpu_indexes))
+    if start_time:
+        stmt = stmt.where(history.timestamp >= start_time)
+    if end_time:
+        stmt = stmt.where(history.timestamp < end_time)
+    return stmt.order_by(history.timestamp, history.id)
+
+
+def iter_batches(engine, stmt, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of rows using a server-side cursor on its own connection"""
+    # A dedicated connection keeps the export out of the request's session,
+    # and stream_results stops drivers such as psycopg2 from buffering everything
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(stmt)
+        for partition in result.partitions(batch_size):
+            yield partition
+
+
+def iter_csv(batches):
+    """Encode batches of rows as CSV, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(
+            (row[0], row[1], row[2].isoformat() if row[2] else '', *row[3:]) for row in rows
+        )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class ChunkSink:
+    """Write-only file object that hands written bytes back in chunks"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('worker_id', pa.string()),
+        ('gpu_index', pa.int32()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('temperature', pa.float64()),
+        ('utilization', pa.float64()),
+        ('memory_used', pa.float64()),
+        ('memory_total', pa.float64()),
+        ('power_usage', pa.float64()),
+        ('sample_interval', pa.float64()),
+        ('sm_clock', pa.float64()),
+        ('memory_clock', pa.float64()),
+        ('fan_speed', pa.float64()),
+        ('throttle_reasons', pa.int64()),
+        ('ecc_corrected', pa.int64()),
+        ('ecc_uncorrected', pa.int64()),
+        ('pcie_tx', pa.float64()),
+        ('pcie_rx', pa.float64()),
+        ('nvlink_tx', pa.float64()),
+        ('nvlink_rx', pa.float64()),
+    ])
+
+
+def iter_parquet(batches):
+    """Encode batches of rows as a Parquet file, one row group per batch"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+    try:
+        for rows in batches:
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+            )
+            writer.write_table(table)
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_chunks(engine, stmt, fmt, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the encoded export as a sequence of byte chunks"""
+    batches = iter_batches(engine, stmt, batch_size)
+    if fmt == 'parquet':
+        return iter_parquet(batches)
+    return iter_csv(batches)
+
+
+def parse_list(value, cast=str):
+    """Parse a comma separated filter value"""
+    if not value:
+        return None
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export GPU metrics history as CSV or Parquet')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='Output format')
+    parser.add_argument('--output', '-o', help='Output file (default: stdout for CSV)')
+    parser.add_argument('--worker-id', help='Comma separated worker IDs to export')
+    parser.add_argument('--gpu', help='Comma separated GPU indexes to export')
+    parser.add_argument('--start', help='Export samples at or after this ISO 8601 time (UTC)')
+    parser.add_argument('--end', help='Export samples before this ISO 8601 time (UTC)')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE, help='Rows per batch / row group')
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and not parquet_available():
+        parser.error('Parquet export requires pyarrow (pip install pyarrow)')
+    if args.format == 'parquet' and not args.output:
+        parser.error('--output is required for Parquet export')
+    try:
+        start_time, end_time = parse_time(args.start), parse_time(args.end)
+        gpu_indexes = parse_list(args.gpu, int)
+    except ValueError as e:
+        parser.error(str(e))
+
+    from master import app, db, Worker, GPUMetricsHistory
+
+    stmt = export_query(Worker, GPUMetricsHistory, parse_list(args.worker_id), gpu_indexes, start_time, end_time)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    written = 0
+    try:
+        with app.app_context():
+            for chunk in export_chunks(db.engine, stmt, args.format, args.batch_size):
+                out.write(chunk)
+                written += len(chunk)
+    finally:
+        if args.output:
+            out.close()
+    print(f"Wrote {written} bytes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""In-memory snapshot of the latest metrics reported by every worker.
+
+The snapshot is updated from the ingest path and read by endpoints that must
+not touch the database, such as the Prometheus exporter and the fleet overview.
+Per-model aggregates are adjusted by each worker's change on every upload, and
+each worker's overview row is built once per upload rather than once per read.
+"""
+import heapq
+import bisect
+import threading
+from datetime import datetime
+
+EPOCH = datetime(1970, 1, 1)
+
+# (metric name, help text, key in the prepared per-GPU values)
+GPU_GAUGES = [
+    ("gpu_temperature_celsius", "GPU temperature in degrees Celsius", "temp"),
+    ("gpu_utilization_percent", "GPU utilization percentage", "util"),
+    ("gpu_memory_used_bytes", "GPU memory used in bytes", "memory_used"),
+    ("gpu_memory_total_bytes", "Total GPU memory in bytes", "memory_total"),
+    ("gpu_power_usage_watts", "GPU power usage in watts", "power_usage"),
+    ("gpu_sm_clock_hertz", "GPU SM clock in hertz", "sm_clock"),
+    ("gpu_memory_clock_hertz", "GPU memory clock in hertz", "memory_clock"),
+    ("gpu_fan_speed_percent", "GPU fan speed percentage", "fan"),
+    ("gpu_clocks_throttle_reasons", "Bitmask of the active NVML clock throttle reasons", "throttle"),
+    ("gpu_ecc_corrected_errors", "Corrected ECC errors since the driver was loaded", "ecc_corrected"),
+    ("gpu_ecc_uncorrected_errors", "Uncorrected ECC errors since the driver was loaded", "ecc_uncorrected"),
+    ("gpu_pcie_tx_bytes_per_second", "GPU PCIe transmit throughput in bytes per second", "pcie_tx"),
+    ("gpu_pcie_rx_bytes_per_second", "GPU PCIe receive throughput in bytes per second", "pcie_rx"),
+    ("gpu_nvlink_tx_bytes_per_second", "GPU NVLink transmit throughput in bytes per second", "nvlink_tx"),
+    ("gpu_nvlink_rx_bytes_per_second", "GPU NVLink receive throughput in bytes per second", "nvlink_rx"),
+    ("gpu_processes", "Compute processes running on the GPU", "processes"),
+]
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def to_epoch(timestamp):
+    """Convert a naive UTC datetime to seconds since the epoch"""
+    return (timestamp - EPOCH).total_seconds()
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    """Format a sample value, returning None for missing readings"""
+    if value is None:
+        return None
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def scaled(value, factor):
+    """Convert a reading to base units, passing None through"""
+    if value is None:
+        return None
+    try:
+        return float(value) * factor
+    except (TypeError, ValueError):
+        return None
+
+
+def mb_to_bytes(value):
+    """Convert a reading in MB to bytes, passing None through"""
+    return scaled(value, 1024 * 1024)
+
+
+def active_seconds(report_interval):
+    """How long a worker counts as active after it last reported; longer for slow adaptive intervals"""
+    return max(60, 3 * (report_interval or 0))
+
+
+def model_totals(gpus):
+    """Per-model [gpus, temperature sum, temperatures, utilization sum, utilizations, memory used, memory total]"""
+    totals = {}
+    for gpu in gpus:
+        model = gpu.get('model') or 'unknown'
+        memory = gpu.get('memory') or {}
+        temp, util = scaled(gpu.get('temp'), 1), scaled(gpu.get('util'), 1)
+        entry = totals.setdefault(model, [0, 0.0, 0, 0.0, 0, 0.0, 0.0])
+        entry[0] += 1
+        if temp is not None:
+            entry[1] += temp
+            entry[2] += 1
+        if util is not None:
+            entry[3] += util
+            entry[4] += 1
+        entry[5] += scaled(memory.get('used'), 1) or 0.0
+        entry[6] += scaled(memory.get('total'), 1) or 0.0
+    return totals
+
+
+def worker_row(gpus):
+    """The fleet overview columns for one worker's latest GPUs"""
+    models = {}
+    for gpu in gpus:
+        model = gpu.get('model') or 'unknown'
+        if model not in models:
+            models[model] = {'model': model, 'count': 0,
+                             'memory_total': scaled((gpu.get('memory') or {}).get('total'), 1)}
+        models[model]['count'] += 1
+    temps = [t for t in (scaled(gpu.get('temp'), 1) for gpu in gpus) if t is not None]
+    utils = [u for u in (scaled(gpu.get('util'), 1) for gpu in gpus) if u is not None]
+    return {
+        'gpu_count': len(gpus),
+        'models': list(models.values()),
+        'max_temperature': max(temps) if temps else None,
+        'mean_utilization': round(sum(utils) / len(utils), 1) if utils else None,
+    }
+
+
+def gpu_entry(reading):
+    temp, util, worker_id, gpu_index, model = reading
+    return {'worker_id': worker_id, 'gpu_index': gpu_index, 'model': model, 'temperature': temp, 'utilization': util}
+
+
+def state_row(worker_id, entry, now_epoch):
+    """A worker's status row and the epoch time it turns (or turned) inactive"""
+    inactive_at = entry["last_seen"] + active_seconds(entry["report_interval"])
+    active = now_epoch < inactive_at
+    return {
+        'worker_id': worker_id,
+        'active': active,
+        'inactive_since': None if active else entry["last_seen_at"],
+        'gpu_count': entry["row"]["gpu_count"],
+        'models': entry["row"]["models"],
+    }, inactive_at
+
+
+class FleetSnapshot:
+    """Latest GPU readings per worker with pre-rendered exposition lines"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        # worker_id -> {"last_seen": epoch seconds, "worker_label": str, "lines": {gauge key: [sample line, ...]}}
+        self.workers = {}
+        # (worker_id, gpu_index, model) -> rendered label set, reused across updates
+        self.label_cache = {}
+        # Worker IDs in order, for keyset paging of the worker list
+        self.worker_ids = []
+        # model -> fleet-wide totals as built by model_totals(), kept current on every update
+        self.model_totals = {}
+        # Bumped whenever a worker is added or removed, changes GPUs or report interval, or comes back
+        # from inactive; uploads that only refresh readings leave it alone
+        self.states_version = 0
+
+    def adjust_models(self, totals, sign):
+        for model, values in totals.items():
+            current = self.model_totals.setdefault(model, [0, 0.0, 0, 0.0, 0, 0.0, 0.0])
+            for i, value in enumerate(values):
+                current[i] += sign * value
+            if current[0] <= 0:
+                del self.model_totals[model]
+
+    def gpu_labels(self, worker_id, gpu_index, model):
+        key = (worker_id, gpu_index, model)
+        labels = self.label_cache.get(key)
+        if labels is None:
+            labels = (f'{{worker="{escape_label(worker_id)}",gpu="{gpu_index}",'
+                      f'model="{escape_label(model or "unknown")}"}}')
+            self.label_cache[key] = labels
+        return labels
+
+    def update(self, worker_id, last_seen, gpus, report_interval=None):
+        """Record the latest metrics for a worker"""
+        gpus = gpus or []
+        lines = {key: [] for _, _, key in GPU_GAUGES}
+        for gpu_index, gpu in enumerate(gpus):
+            labels = self.gpu_labels(worker_id, gpu_index, gpu.get('model'))
+            memory = gpu.get('memory') or {}
+            clocks = gpu.get('clocks') or {}
+            ecc = gpu.get('ecc') or {}
+            pcie = gpu.get('pcie') or {}
+            nvlink = gpu.get('nvlink') or {}
+            processes = gpu.get('processes')
+            values = {
+                "temp": format_value(gpu.get('temp')),
+                "util": format_value(gpu.get('util')),
+                "memory_used": format_value(mb_to_bytes(memory.get('used'))),
+                "memory_total": format_value(mb_to_bytes(memory.get('total'))),
+                "power_usage": format_value(gpu.get('power_usage')),
+                "sm_clock": format_value(scaled(clocks.get('sm'), 1e6)),
+                "memory_clock": format_value(scaled(clocks.get('memory'), 1e6)),
+                "fan": format_value(gpu.get('fan')),
+                "throttle": format_value(gpu.get('throttle_mask')),
+                "ecc_corrected": format_value(ecc.get('corrected')),
+                "ecc_uncorrected": format_value(ecc.get('uncorrected')),
+                "pcie_tx": format_value(scaled(pcie.get('tx'), 1000)),
+                "pcie_rx": format_value(scaled(pcie.get('rx'), 1000)),
+                "nvlink_tx": format_value(scaled(nvlink.get('tx'), 1000)),
+                "nvlink_rx": format_value(scaled(nvlink.get('rx'), 1000)),
+                "processes": format_value(len(processes)) if processes is not None else None,
+            }
+            for name, _, key in GPU_GAUGES:
+                if values[key] is not None:
+                    lines[key].append(f"{name}{labels} {values[key]}")
+
+        entry = {
+            "last_seen": to_epoch(last_seen),
+            "last_seen_at": last_seen.isoformat(),
+            "report_interval": report_interval,
+            "worker_label": f'{{worker="{escape_label(worker_id)}"}}',
+            "lines": lines,
+            "row": worker_row(gpus),
+            "models": model_totals(gpus),
+            "gpus": [(scaled(gpu.get('temp'), 1), scaled(gpu.get('util'), 1), worker_id, gpu_index,
+                      gpu.get('model') or 'unknown') for gpu_index, gpu in enumerate(gpus)],
+        }
+        with self.lock:
+            previous = self.workers.get(worker_id)
+            if previous:
+                self.adjust_models(previous["models"], -1)
+            else:
+                bisect.insort(self.worker_ids, worker_id)
+            if (not previous or previous["row"]["models"] != entry["row"]["models"]
+                    or previous["report_interval"] != report_interval
+                    or entry["last_seen"] - previous["last_seen"] >= active_seconds(previous["report_interval"])):
+                self.states_version += 1
+            self.adjust_models(entry["models"], 1)
+            self.workers[worker_id] = entry
+
+    def load(self, workers):
+        """Populate the snapshot from Worker rows (done once at startup)"""
+        for worker in workers:
+            metrics = worker.get_metrics_json() or {}
+            self.update(worker.worker_id, worker.last_seen, metrics.get('gpus', []), worker.report_interval)
+        self.loaded = True
+
+    def last_seen_times(self):
+        """Return worker_id -> last-seen time in seconds since the epoch"""
+        with self.lock:
+            return {worker_id: entry["last_seen"] for worker_id, entry in self.workers.items()}
+
+    def forget(self, worker_id):
+        """Drop a worker, e.g. after it has been deleted"""
+        with self.lock:
+            entry = self.workers.pop(worker_id, None)
+            if entry:
+                self.adjust_models(entry["models"], -1)
+                self.worker_ids.pop(bisect.bisect_left(self.worker_ids, worker_id))
+                self.states_version += 1
+            for key in [k for k in self.label_cache if k[0] == worker_id]:
+                del self.label_cache[key]
+
+    def summary(self, now=None, top=10, stale_limit=50, exclude=()):
+        """Fleet overview: worker and GPU counts, per-model aggregates, hottest and idlest GPUs, stale workers.
+
+        Workers in exclude are left out, e.g. ones that now report to another master of a federation.
+        """
+        now_epoch = to_epoch(now or datetime.utcnow())
+        with self.lock:
+            entries = [(worker_id, entry) for worker_id, entry in self.workers.items() if worker_id not in exclude]
+            totals = {model: list(values) for model, values in self.model_totals.items()}
+            for worker_id in exclude:
+                if worker_id in self.workers:
+                    for model, values in self.workers[worker_id]["models"].items():
+                        totals[model] = [total - value for total, value in zip(totals[model], values)]
+        totals = {model: values for model, values in totals.items() if values[0] > 0}
+
+        readings = []
+        stale = []
+        gpu_count = 0
+        for worker_id, entry in entries:
+            gpu_count += len(entry["gpus"])
+            age = now_epoch - entry["last_seen"]
+            if age < active_seconds(entry["report_interval"]):
+                readings.extend(entry["gpus"])
+            else:
+                stale.append((age, worker_id, entry["last_seen_at"]))
+        # Only GPUs of active workers compete; an offline worker's last readings are not current
+        hottest = heapq.nlargest(top, (r for r in readings if r[0] is not None), key=lambda r: r[0])
+        idlest = heapq.nsmallest(top, (r for r in readings if r[1] is not None), key=lambda r: r[1])
+        stale.sort()
+
+        return {
+            'generated_at': (now or datetime.utcnow()).isoformat(),
+            'workers': {'total': len(entries), 'active': len(entries) - len(stale), 'inactive': len(stale)},
+            'gpus': {'total': gpu_count, 'active': len(readings)},
+            'models': sorted(({
+                'model': model,
+                'gpus': int(gpus),
+                'temperature_mean': round(temp_sum / temps, 1) if temps else None,
+                'utilization_mean': round(util_sum / utils, 1) if utils else None,
+                'memory_used': round(memory_used, 1),
+                'memory_total': round(memory_total, 1),
+            } for model, (gpus, temp_sum, temps, util_sum, utils, memory_used, memory_total) in totals.items()),
+                key=lambda m: (-m['gpus'], m['model'])),
+            'hottest': [gpu_entry(r) for r in hottest],
+            'idlest': [gpu_entry(r) for r in idlest],
+            'stale_workers': [{'worker_id': worker_id, 'last_seen': last_seen, 'age_seconds': round(age)}
+                              for age, worker_id, last_seen in stale[:stale_limit]],
+        }
+
+    def list_workers(self, now=None, after=None, limit=50, status=None, search=None, model=None):
+        """Page through workers in ID order after the worker ID after, returning (rows, next_after)"""
+        now_epoch = to_epoch(now or datetime.utcnow())
+        search = search.lower() if search else None
+        model = model.lower() if model else None
+        rows = []
+        with self.lock:
+            start = bisect.bisect_right(self.worker_ids, after) if after else 0
+            for worker_id in self.worker_ids[start:]:
+                entry = self.workers[worker_id]
+                age = now_epoch - entry["last_seen"]
+                active = age < active_seconds(entry["report_interval"])
+                if status and (status == 'active') != active:
+                    continue
+                if search and search not in worker_id.lower():
+                    continue
+                if model and not any(model in m['model'].lower() for m in entry["row"]["models"]):
+                    continue
+                rows.append(dict(entry["row"], worker_id=worker_id, last_seen=entry["last_seen_at"],
+                                 report_interval=entry["report_interval"], active=active,
+                                 age_seconds=round(age)))
+                if len(rows) > limit:
+                    break
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1]['worker_id']
+        return rows, None
+
+    def worker_states(self, now=None):
+        """Every worker's status and GPUs in ID order, without readings that change on every upload.
+
+        Returns (rows, states_version, expires): the rows stay the same until states_version
+        changes or, at the epoch time expires, the next active worker turns inactive.
+        """
+        now_epoch = to_epoch(now or datetime.utcnow())
+        rows = []
+        expires = float('inf')
+        with self.lock:
+            for worker_id in self.worker_ids:
+                row, inactive_at = state_row(worker_id, self.workers[worker_id], now_epoch)
+                if row['active']:
+                    expires = min(expires, inactive_at)
+                rows.append(row)
+            return rows, self.states_version, expires
+
+    def worker_state(self, worker_id, now=None):
+        """One worker's row as listed by worker_states(), or None if it is unknown"""
+        with self.lock:
+            entry = self.workers.get(worker_id)
+            if entry is None:
+                return None
+            return state_row(worker_id, entry, to_epoch(now or datetime.utcnow()))[0]
+
+    def render_prometheus(self, now=None, openmetrics=False, extra=""):
+        """Render every worker's gauges in the Prometheus text exposition format, followed by the
+        already rendered families in extra (placed before the OpenMetrics # EOF terminator)"""
+        now = to_epoch(now or datetime.utcnow())
+        with self.lock:
+            entries = list(self.workers.values())
+
+        out = []
+        for name, help_text, key in GPU_GAUGES:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} gauge")
+            for entry in entries:
+                out.extend(entry["lines"][key])
+
+        out.append("# HELP gpu_worker_last_seen_age_seconds Seconds since the worker last reported metrics")
+        out.append("# TYPE gpu_worker_last_seen_age_seconds gauge")
+        for entry in entries:
+            out.append(f"gpu_worker_last_seen_age_seconds{entry['worker_label']} {now - entry['last_seen']:.3f}")
+
+        if extra:
+            out.append(extra.rstrip("\n"))
+        if openmetrics:
+            out.append("# EOF")
+        return "\n".join(out) + "\n"
@@ -0,0 +1,192 @@
+"""Self-instrumentation for the master: logging, request timing, SQL counters and profiling.
+
+Configuration is read from the environment:
+
+- LOG_LEVEL: logging level for the master (default INFO)
+- SLOW_REQUEST_MS: requests slower than this are logged as warnings (default 1000)
+- PROFILE_REQUESTS: "1" honours ?profile=1 on any request, "slow" profiles every
+  request and keeps the profiles of requests slower than SLOW_REQUEST_MS
+- PROFILE_DIR: directory profiles are written to (default "profiles")
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('gpu_master')
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the SQL statements-per-request histogram buckets
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def configure_logging():
+    """Set up level-controlled logging for the master"""
+    level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    logging.basicConfig(
+        level=getattr(logging, level, logging.INFO),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    logger.setLevel(getattr(logging, level, logging.INFO))
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """Render the histogram as Prometheus text lines"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestMetrics:
+    """Per-endpoint latency and SQL statement histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.statements = {}
+
+    def observe(self, endpoint, elapsed, statements):
+        with self.lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.statements[endpoint] = Histogram(STATEMENT_BUCKETS)
+            self.latency[endpoint].observe(elapsed)
+            self.statements[endpoint].observe(statements)
+
+    def render_prometheus(self):
+        """Render all histograms in the Prometheus text exposition format"""
+        with self.lock:
+            out = [
+                "# HELP gpu_master_request_duration_seconds Request latency per endpoint",
+                "# TYPE gpu_master_request_duration_seconds histogram",
+            ]
+            for endpoint, histogram in sorted(self.latency.items()):
+                out.extend(histogram.render("gpu_master_request_duration_seconds", f'endpoint="{endpoint}"'))
+            out.append("# HELP gpu_master_request_sql_statements SQL statements executed per request")
+            out.append("# TYPE gpu_master_request_sql_statements histogram")
+            for endpoint, histogram in sorted(self.statements.items()):
+                out.extend(histogram.render("gpu_master_request_sql_statements", f'endpoint="{endpoint}"'))
+        return "\n".join(out) + "\n"
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval into folded stacks"""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        """Write the samples in the folded format used by flamegraph.pl and speedscope"""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+request_metrics = RequestMetrics()
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+
+
+def init_app(app):
+    """Install request timing, SQL counting and profiling hooks on app"""
+    slow_request_seconds = float(os.environ.get('SLOW_REQUEST_MS', 1000)) / 1000.0
+    profile_mode = os.environ.get('PROFILE_REQUESTS', '').lower()
+    profile_dir = os.environ.get('PROFILE_DIR', 'profiles')
+
+    if not event.contains(Engine, 'before_cursor_execute', count_statement):
+        event.listen(Engine, 'before_cursor_execute', count_statement)
+
+    @app.before_request
+    def start_request_timer():
+        g.sql_statements = 0
+        g.profiler = None
+        if profile_mode == 'slow' or (profile_mode == '1' and request.args.get('profile') == '1'):
+            g.profiler = SamplingProfiler(threading.get_ident())
+            g.profiler.start()
+        g.request_started = time.perf_counter()
+
+    @app.teardown_request
+    def record_request(exc):
+        if 'request_started' not in g:
+            return
+        elapsed = time.perf_counter() - g.request_started
+        # Labelled by view name, without the blueprint prefix
+        endpoint = (request.endpoint or 'unmatched').rpartition('.')[2]
+        request_metrics.observe(endpoint, elapsed, g.sql_statements)
+
+        if elapsed > slow_request_seconds:
+            logger.warning("Slow request %s %s took %.1f ms with %d SQL statements",
+                           request.method, request.path, elapsed * 1000, g.sql_statements)
+        else:
+            logger.debug("%s %s took %.1f ms with %d SQL statements",
+                         request.method, request.path, elapsed * 1000, g.sql_statements)
+
+        if g.profiler:
+            g.profiler.stop()
+            if profile_mode != 'slow' or elapsed > slow_request_seconds:
+                os.makedirs(profile_dir, exist_ok=True)
+                path = os.path.join(
+                    profile_dir, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S.%f')}-{endpoint}.folded"
+                )
+                g.profiler.dump(path)
+                logger.info("Wrote profile for %s %s to %s", request.method, request.path, path)
@@ -1,71 +1,268 @@
-from flask import Flask, request, jsonify, render_template, redirect
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from flask import Blueprint, Flask, current_app, request, jsonify, render_template, redirect, Response, stream_with_context
+from sqlalchemy import insert, select, func
+from datetime import datetime, timedelta, timezone
 import secrets
+import hashlib
+import threading
 import json
 import os
 
-app = Flask(__name__)
-
-# Use environment variable for database URI if provided, otherwise use default
-db_uri = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///workers.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-# Worker model
-class Worker(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    worker_id = db.Column(db.String(50), unique=True, nullable=False)
-    token = db.Column(db.String(100), nullable=False)
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
-    metrics = db.Column(db.Text)  # Store metrics as JSON string
-
-    def get_metrics_json(self):
-        if self.metrics:
-            return json.loads(self.metrics)
+from alerts import AlertEngine, load_config as load_alert_config
+from anomaly import AnomalyDetector
+import compression
+from compression import request_json
+import export
+from fleet_state import FleetSnapshot, PROMETHEUS_CONTENT_TYPE, OPENMETRICS_CONTENT_TYPE, to_epoch
+from models import (db, init_db, Worker, Command, CommandOutput, GPUMetricsHistory, GPUProcessHistory,
+                    EXTENDED_SERIES, COMMAND_PAGE_SIZE, MAX_COMMAND_PAGE_SIZE, command_output_inline_chars,
+                    live_workers, set_command_output, command_output_text, command_page, command_summary)
+import migrate_db
+from purge import WorkerPurger
+import instrumentation
+from instrumentation import logger
+
+# The master's routes; create_app() registers them on a new app
+bp = Blueprint('master', __name__)
+
+def create_app(config=None):
+    """Build a master Flask app with its own in-memory state (see MasterState). Nothing touches
+    the database until the first request (or migrate_db.upgrade(), which __main__ runs before serving)"""
+    instrumentation.configure_logging()
+    app = Flask(__name__)
+    if config:
+        app.config.update(config)
+    instrumentation.init_app(app)
+    compression.init_app(app)
+    init_db(app)
+    app.register_blueprint(bp)
+    app.extensions['gpu_master'] = MasterState(app)
+    return app
+
+_app = None
+
+def get_app():
+    """Return the app `from master import app` refers to, creating it on first use"""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # Scripts that import app (export, archive, anomaly, benchmark) get one built on first access
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def create_tables():
+    """Bring the database schema up to date"""
+    migrate_db.upgrade(db.engine)
+
+def setting(app, name, default):
+    """A setting from the app's config, or else from the environment"""
+    return app.config.get(name, os.environ.get(name, default))
+
+# Deleted workers' rows are purged in the background, in this order, before the worker row itself
+PURGE_STEPS = [
+    ('gpu_metrics_history', GPUMetricsHistory.id, lambda worker_db_id: GPUMetricsHistory.worker_id == worker_db_id),
+    ('gpu_process_history', GPUProcessHistory.id, lambda worker_db_id: GPUProcessHistory.worker_id == worker_db_id),
+    ('command_output', CommandOutput.command_id, lambda worker_db_id: CommandOutput.command_id.in_(
+        select(Command.id).where(Command.worker_id == worker_db_id))),
+    ('command', Command.id, lambda worker_db_id: Command.worker_id == worker_db_id),
+]
+
+class MasterState:
+    """The in-memory side of one master app, kept in app.extensions['gpu_master'].
+
+    Every app built by create_app() has its own, so two apps in one process (e.g. on two
+    databases) never share fleet state, alerts or a purge thread. The getters below create
+    or load each component on first use in the current app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.RLock()
+        # Latest metrics of every worker, kept in memory so scrapers never hit the database
+        self.fleet_snapshot = FleetSnapshot()
+        # Alert rules evaluated on every metrics upload
+        self.alert_engine = AlertEngine(load_alert_config())
+        # Online anomaly detection over every GPU's metric series
+        self.anomaly_detector = AnomalyDetector(
+            z_threshold=float(setting(app, 'ANOMALY_Z_THRESHOLD', 4.0)),
+            peer_threshold=float(setting(app, 'ANOMALY_PEER_THRESHOLD', 5.0))
+        )
+        self.worker_purger = WorkerPurger(db, Worker, PURGE_STEPS,
+                                          batch_size=int(setting(app, 'PURGE_BATCH_SIZE', 5000)),
+                                          cleanups=[purge_archived_history])
+        # These need NumPy, so they and their modules are loaded on first use (or by
+        # preload() once the master is serving) rather than when the app is built
+        self.metrics_archive = None
+        self.recent_samples = None
+        self.fleet_analytics = None
+        # Metrics uploads handled at once (MAX_CONCURRENT_INGEST); None for no limit
+        max_concurrent_ingest = int(setting(app, 'MAX_CONCURRENT_INGEST', 0))
+        self.ingest_slots = threading.BoundedSemaphore(max_concurrent_ingest) if max_concurrent_ingest else None
+        # Rendered /api/v1/workers body and its ETag, reused until the snapshot's worker states
+        # change or the next active worker is due to turn inactive
+        self.v1_workers_cache = {'version': None, 'expires': 0.0, 'body': None, 'etag': None}
+        self.v1_workers_lock = threading.Lock()
+
+def master_state():
+    """Return the current app's MasterState"""
+    return current_app.extensions['gpu_master']
+
+def get_fleet_snapshot():
+    """Return the fleet snapshot, loading it from the database on first use"""
+    state = master_state()
+    if not state.fleet_snapshot.loaded:
+        with state.lock:
+            if not state.fleet_snapshot.loaded:
+                state.fleet_snapshot.load(live_workers().all())
+    return state.fleet_snapshot
+
+def get_alert_engine():
+    """Return the alert engine, starting its background threads on first use"""
+    state = master_state()
+    if not state.alert_engine.started:
+        with state.lock:
+            if not state.alert_engine.started:
+                state.alert_engine.start(get_fleet_snapshot().last_seen_times())
+    return state.alert_engine
+
+def get_anomaly_detector():
+    return master_state().anomaly_detector
+
+def get_metrics_archive():
+    """Return the reader of history older than the database retains, kept in compressed archive segments"""
+    state = master_state()
+    if state.metrics_archive is None:
+        from archive import ArchiveReader
+        with state.lock:
+            if state.metrics_archive is None:
+                state.metrics_archive = ArchiveReader(setting(state.app, 'ARCHIVE_DIR', 'archive'))
+    return state.metrics_archive
+
+def get_recent_samples():
+    """Return the last RECENT_SAMPLES samples of every GPU, which answer short history windows without the database"""
+    state = master_state()
+    if state.recent_samples is None:
+        from recent import RecentSamples
+        with state.lock:
+            if state.recent_samples is None:
+                state.recent_samples = RecentSamples(int(setting(state.app, 'RECENT_SAMPLES', 800)))
+    return state.recent_samples
+
+def get_analytics():
+    """Return the fleet-wide aggregate queries over the metrics history"""
+    state = master_state()
+    if state.fleet_analytics is None:
+        from analytics import FleetAnalytics
+        with state.lock:
+            if state.fleet_analytics is None:
+                state.fleet_analytics = FleetAnalytics(
+                    db, Worker, GPUMetricsHistory,
+                    cache_seconds=int(setting(state.app, 'ANALYTICS_CACHE_SECONDS', 60))
+                )
+    return state.fleet_analytics
+
+def purge_archived_history(worker_db_id):
+    """Remove a deleted worker's archived history, which a new worker registered under its ID would otherwise read"""
+    from archive import purge_worker
+    purge_worker(get_metrics_archive().archive_dir, worker_db_id, log=logger.info)
+
+def preload(app):
+    """Load app's lazily created components ahead of the requests that need them"""
+    with app.app_context():
+        get_metrics_archive()
+        get_recent_samples()
+        get_analytics()
+
+def get_worker_purger():
+    """Return the worker purger, starting its thread (and resuming interrupted purges) on first use"""
+    state = master_state()
+    if not state.worker_purger.started:
+        state.worker_purger.start(state.app)
+    return state.worker_purger
+
+# A deleted worker keeps its row under this prefix until it is purged, so its ID is free at once
+DELETED_WORKER_PREFIX = '~deleted-'
+
+# Backlogged samples from workers that lost or failed over between masters are accepted for this long
+late_data_max_age = timedelta(hours=float(os.environ.get('LATE_DATA_MAX_HOURS', 24)))
+# Sample times this far ahead of the master's clock are taken as clock skew and stored at the master's time
+late_data_max_skew = timedelta(seconds=float(os.environ.get('LATE_DATA_MAX_SKEW', 60)))
+
+def parse_sample_time(value, now):
+    """Parse a worker's UTC sample time, returning None for local, too far future or too old times"""
+    try:
+        sample_time = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
         return None
+    if sample_time.tzinfo is None:
+        return None
+    sample_time = sample_time.astimezone(timezone.utc).replace(tzinfo=None)
+    if sample_time > now + late_data_max_skew or sample_time < now - late_data_max_age:
+        return None
+    return min(sample_time, now)
 
-# Command model
-class Command(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    worker_id = db.Column(db.Integer, db.ForeignKey('worker.id'), nullable=False)
-    command_text = db.Column(db.String(500), nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
-    output = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    worker = db.relationship('Worker', backref=db.backref('commands', lazy=True))
-
-# GPU Metrics History model
-class GPUMetricsHistory(db.Model):
-    __tablename__ = 'gpu_metrics_history'  # Explicitly define table name
-    id = db.Column(db.Integer, primary_key=True)
-    worker_id = db.Column(db.Integer, db.ForeignKey('worker.id'), nullable=False)
-    gpu_index = db.Column(db.Integer, nullable=False)  # Index of the GPU in the worker's system
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    temperature = db.Column(db.Float)  # GPU temperature in Celsius
-    utilization = db.Column(db.Float)  # GPU utilization percentage
-    memory_used = db.Column(db.Float)  # Memory used in MB
-    memory_total = db.Column(db.Float)  # Total memory in MB
-    power_usage = db.Column(db.Float, nullable=True)  # Power usage in Watts (if available)
-    
-    @property
-    def memory_utilization(self):
-        """Calculate memory utilization as a percentage"""
-        if self.memory_total and self.memory_total > 0:
-            return (self.memory_used / self.memory_total) * 100
-        return 0
-    
-    worker = db.relationship('Worker', backref=db.backref('metrics_history', lazy=True))
+def parse_interval(value):
+    """Parse the sampling interval a worker reported, returning None if it is missing or invalid"""
+    try:
+        interval = float(value)
+    except (TypeError, ValueError):
+        return None
+    return interval if 0 < interval <= 86400 else None
+
+def history_rows(worker_db_id, timestamp, gpus, sample_interval=None):
+    """Build gpu_metrics_history rows for one upload"""
+    return [{
+        'worker_id': worker_db_id,
+        'gpu_index': gpu_index,
+        'timestamp': timestamp,
+        'temperature': gpu_data.get('temp'),
+        'utilization': gpu_data.get('util'),
+        'memory_used': gpu_data.get('memory', {}).get('used', 0),
+        'memory_total': gpu_data.get('memory', {}).get('total', 0),
+        'power_usage': gpu_data.get('power_usage'),  # This might be None if not available
+        'sample_interval': sample_interval,
+        'sm_clock': (gpu_data.get('clocks') or {}).get('sm'),
+        'memory_clock': (gpu_data.get('clocks') or {}).get('memory'),
+        'fan_speed': gpu_data.get('fan'),
+        'throttle_reasons': gpu_data.get('throttle_mask'),
+        'ecc_corrected': (gpu_data.get('ecc') or {}).get('corrected'),
+        'ecc_uncorrected': (gpu_data.get('ecc') or {}).get('uncorrected'),
+        'pcie_tx': (gpu_data.get('pcie') or {}).get('tx'),
+        'pcie_rx': (gpu_data.get('pcie') or {}).get('rx'),
+        'nvlink_tx': (gpu_data.get('nvlink') or {}).get('tx'),
+        'nvlink_rx': (gpu_data.get('nvlink') or {}).get('rx'),
+    } for gpu_index, gpu_data in enumerate(gpus)]
+
+def process_rows(worker_db_id, timestamp, gpus, sample_interval=None):
+    """Build gpu_process_history rows for the processes in one upload"""
+    return [{
+        'worker_id': worker_db_id,
+        'gpu_index': gpu_index,
+        'timestamp': timestamp,
+        'pid': process['pid'],
+        'name': (process.get('name') or '')[:100] or None,
+        'memory_used': process.get('memory_used'),
+        'sm_utilization': process.get('sm_util'),
+        'sample_interval': sample_interval,
+    } for gpu_index, gpu_data in enumerate(gpus) for process in gpu_data.get('processes') or []
+        if isinstance(process.get('pid'), int)]
+
+# Upload interval suggested to workers in every metrics response, in seconds (optional)
+suggested_interval = os.environ.get('WORKER_INTERVAL')
+
+# Beyond MAX_CONCURRENT_INGEST uploads at once (MasterState.ingest_slots), workers are told
+# to come back later instead of piling up behind the database
+retry_after_seconds = int(os.environ.get('RETRY_AFTER_SECONDS', 5))
 
 # Generate a unique token
 def generate_token():
     return secrets.token_hex(16)
 
 # Register a new worker
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     data = request.json
     worker_id = data.get('worker_id')
@@ -73,6 +270,8 @@ def register():
     # Check if worker_id is provided and unique
     if not worker_id:
         return jsonify({"status": "error", "message": "Worker ID missing"}), 400
+    if worker_id.startswith(DELETED_WORKER_PREFIX):
+        return jsonify({"status": "error", "message": f"Worker IDs starting with {DELETED_WORKER_PREFIX} are reserved"}), 400
     
     existing_worker = Worker.query.filter_by(worker_id=worker_id).first()
     if existing_worker:
@@ -84,13 +283,27 @@ def register():
     worker = Worker(worker_id=worker_id, token=token)
     db.session.add(worker)
     db.session.commit()
+    # Listed on the dashboard before its first upload
+    get_fleet_snapshot().update(worker.worker_id, worker.last_seen, [])
     return jsonify({"token": token})
 
 # Receive metrics from workers
-@app.route('/metrics', methods=['POST'])
+@bp.route('/metrics', methods=['POST'])
 def receive_metrics():
+    ingest_slots = master_state().ingest_slots
+    if ingest_slots and not ingest_slots.acquire(blocking=False):
+        response = jsonify({"status": "error", "message": "Master is busy, retry later"})
+        response.headers['Retry-After'] = str(retry_after_seconds)
+        return response, 503
+    try:
+        return store_metrics()
+    finally:
+        if ingest_slots:
+            ingest_slots.release()
+
+def store_metrics():
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
-    data = request.json
+    data = request_json()
     
     worker = Worker.query.filter_by(token=token).first()
     if not worker:
@@ -100,30 +313,75 @@ def receive_metrics():
     worker.metrics = json.dumps(data['metrics'])
     worker.last_seen = datetime.utcnow()
     
-    # Store historical metrics data
+    # Store historical metrics data; workers with adaptive sampling report how long each sample stands for
     current_time = datetime.utcnow()
     metrics = data['metrics']
+    worker.report_interval = parse_interval(metrics.get('interval'))
+    rows = history_rows(worker.id, current_time, metrics.get('gpus', []), worker.report_interval)
+    processes = process_rows(worker.id, current_time, metrics.get('gpus', []), worker.report_interval)
     
-    if 'gpus' in metrics:
-        for gpu_index, gpu_data in enumerate(metrics['gpus']):
-            # Create a new metrics history record
-            metrics_history = GPUMetricsHistory(
-                worker_id=worker.id,
-                gpu_index=gpu_index,
-                timestamp=current_time,
-                temperature=gpu_data.get('temp'),
-                utilization=gpu_data.get('util'),
-                memory_used=gpu_data.get('memory', {}).get('used', 0),
-                memory_total=gpu_data.get('memory', {}).get('total', 0),
-                power_usage=gpu_data.get('power_usage') # This might be None if not available
-            )
-            db.session.add(metrics_history)
+    # Uploads a worker could not deliver earlier (e.g. while failing over from another
+    # master) only go into the history at their own sample times; they never replace
+    # the worker's latest metrics or move last_seen back
+    upload_rows = len(rows)
+    late_samples = 0
+    rejected_samples = 0
+    for sample in data.get('backlog') or []:
+        if not sample.get('gpus'):
+            continue
+        sample_time = parse_sample_time(sample.get('timestamp'), current_time)
+        if sample_time is None:
+            rejected_samples += 1
+        else:
+            sample_interval = parse_interval(sample.get('interval'))
+            rows.extend(history_rows(worker.id, sample_time, sample['gpus'], sample_interval))
+            processes.extend(process_rows(worker.id, sample_time, sample['gpus'], sample_interval))
+            get_recent_samples().late(worker.worker_id, sample_time)
+            late_samples += 1
+    if rejected_samples:
+        logger.warning("Rejected %d backlog samples from worker %s with missing, future or too old times",
+                       rejected_samples, worker.worker_id)
     
+    if rows:
+        db.session.execute(insert(GPUMetricsHistory), rows)
+    if processes:
+        db.session.execute(insert(GPUProcessHistory), processes)
     db.session.commit()
-    return jsonify({"status": "success"})
+    get_recent_samples().add(worker.worker_id, current_time, rows[:upload_rows])
+    get_fleet_snapshot().update(worker.worker_id, worker.last_seen, metrics.get('gpus', []), worker.report_interval)
+    get_alert_engine().evaluate(worker.worker_id, current_time, metrics.get('gpus', []))
+    get_worker_purger()
+    get_anomaly_detector().observe(worker.worker_id, current_time, metrics.get('gpus', []))
+    result = {"status": "success"}
+    if late_samples:
+        result["late_samples"] = late_samples
+    if rejected_samples:
+        result["rejected_samples"] = rejected_samples
+    if suggested_interval:
+        result["suggested_interval"] = float(suggested_interval)
+    return jsonify(result)
+
+def delete_workers_later(workers):
+    """Mark workers deleted in one short transaction and queue the purge of their data"""
+    purger = get_worker_purger()  # Started first, so these workers are not also picked up as interrupted
+    deleted = [(worker.id, worker.worker_id) for worker in workers]
+    now = datetime.utcnow()
+    for worker in workers:
+        # The worker ID is free for re-registration at once and the old token stops working
+        worker.worker_id = f"{DELETED_WORKER_PREFIX}{worker.id}"
+        worker.token = generate_token()
+        worker.metrics = None
+        worker.deleted_at = now
+    db.session.commit()
+    for _, worker_id in deleted:
+        get_fleet_snapshot().forget(worker_id)
+        get_recent_samples().forget(worker_id)
+        get_alert_engine().forget(worker_id)
+        get_anomaly_detector().forget(worker_id)
+    return purger.submit(deleted)
 
 # Send commands to workers
-@app.route('/commands', methods=['GET'])
+@bp.route('/commands', methods=['GET'])
 def get_command():
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     
@@ -141,10 +399,10 @@ def get_command():
     return jsonify({"command": None})
 
 # Receive command output
-@app.route('/command_output', methods=['POST'])
+@bp.route('/command_output', methods=['POST'])
 def receive_output():
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
-    data = request.json
+    data = request_json()
     
     worker = Worker.query.filter_by(token=token).first()
     if not worker:
@@ -157,73 +415,192 @@ def receive_output():
         return jsonify({"status": "error", "message": "Invalid command"}), 400
     
     # Update command output and status
-    command.output = data['output']
+    set_command_output(command, data.get('output'))
     command.status = data['status']
     command.updated_at = datetime.utcnow()
     db.session.commit()
     
     return jsonify({"status": "success"})
 
-# Web interface routes
-@app.route('/')
+# Web interface routes; the dashboard loads its data from the fleet APIs below
+@bp.route('/')
 def index():
-    workers = Worker.query.all()
-    now = datetime.utcnow()
-    return render_template('index.html', workers=workers, now=now)
+    return render_template('index.html')
+
+# Workers per page in the fleet worker list, and the most a client may ask for
+WORKER_PAGE_SIZE = 50
+MAX_WORKER_PAGE_SIZE = 500
+
+# API endpoint summarizing the fleet from the in-memory snapshot: worker and GPU counts,
+# per-model aggregates, hottest and idlest GPUs and workers that stopped reporting
+@bp.route('/api/fleet/summary')
+def get_fleet_summary():
+    top = min(max(request.args.get('top', 10, type=int), 0), 100)
+    # A federation aggregator excludes workers that failed over to another master (?exclude=<worker_id>, repeatable)
+    return jsonify(get_fleet_snapshot().summary(top=top, exclude=set(request.args.getlist('exclude'))))
+
+# API endpoint paging through the fleet in worker ID order; pass the returned next_after as ?after=
+@bp.route('/api/fleet/workers')
+def get_fleet_workers():
+    limit = request.args.get('limit', WORKER_PAGE_SIZE, type=int)
+    if not limit or limit < 1:
+        return jsonify({'status': 'error', 'message': 'limit must be a positive integer'}), 400
+    status = request.args.get('status')
+    if status not in (None, '', 'active', 'inactive'):
+        return jsonify({'status': 'error', 'message': 'status must be active or inactive'}), 400
+    workers, next_after = get_fleet_snapshot().list_workers(
+        after=request.args.get('after'), limit=min(limit, MAX_WORKER_PAGE_SIZE), status=status,
+        search=request.args.get('q'), model=request.args.get('model')
+    )
+    return jsonify({'workers': workers, 'next_after': next_after})
+
+# Version of the /api/v1 read API, sent with every v1 response
+READ_API_VERSION = 1
+
+def conditional_json(body, etag):
+    """A JSON response with a (weak, as it may be compressed) ETag, or 304 if the client already has it"""
+    response = Response(body, content_type='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-API-Version'] = str(READ_API_VERSION)
+    return response.make_conditional(request)
+
+def body_etag(body):
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=12).hexdigest()
+
+# Versioned read API listing every worker with only what dashboards render (status and GPU models);
+# served from the fleet snapshot, and answered with 304 while nothing changed
+@bp.route('/api/v1/workers')
+def get_workers_v1():
+    snapshot = get_fleet_snapshot()
+    now = to_epoch(datetime.utcnow())
+    state = master_state()
+    with state.v1_workers_lock:
+        cache = state.v1_workers_cache
+        if cache['version'] != snapshot.states_version or now >= cache['expires']:
+            rows, version, expires = snapshot.worker_states()
+            body = json.dumps({'api_version': READ_API_VERSION, 'workers': rows}, separators=(',', ':'))
+            cache.update(version=version, expires=expires, body=body, etag=body_etag(body))
+        body, etag = cache['body'], cache['etag']
+    return conditional_json(body, etag)
+
+# Versioned read API for one worker: its row as in /api/v1/workers and a page of its commands
+# (newest first, without output; pass next_before as ?before= for older ones)
+@bp.route('/api/v1/workers/<worker_id>')
+def get_worker_v1(worker_id):
+    state = get_fleet_snapshot().worker_state(worker_id)
+    worker = Worker.query.filter_by(worker_id=worker_id).first() if state else None
+    if not worker:
+        return jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404
+    limit = min(max(request.args.get('limit', COMMAND_PAGE_SIZE, type=int), 1), MAX_COMMAND_PAGE_SIZE)
+    commands = command_page(worker.id, request.args.get('before', type=int), limit)
+    body = json.dumps({
+        'api_version': READ_API_VERSION,
+        'worker': state,
+        'commands': [command_summary(command) for command in commands],
+        'next_before': commands[-1].id if len(commands) == limit else None,
+    }, separators=(',', ':'))
+    return conditional_json(body, body_etag(body))
+
+# Prometheus/OpenMetrics exporter served from the in-memory fleet snapshot
+@bp.route('/metrics/prometheus')
+def prometheus_metrics():
+    openmetrics = 'application/openmetrics-text' in request.headers.get('Accept', '')
+    body = get_fleet_snapshot().render_prometheus(
+        openmetrics=openmetrics, extra=instrumentation.request_metrics.render_prometheus())
+    return Response(body, content_type=OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
 
 # API endpoint to get historical metrics data for a specific worker and GPU
-@app.route('/api/metrics/history/<worker_id>/<int:gpu_index>')
+
+# Sample columns the chart series are computed from; ?extended=1 also needs EXTENDED_SERIES
+HISTORY_COLUMNS = ('temperature', 'utilization', 'memory_used', 'memory_total', 'power_usage', 'sample_interval')
+
+def empty_history(extended=()):
+    """The metrics history API's series, with no samples yet"""
+    result = {
+        'timestamps': [],
+        'temperature': [],
+        'utilization': [],
+        'memory_utilization': [],
+        'power_usage': [],
+        'sample_interval': []
+    }
+    for name in extended:
+        result[name] = []
+    return result
+
+def add_array_samples(result, timestamps, values, extended=()):
+    """Append samples held in arrays (archive segments, recent rings) to a history response"""
+    import numpy as np
+    # float32 values are rounded so they serialize as reported rather than as 55.29999923706055
+    for name in ['sample_interval'] + list(extended):
+        column = np.round(values[name].astype(np.float64), 3)
+        result[name].extend(np.where(np.isnan(column), None, column).tolist())
+    # Unreported chart values are 0, like for rows read from the database
+    values = {name: np.nan_to_num(np.round(column.astype(np.float64), 3)) for name, column in values.items()}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        memory_utilization = np.where(values['memory_total'] > 0,
+                                      values['memory_used'] / values['memory_total'] * 100, 0)
+    result['timestamps'].extend(np.datetime_as_string(timestamps, unit='us').tolist())
+    result['temperature'].extend(values['temperature'].tolist())
+    result['utilization'].extend(values['utilization'].tolist())
+    result['memory_utilization'].extend(memory_utilization.tolist())
+    result['power_usage'].extend(values['power_usage'].tolist())
+
+@bp.route('/api/metrics/history/<worker_id>/<int:gpu_index>')
 def get_metrics_history(worker_id, gpu_index):
     try:
         # Get time range from query parameters (default to last 24 hours)
         hours = request.args.get('hours', 24, type=int)
         start_time = datetime.utcnow() - timedelta(hours=hours)
+        # Extended telemetry series are only sent on request (?extended=1); null where not reported
+        extended = list(EXTENDED_SERIES) if request.args.get('extended', type=int) else []
         
-        print(f"\n---------- METRICS API REQUEST ----------")
-        print(f"Fetching metrics history for worker_id={worker_id}, gpu_index={gpu_index}, hours={hours}")
-        print(f"Start time: {start_time.isoformat()}")
+        logger.debug("Fetching metrics history for worker_id=%s, gpu_index=%s, hours=%s", worker_id, gpu_index, hours)
+        
+        # Windows the GPU's ring of recent samples fully covers are answered without the database,
+        # provided the ring keeps every column the response needs. Rings keep the chart series'
+        # columns only (recent.COLUMNS), so ?extended=1 is always read from the archive and database.
+        recent = get_recent_samples().window(worker_id, gpu_index, start_time, HISTORY_COLUMNS + tuple(extended))
+        if recent is not None and len(recent[0]):
+            result = empty_history(extended)
+            add_array_samples(result, *recent, extended)
+            response = jsonify(result)
+            response.headers['X-History-Source'] = 'memory'
+            return response
         
         # Get the worker
         worker = Worker.query.filter_by(worker_id=worker_id).first()
         if not worker:
-            print(f"Error: Worker with ID {worker_id} not found")
+            logger.debug("Worker with ID %s not found", worker_id)
             return jsonify({
                 'error': f"Worker with ID {worker_id} not found",
                 'timestamps': [],
                 'temperature': [],
                 'utilization': [],
                 'memory_utilization': [],
-                'power_usage': []
+                'power_usage': [],
+                'sample_interval': []
             }), 404
-            
-        print(f"Found worker with ID {worker.id}")
         
-        # Check if any metrics exist for this worker
-        total_metrics = GPUMetricsHistory.query.filter_by(worker_id=worker.id).count()
-        print(f"Total metrics for worker {worker.id} in database: {total_metrics}")
-        
-        if total_metrics == 0:
-            print(f"Warning: No metrics found for worker {worker.id} in database")
-            return jsonify({
-                'timestamps': [],
-                'temperature': [],
-                'utilization': [],
-                'memory_utilization': [],
-                'power_usage': []
-            })
+        # Windows reaching back before the archive boundary are read from archive
+        # segments up to the boundary and from the database after it
+        archived = None
+        database_start = start_time
+        archived_until = get_metrics_archive().archived_until()
+        if archived_until and start_time < archived_until:
+            archived = get_metrics_archive().read(worker_id, gpu_index, start_time, archived_until, worker.id)
+            database_start = archived_until
         
         # Query for metrics history with the specified time range
         metrics = GPUMetricsHistory.query.filter(
             GPUMetricsHistory.worker_id == worker.id,
             GPUMetricsHistory.gpu_index == gpu_index,
-            GPUMetricsHistory.timestamp >= start_time
+            GPUMetricsHistory.timestamp >= database_start
         ).order_by(GPUMetricsHistory.timestamp).all()
         
-        print(f"Found {len(metrics)} metrics records for the specified time range (past {hours} hours)")
-        
         # If no metrics found in the time range, try to get some recent data
-        if len(metrics) == 0:
-            print("No metrics found with time filter, trying to get the most recent records")
+        if len(metrics) == 0 and (archived is None or len(archived[0]) == 0):
             metrics = GPUMetricsHistory.query.filter(
                 GPUMetricsHistory.worker_id == worker.id,
                 GPUMetricsHistory.gpu_index == gpu_index
@@ -231,16 +608,14 @@ def get_metrics_history(worker_id, gpu_index):
             
             # Reverse to get chronological order
             metrics.reverse()
-            print(f"Found {len(metrics)} recent metrics records without time filter")
         
-        # Format the data for charts
-        result = {
-            'timestamps': [],
-            'temperature': [],
-            'utilization': [],
-            'memory_utilization': [],
-            'power_usage': []
-        }
+        # Format the data for charts; samples may be irregularly spaced, and
+        # sample_interval says how long each one stands for (null if unknown)
+        result = empty_history(extended)
+        
+        # Archived samples come first
+        if archived is not None and len(archived[0]):
+            add_array_samples(result, *archived, extended)
         
         # Process metrics data
         for metric in metrics:
@@ -252,23 +627,19 @@ def get_metrics_history(worker_id, gpu_index):
             result['utilization'].append(float(metric.utilization) if metric.utilization is not None else 0)
             result['memory_utilization'].append(float(metric.memory_utilization) if metric.memory_utilization is not None else 0)
             result['power_usage'].append(float(metric.power_usage) if metric.power_usage is not None else 0)
+            result['sample_interval'].append(metric.sample_interval)
+            for name in extended:
+                result[name].append(getattr(metric, name))
         
-        # Add debug output
-        print(f"Returning {len(result['timestamps'])} data points")
-        if len(result['timestamps']) > 0:
-            print(f"Time range: {result['timestamps'][0]} to {result['timestamps'][-1]}")
-            print(f"Sample data point - Temperature: {result['temperature'][0]}, "
-                  f"Utilization: {result['utilization'][0]}, "
-                  f"Memory: {result['memory_utilization'][0]}, "
-                  f"Power: {result['power_usage'][0]}")
-        print("----------------------------------------\n")
+        logger.debug("Returning %d data points for worker_id=%s, gpu_index=%s",
+                     len(result['timestamps']), worker_id, gpu_index)
         
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers['X-History-Source'] = 'database'
+        return response
         
     except Exception as e:
-        print(f"Error in get_metrics_history: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_metrics_history")
         
         # Return empty data with error message
         return jsonify({
@@ -277,17 +648,173 @@ def get_metrics_history(worker_id, gpu_index):
             'temperature': [],
             'utilization': [],
             'memory_utilization': [],
-            'power_usage': []
+            'power_usage': [],
+            'sample_interval': []
         })
 
-@app.route('/worker/<worker_id>')
+# API endpoint reporting the memory held by the rings of recent samples
+@bp.route('/api/metrics/recent')
+def get_recent_samples_stats():
+    return jsonify(get_recent_samples().stats())
+
+# API endpoint for fleet-wide aggregates (per model/worker/GPU stats, top-k GPUs, time buckets)
+@bp.route('/api/fleet/analytics')
+def get_fleet_analytics():
+    from analytics import METRICS, GROUP_BY
+    hours = request.args.get('hours', 6, type=float)
+    metric = request.args.get('metric', 'utilization')
+    group_by = request.args.get('group_by', 'model')
+    granularity = request.args.get('granularity', type=int)
+    top = request.args.get('top', 20, type=int)
+    order = request.args.get('order', 'desc')
+
+    if metric not in METRICS:
+        return jsonify({'status': 'error', 'message': f"metric must be one of {', '.join(METRICS)}"}), 400
+    if group_by not in GROUP_BY:
+        return jsonify({'status': 'error', 'message': f"group_by must be one of {', '.join(GROUP_BY)}"}), 400
+    if order not in ('asc', 'desc'):
+        return jsonify({'status': 'error', 'message': 'order must be asc or desc'}), 400
+    if not hours or hours <= 0 or top < 0 or (granularity is not None and granularity <= 0):
+        return jsonify({'status': 'error', 'message': 'hours, top and granularity must be positive'}), 400
+    if granularity and hours * 3600 / granularity > 10000:
+        return jsonify({'status': 'error', 'message': 'granularity is too fine for the requested window'}), 400
+
+    return jsonify(get_analytics().query(hours, metric, group_by, granularity, top, order))
+
+# API endpoint streaming metrics history as CSV or Parquet for bulk export
+@bp.route('/api/metrics/export')
+def export_metrics_history():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({'status': 'error', 'message': f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    if fmt == 'parquet' and not export.parquet_available():
+        return jsonify({'status': 'error', 'message': 'Parquet export requires pyarrow on the master'}), 400
+    try:
+        start_time = export.parse_time(request.args.get('start'))
+        end_time = export.parse_time(request.args.get('end'))
+        gpu_indexes = export.parse_list(request.args.get('gpu'), int)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'start/end must be ISO 8601 times and gpu a list of indexes'}), 400
+
+    stmt = export.export_query(Worker, GPUMetricsHistory, export.parse_list(request.args.get('worker_id')),
+                               gpu_indexes, start_time, end_time)
+    filename = f"gpu_metrics_history.{fmt}"
+    return Response(
+        stream_with_context(export.export_chunks(db.engine, stmt, fmt)),
+        content_type=export.CONTENT_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# API endpoint listing every worker with its latest metrics (also used by the Cockpit plugin and aggregator)
+@bp.route('/api/workers')
+def get_workers():
+    return jsonify([{
+        'id': worker.id,
+        'worker_id': worker.worker_id,
+        'last_seen': worker.last_seen.isoformat(),
+        'report_interval': worker.report_interval,
+        'metrics': worker.metrics
+    } for worker in live_workers().all()])
+
+# API endpoint queueing a command on one or more workers
+@bp.route('/api/submit_command', methods=['POST'])
+def api_submit_command():
+    data = request.get_json(silent=True) or {}
+    worker_ids = data.get('worker_ids') or ([data['worker_id']] if data.get('worker_id') else [])
+    command_text = data.get('command')
+    if not worker_ids or not command_text:
+        return jsonify({'status': 'error', 'message': 'worker_ids and command are required'}), 400
+
+    workers = Worker.query.filter(Worker.worker_id.in_(worker_ids)).all()
+    commands = [Command(worker_id=worker.id, command_text=command_text) for worker in workers]
+    db.session.add_all(commands)
+    db.session.commit()
+
+    found = {worker.worker_id for worker in workers}
+    return jsonify({
+        'status': 'success',
+        'commands': [{'worker_id': worker.worker_id, 'command_id': command.id}
+                     for worker, command in zip(workers, commands)],
+        'missing': [worker_id for worker_id in worker_ids if worker_id not in found]
+    })
+
+# API endpoint listing currently firing alerts
+@bp.route('/api/alerts')
+def get_alerts():
+    return jsonify({'alerts': get_alert_engine().active_alerts()})
+
+# API endpoint listing GPUs whose metrics currently look anomalous
+@bp.route('/api/anomalies')
+def get_anomalies():
+    return jsonify({'anomalies': get_anomaly_detector().current_anomalies()})
+
+# API endpoint accounting GPU use per process on a worker: GPU time, SM time and peak memory
+@bp.route('/api/processes/<worker_id>')
+def get_process_accounting(worker_id):
+    from analytics import DEFAULT_SAMPLE_INTERVAL
+    hours = request.args.get('hours', 24, type=float)
+    if not hours or hours <= 0:
+        return jsonify({'status': 'error', 'message': 'hours must be positive'}), 400
+    worker = Worker.query.filter_by(worker_id=worker_id).first()
+    if not worker:
+        return jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404
+
+    start_time = datetime.utcnow() - timedelta(hours=hours)
+    process = GPUProcessHistory
+    interval = func.coalesce(process.sample_interval, DEFAULT_SAMPLE_INTERVAL)
+    rows = db.session.query(
+        process.gpu_index, process.pid, process.name,
+        func.min(process.timestamp), func.max(process.timestamp), func.count(),
+        func.sum(interval), func.sum(func.coalesce(process.sm_utilization, 0) * interval / 100.0),
+        func.max(process.memory_used)
+    ).filter(
+        process.worker_id == worker.id,
+        process.timestamp >= start_time
+    ).group_by(process.gpu_index, process.pid, process.name).all()
+
+    processes = [{
+        'gpu_index': gpu_index,
+        'pid': pid,
+        'name': name,
+        'first_seen': first_seen.isoformat(),
+        'last_seen': last_seen.isoformat(),
+        'samples': samples,
+        'gpu_seconds': round(gpu_seconds or 0, 1),
+        'sm_seconds': round(sm_seconds or 0, 1),
+        'max_memory_used': max_memory_used,
+    } for gpu_index, pid, name, first_seen, last_seen, samples, gpu_seconds, sm_seconds, max_memory_used in rows]
+    processes.sort(key=lambda p: p['sm_seconds'], reverse=True)
+    return jsonify({'worker_id': worker_id, 'hours': hours, 'processes': processes})
+
+# API endpoint listing a worker's commands newest first, without their output; pass the
+# returned next_before as ?before= to get the next page
+@bp.route('/api/commands/<worker_id>')
+def get_commands(worker_id):
+    limit = request.args.get('limit', COMMAND_PAGE_SIZE, type=int)
+    if not limit or limit < 1:
+        return jsonify({'status': 'error', 'message': 'limit must be a positive integer'}), 400
+    limit = min(limit, MAX_COMMAND_PAGE_SIZE)
+    worker = Worker.query.filter_by(worker_id=worker_id).first()
+    if not worker:
+        return jsonify({'status': 'error', 'message': f"Worker {worker_id} not found"}), 404
+
+    commands = command_page(worker.id, request.args.get('before', type=int), limit, request.args.get('status'))
+    return jsonify({
+        'worker_id': worker_id,
+        'commands': [command_summary(command) for command in commands],
+        'next_before': commands[-1].id if len(commands) == limit else None,
+    })
+
+@bp.route('/worker/<worker_id>')
 def worker_details(worker_id):
     worker = Worker.query.filter_by(worker_id=worker_id).first_or_404()
-    commands = Command.query.filter_by(worker_id=worker.id).order_by(Command.id.desc()).limit(10).all()
-    return render_template('worker.html', worker=worker, commands=commands)
+    commands = command_page(worker.id, request.args.get('before', type=int), limit=10, with_output=True)
+    next_before = commands[-1].id if len(commands) == 10 else None
+    return render_template('worker.html', worker=worker, commands=commands, next_before=next_before,
+                           output_tail=command_output_inline_chars)
 
 # Submit a command
-@app.route('/submit_command', methods=['POST'])
+@bp.route('/submit_command', methods=['POST'])
 def submit_command():
     worker_id = request.form['worker_id']
     command_text = request.form['command']
@@ -301,7 +828,7 @@ def submit_command():
     return redirect('/')
 
 # Submit command to multiple workers
-@app.route('/submit_multi_command', methods=['POST'])
+@bp.route('/submit_multi_command', methods=['POST'])
 def submit_multi_command():
     worker_ids = request.form.getlist('worker_ids')
     command_text = request.form.get('command')
@@ -318,7 +845,7 @@ def submit_multi_command():
     return redirect('/')
 
 # Stop a running command
-@app.route('/stop_command/<int:command_id>', methods=['POST'])
+@bp.route('/stop_command/<int:command_id>', methods=['POST'])
 def stop_command(command_id):
     command = Command.query.get_or_404(command_id)
     worker = Worker.query.get(command.worker_id)
@@ -331,7 +858,7 @@ def stop_command(command_id):
     return redirect(f'/worker/{worker.worker_id}')
 
 # GPU Overclocking API endpoints
-@app.route('/api/gpu/set_tdp', methods=['POST'])
+@bp.route('/api/gpu/set_tdp', methods=['POST'])
 def set_gpu_tdp():
     """Set the TDP (power limit) for a specific GPU"""
     try:
@@ -385,10 +912,10 @@ def set_gpu_tdp():
         })
         
     except Exception as e:
-        print(f"Error setting GPU TDP: {str(e)}")
+        logger.exception("Error setting GPU TDP")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/api/gpu/get_power_limits', methods=['GET'])
+@bp.route('/api/gpu/get_power_limits', methods=['GET'])
 def get_gpu_power_limits():
     """Get the current and maximum power limits for GPUs on a worker"""
     try:
@@ -419,8 +946,7 @@ def get_gpu_power_limits():
         db.session.add(cmd)
         db.session.commit()
         
-        # Log the command for debugging
-        print(f"Created power limits command: {cmd.id} - {cmd.command_text}")
+        logger.debug("Created power limits command: %s - %s", cmd.id, cmd.command_text)
         
         return jsonify({
             'status': 'success',
@@ -429,64 +955,91 @@ def get_gpu_power_limits():
         })
         
     except Exception as e:
-        print(f"Error getting GPU power limits: {str(e)}")
+        logger.exception("Error getting GPU power limits")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 # Get real-time command output
-@app.route('/command_output/<int:command_id>', methods=['GET'])
+@bp.route('/command_output/<int:command_id>', methods=['GET'])
 def get_command_output(command_id):
     try:
         command = Command.query.get_or_404(command_id)
         
-        # Log command status for debugging
-        print(f"Command {command_id} status: {command.status}, output length: {len(command.output) if command.output else 0}")
+        logger.debug("Command %s status: %s", command_id, command.status)
         
-        return jsonify({
+        # ?output=0 leaves the output out, for polling the status alone; ?tail=N returns only
+        # the last N characters, for polling long-running commands
+        result = {
             'status': command.status,
-            'output': command.output,
+            'output_size': command.output_size,
             'updated_at': command.updated_at.isoformat()
-        })
+        }
+        if request.args.get('output', 1, type=int):
+            result['output'] = command_output_text(command, request.args.get('tail', type=int))
+        return jsonify(result)
     except Exception as e:
-        print(f"Error retrieving command output for {command_id}: {str(e)}")
+        logger.exception("Error retrieving command output for %s", command_id)
         return jsonify({
             'status': 'error',
             'output': f"Error retrieving command: {str(e)}",
             'updated_at': datetime.utcnow().isoformat()
         }), 500
 
-# Delete a worker
-@app.route('/delete_worker/<worker_id>', methods=['POST'])
+# Download a command's full output as text
+@bp.route('/command_output/<int:command_id>/download')
+def download_command_output(command_id):
+    command = Command.query.get_or_404(command_id)
+    return Response(command_output_text(command) or '', content_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename="command-{command_id}.txt"'})
+
+# Delete a worker; its data is purged in the background
+@bp.route('/delete_worker/<worker_id>', methods=['POST'])
 def delete_worker(worker_id):
     worker = Worker.query.filter_by(worker_id=worker_id).first_or_404()
-    
-    # Delete all commands associated with this worker
-    Command.query.filter_by(worker_id=worker.id).delete()
-    
-    # Delete the worker
-    db.session.delete(worker)
-    db.session.commit()
-    
+    delete_workers_later([worker])
     return redirect('/')
 
 # Delete multiple workers
-@app.route('/delete_workers', methods=['POST'])
+@bp.route('/delete_workers', methods=['POST'])
 def delete_workers():
     worker_ids = request.form.getlist('worker_ids')
     
     if worker_ids:
-        for worker_id in worker_ids:
-            worker = Worker.query.filter_by(worker_id=worker_id).first()
-            if worker:
-                # Delete all commands associated with this worker
-                Command.query.filter_by(worker_id=worker.id).delete()
-                # Delete the worker
-                db.session.delete(worker)
-        
-        db.session.commit()
+        workers = Worker.query.filter(Worker.worker_id.in_(worker_ids)).all()
+        if workers:
+            delete_workers_later(workers)
     
     return redirect('/')
 
+# API endpoint deleting workers: they disappear at once and a background job purges their
+# history and commands; poll the returned job at /api/jobs/<job_id>
+@bp.route('/api/delete_workers', methods=['POST'])
+def api_delete_workers():
+    data = request.get_json(silent=True) or {}
+    worker_ids = data.get('worker_ids') or ([data['worker_id']] if data.get('worker_id') else [])
+    if not worker_ids:
+        return jsonify({'status': 'error', 'message': 'worker_ids is required'}), 400
+
+    workers = Worker.query.filter(Worker.worker_id.in_(worker_ids)).all()
+    found = {worker.worker_id for worker in workers}
+    missing = [worker_id for worker_id in worker_ids if worker_id not in found]
+    if not workers:
+        return jsonify({'status': 'error', 'message': 'No such workers', 'missing': missing}), 404
+    job = delete_workers_later(workers)
+    return jsonify({'status': 'accepted', 'job_id': job.id, 'job_url': f"/api/jobs/{job.id}",
+                    'missing': missing}), 202
+
+# API endpoint reporting the progress of a background job
+@bp.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = get_worker_purger().get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': f"Job {job_id} not found"}), 404
+    return jsonify(job.to_dict())
+
 if __name__ == '__main__':
+    app = get_app()
     with app.app_context():
-        db.create_all()  # Create database tables
-    app.run(host='0.0.0.0', port=5000, debug=True)
+        create_tables()  # Apply pending schema migrations
+    threading.Thread(target=preload, args=(app,), name='preload', daemon=True).start()
+    # FLASK_DEBUG=1 turns on the debugger and reloader, which runs the master in a second process
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=os.environ.get('FLASK_DEBUG') == '1')
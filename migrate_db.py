@@ -1,74 +1,182 @@
 #!/usr/bin/env python3
-from master import db, app, GPUMetricsHistory, Worker, Command
-import os
-import sqlite3
-from sqlalchemy import text, inspect
-
-# Create the database tables if they don't exist
-with app.app_context():
-    print("Creating database tables...")
-    
-    # Force recreate the GPUMetricsHistory table
-    inspector = inspect(db.engine)
-    existing_tables = inspector.get_table_names()
-    print(f"Existing tables: {existing_tables}")
-    
-    # Drop the table if it exists
-    try:
-        print("Dropping existing GPUMetricsHistory table if it exists...")
-        db.session.execute(text("DROP TABLE IF EXISTS gpu_metrics_history"))
-        db.session.commit()
-        print("Table dropped successfully.")
-    except Exception as e:
-        print(f"Error dropping table: {e}")
-        db.session.rollback()
-    
-    # Create all tables
-    print("Creating tables...")
-    db.create_all()
-    print("All tables created.")
-    
-    # Verify using SQLAlchemy's inspector
-    inspector = inspect(db.engine)
-    tables_after_create = inspector.get_table_names()
-    print(f"Tables after create_all: {tables_after_create}")
-    
-    if 'gpu_metrics_history' in tables_after_create:
-        print("Verified GPUMetricsHistory table exists using SQLAlchemy inspector.")
-        columns = inspector.get_columns('gpu_metrics_history')
-        column_names = [col['name'] for col in columns]
-        print(f"Columns in gpu_metrics_history: {column_names}")
-    else:
-        print("WARNING: GPUMetricsHistory table was not found in SQLAlchemy inspector!")
-    
-    # Get the actual database URI from the engine
-    db_uri = str(db.engine.url)
-    print(f"Actual database URI: {db_uri}")
-    
-    # Since SQLAlchemy confirmed the table exists and we could create a record,
-    # we can skip the direct SQLite check which might have path issues
-    print("SQLAlchemy successfully verified the table structure and created a test record.")
-    print("This confirms the database is working properly despite the SQLite path warning.")
-    
-    print("Database migration completed.")
-    
-    # Create a test record to verify we can write to the table
-    try:
-        print("Creating a test record in GPUMetricsHistory table...")
-        test_record = GPUMetricsHistory(
-            worker_id=1,  # This assumes worker with ID 1 exists, or will be created
-            gpu_index=0,
-            temperature=0,
-            utilization=0,
-            memory_used=0,
-            memory_total=1,
-            power_usage=0
-        )
-        db.session.add(test_record)
-        db.session.commit()
-        print("Test record created successfully.")
-    except Exception as e:
-        print(f"Error creating test record: {e}")
-        db.session.rollback()
-    
-    print("Database migration completed successfully!")
+"""Versioned, non-destructive schema migrations for the master's database.
+
+Every migration applied is recorded in the schema_version table, so a master
+whose database is current pays one query at startup. Migrations only add
+tables, nullable columns and indexes; none drops or rewrites data, so masters
+still running the previous version keep working during a rolling restart.
+Each migration checks what already exists, so one that was interrupted, or that
+two masters start at once, is simply applied again.
+
+A change to the models needs a migration appended to MIGRATIONS. A migration
+spells out the tables, columns and indexes it adds rather than reading them from
+the models, so a version means the same schema whichever release applied it.
+The master applies pending migrations when it starts; to apply them beforehand:
+
+    python migrate_db.py            # apply pending migrations
+    python migrate_db.py --status   # list applied and pending migrations
+"""
+import sys
+import argparse
+from datetime import datetime
+
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, MetaData, String,
+                        Table, Text, inspect, insert, select, text)
+from sqlalchemy.exc import IntegrityError
+
+import instrumentation
+from instrumentation import logger
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+# Schema of migration 1: the models when schema versioning was introduced. Databases created
+# before then lack some of these tables, nullable columns and indexes.
+SCHEMA_1 = MetaData()
+Table(
+    'worker', SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('worker_id', String(50), unique=True, nullable=False),
+    Column('token', String(100), nullable=False),
+    Column('last_seen', DateTime),
+    Column('metrics', Text),
+    Column('report_interval', Float, nullable=True),
+    Column('deleted_at', DateTime, nullable=True),
+)
+Table(
+    'command', SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('worker_id', Integer, ForeignKey('worker.id'), nullable=False),
+    Column('command_text', String(500), nullable=False),
+    Column('status', String(20)),
+    Column('output', Text),
+    Column('output_size', Integer, nullable=True),
+    Column('output_external', Boolean, nullable=True),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Index('ix_command_worker_status_id', 'worker_id', 'status', 'id'),
+    Index('ix_command_worker_id', 'worker_id', 'id'),
+)
+Table(
+    'command_output', SCHEMA_1,
+    Column('command_id', Integer, ForeignKey('command.id'), primary_key=True),
+    Column('data', LargeBinary, nullable=False),
+)
+Table(
+    'gpu_metrics_history', SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('worker_id', Integer, ForeignKey('worker.id'), nullable=False),
+    Column('gpu_index', Integer, nullable=False),
+    Column('timestamp', DateTime, index=True),
+    Column('temperature', Float),
+    Column('utilization', Float),
+    Column('memory_used', Float),
+    Column('memory_total', Float),
+    Column('power_usage', Float, nullable=True),
+    Column('sample_interval', Float, nullable=True),
+    *(Column(name, Float, nullable=True) for name in ('sm_clock', 'memory_clock', 'fan_speed')),
+    *(Column(name, Integer, nullable=True) for name in ('throttle_reasons', 'ecc_corrected', 'ecc_uncorrected')),
+    *(Column(name, Float, nullable=True) for name in ('pcie_tx', 'pcie_rx', 'nvlink_tx', 'nvlink_rx')),
+    Index('ix_gpu_metrics_history_worker_gpu_time', 'worker_id', 'gpu_index', 'timestamp'),
+)
+Table(
+    'gpu_process_history', SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('worker_id', Integer, ForeignKey('worker.id'), nullable=False),
+    Column('gpu_index', Integer, nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('pid', Integer, nullable=False),
+    Column('name', String(100), nullable=True),
+    Column('memory_used', Float, nullable=True),
+    Column('sm_utilization', Float, nullable=True),
+    Column('sample_interval', Float, nullable=True),
+    Index('ix_gpu_process_history_worker_time', 'worker_id', 'timestamp'),
+)
+
+
+def add_missing(connection, metadata):
+    """Create the tables of metadata that are missing, and the nullable columns and indexes existing ones lack"""
+    metadata.create_all(connection)
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info("Added column %s.%s", table.name, column.name)
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(connection)
+                logger.info("Created index %s", index.name)
+
+
+def add_schema_1(connection):
+    add_missing(connection, SCHEMA_1)
+
+
+# (version, description, function applying it to a connection), in order
+MIGRATIONS = [
+    (1, 'Tables, columns and indexes of the models as of schema versioning', add_schema_1),
+]
+
+
+def applied_versions(engine):
+    """Return {version: applied_at} of the migrations already applied"""
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        return dict(connection.execute(select(schema_version.c.version, schema_version.c.applied_at)).all())
+
+
+def upgrade(engine):
+    """Apply pending migrations in order, returning the versions this call applied"""
+    applied = applied_versions(engine)
+    done = []
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info("Applying schema migration %d: %s", version, description)
+        try:
+            with engine.begin() as connection:
+                migrate(connection)
+                connection.execute(insert(schema_version).values(
+                    version=version, description=description, applied_at=datetime.utcnow()))
+        except IntegrityError:
+            # Another master recorded it first
+            logger.info("Schema migration %d was applied concurrently", version)
+            continue
+        done.append(version)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations to the master database')
+    parser.add_argument('--status', action='store_true', help='List applied and pending migrations and exit')
+    args = parser.parse_args()
+    instrumentation.configure_logging()
+
+    from flask import Flask
+    from models import db, init_db
+
+    app = Flask(__name__)
+    init_db(app)
+    with app.app_context():
+        print(f"Database: {db.engine.url!r}")
+        if args.status:
+            applied = applied_versions(db.engine)
+            for version, description, _ in MIGRATIONS:
+                state = f"applied {applied[version].isoformat()}" if version in applied else 'pending'
+                print(f"  {version:>4}  {state:<36} {description}")
+            sys.exit(0)
+        done = upgrade(db.engine)
+    print(f"Applied migrations: {', '.join(map(str, done))}" if done else "Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Mock NVML layer with synthetic GPUs, for running the worker without NVIDIA hardware.
+
+Implements the subset of the pynvml API the worker's NVMLCollector uses, with
+the same function names, constants and error codes. Each GPU follows a random
+walk like simulate.py's virtual GPUs, runs a few synthetic compute processes, and
+some models lack features (no fan on passively cooled cards, no NVLink on PCIe
+cards) so unsupported-query handling is exercised too:
+
+    python worker.py --master http://localhost:5000 --mock-gpus 8
+
+Run this file directly to time the worker's collector against the mock:
+
+    python mock_nvml.py --gpus 8 --ticks 1000
+"""
+import sys
+import time
+import random
+import argparse
+import threading
+from types import SimpleNamespace
+
+NVML_SUCCESS = 0
+NVML_ERROR_INVALID_ARGUMENT = 2
+NVML_ERROR_NOT_SUPPORTED = 3
+NVML_ERROR_NO_PERMISSION = 4
+NVML_ERROR_NOT_FOUND = 6
+NVML_ERROR_FUNCTION_NOT_FOUND = 13
+NVML_ERROR_UNINITIALIZED = 1
+
+NVML_TEMPERATURE_GPU = 0
+NVML_CLOCK_GRAPHICS = 0
+NVML_CLOCK_SM = 1
+NVML_CLOCK_MEM = 2
+NVML_PCIE_UTIL_TX_BYTES = 0
+NVML_PCIE_UTIL_RX_BYTES = 1
+NVML_NVLINK_MAX_LINKS = 18
+
+NVML_VALUE_TYPE_DOUBLE = 0
+NVML_VALUE_TYPE_UNSIGNED_LONG_LONG = 3
+
+# (name, memory MB, TDP W, max SM clock MHz, NVLink links, has fan)
+MODELS = [
+    ("NVIDIA A100-SXM4-80GB", 81920, 400, 1410, 12, False),
+    ("NVIDIA H100 80GB HBM3", 81920, 700, 1980, 18, False),
+    ("NVIDIA L40S", 46068, 350, 2520, 0, False),
+    ("NVIDIA GeForce RTX 4090", 24564, 450, 2520, 0, True),
+]
+
+PROCESS_NAMES = ["python", "python3", "torchrun", "trainer", "vllm", "tritonserver"]
+
+
+class NVMLError(Exception):
+    """NVML error carrying the numeric return code in value, like pynvml's"""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+    def __str__(self):
+        return f"NVML error {self.value}"
+
+
+class MockDevice:
+    """One synthetic GPU whose readings advance with wall-clock time"""
+
+    def __init__(self, index, rng):
+        self.index = index
+        self.rng = rng
+        name, memory_total, tdp, max_clock, links, has_fan = MODELS[index % len(MODELS)]
+        self.name = name
+        self.uuid = f"GPU-{rng.getrandbits(128):032x}"
+        self.memory_total = memory_total
+        self.tdp = tdp
+        self.max_clock = max_clock
+        self.links = links
+        self.has_fan = has_fan
+        self.util = 0.0
+        self.target_util = rng.choice([0.0, 35.0, 80.0, 98.0])
+        self.temp = 30.0 + rng.uniform(0, 5)
+        self.ecc_corrected = 0
+        self.ecc_uncorrected = 0
+        self.nvlink_tx = 0
+        self.nvlink_rx = 0
+        self.processes = {}
+        self.process_samples = []
+        self.updated = time.monotonic()
+
+    def advance(self):
+        """Step the random walk once per elapsed second"""
+        now = time.monotonic()
+        steps = int(now - self.updated)
+        if steps <= 0:
+            return
+        self.updated += steps
+        rng = self.rng
+        for _ in range(min(steps, 60)):
+            if rng.random() < 0.02:
+                self.target_util = rng.choice([0.0, 0.0, 35.0, 80.0, 98.0])
+            self.util = min(100.0, max(0.0, self.util + (self.target_util - self.util) * 0.3 + rng.gauss(0, 2)))
+            self.temp += (30.0 + self.util * 0.5 - self.temp) * 0.15 + rng.gauss(0, 0.3)
+            if rng.random() < 0.001:
+                self.ecc_corrected += 1
+        # NVLink traffic in KiB, proportional to load
+        if self.links:
+            self.nvlink_tx += int(self.util * 2000 * steps)
+            self.nvlink_rx += int(self.util * 1900 * steps)
+
+        # Busy GPUs run one or two jobs; idle ones none
+        wanted = 0 if self.util < 5 else (1 if self.util < 60 else 2)
+        while len(self.processes) > wanted:
+            self.processes.pop(next(iter(self.processes)))
+        while len(self.processes) < wanted:
+            self.processes[rng.randint(1000, 400000)] = rng.choice(PROCESS_NAMES)
+        stamp = int(time.time() * 1e6)
+        share = self.util / max(1, len(self.processes))
+        self.process_samples = [
+            SimpleNamespace(pid=pid, timeStamp=stamp, smUtil=int(share), memUtil=int(share * 0.6), encUtil=0, decUtil=0)
+            for pid in self.processes
+        ]
+
+    def memory_used(self):
+        return 500 + self.memory_total * 0.9 * self.util / 100.0
+
+
+state = SimpleNamespace(devices=[], initialized=False, calls=0, lock=threading.Lock())
+
+
+def configure(gpu_count=8, seed=0):
+    """Set up gpu_count synthetic GPUs and return this module for use as the NVML layer"""
+    rng = random.Random(seed)
+    state.devices = [MockDevice(i, rng) for i in range(gpu_count)]
+    return sys.modules[__name__]
+
+
+def device(handle):
+    state.calls += 1
+    if not state.initialized:
+        raise NVMLError(NVML_ERROR_UNINITIALIZED)
+    with state.lock:
+        handle.advance()
+    return handle
+
+
+def nvmlInit():
+    state.initialized = True
+
+
+def nvmlShutdown():
+    state.initialized = False
+
+
+def nvmlDeviceGetCount():
+    state.calls += 1
+    return len(state.devices)
+
+
+def nvmlDeviceGetHandleByIndex(index):
+    state.calls += 1
+    if not 0 <= index < len(state.devices):
+        raise NVMLError(NVML_ERROR_INVALID_ARGUMENT)
+    return state.devices[index]
+
+
+def nvmlDeviceGetName(handle):
+    return device(handle).name
+
+
+def nvmlDeviceGetUUID(handle):
+    return device(handle).uuid
+
+
+def nvmlDeviceGetTemperature(handle, sensor):
+    return int(round(device(handle).temp))
+
+
+def nvmlDeviceGetUtilizationRates(handle):
+    gpu = device(handle)
+    return SimpleNamespace(gpu=int(round(gpu.util)), memory=int(round(gpu.util * 0.6)))
+
+
+def nvmlDeviceGetMemoryInfo(handle):
+    gpu = device(handle)
+    total = gpu.memory_total * 1024 * 1024
+    used = int(gpu.memory_used() * 1024 * 1024)
+    return SimpleNamespace(total=total, used=used, free=total - used)
+
+
+def nvmlDeviceGetPowerUsage(handle):
+    gpu = device(handle)
+    return int((gpu.tdp * 0.15 + gpu.tdp * 0.85 * gpu.util / 100.0) * 1000)
+
+
+def nvmlDeviceGetClockInfo(handle, clock_type):
+    gpu = device(handle)
+    if clock_type == NVML_CLOCK_MEM:
+        return 1593
+    return int(gpu.max_clock * (0.6 + 0.4 * min(1.0, gpu.util / 50.0)))
+
+
+def nvmlDeviceGetFanSpeed(handle):
+    gpu = device(handle)
+    if not gpu.has_fan:
+        raise NVMLError(NVML_ERROR_NOT_SUPPORTED)
+    return int(30 + gpu.util * 0.6)
+
+
+def nvmlDeviceGetCurrentClocksThrottleReasons(handle):
+    gpu = device(handle)
+    if gpu.util < 5:
+        return 0x1  # idle
+    return 0x4 if gpu.util > 95 else 0x0  # software power cap at full load
+
+
+def nvmlDeviceGetFieldValues(handle, field_ids):
+    gpu = device(handle)
+    values = {3: gpu.ecc_corrected, 4: gpu.ecc_uncorrected, 138: gpu.nvlink_tx, 139: gpu.nvlink_rx}
+    result = []
+    for field in field_ids:
+        field_id, scope = field if isinstance(field, tuple) else (field, 0)
+        supported = field_id in values and (field_id < 138 or gpu.links)
+        result.append(SimpleNamespace(
+            fieldId=field_id, scopeId=scope, timestamp=int(time.time() * 1e6), latencyUsec=0,
+            valueType=NVML_VALUE_TYPE_UNSIGNED_LONG_LONG,
+            nvmlReturn=NVML_SUCCESS if supported else NVML_ERROR_NOT_SUPPORTED,
+            value=SimpleNamespace(ullVal=values.get(field_id, 0), dVal=0.0, uiVal=0, ulVal=0, sllVal=0),
+        ))
+    return result
+
+
+def nvmlDeviceGetPcieThroughput(handle, counter):
+    gpu = device(handle)
+    return int(gpu.util * (400 if counter == NVML_PCIE_UTIL_TX_BYTES else 900))
+
+
+def nvmlDeviceGetNvLinkState(handle, link):
+    gpu = device(handle)
+    if not gpu.links:
+        raise NVMLError(NVML_ERROR_NOT_SUPPORTED)
+    if link >= gpu.links:
+        raise NVMLError(NVML_ERROR_INVALID_ARGUMENT)
+    return 1
+
+
+def nvmlDeviceGetComputeRunningProcesses(handle):
+    gpu = device(handle)
+    count = max(1, len(gpu.processes))
+    return [SimpleNamespace(pid=pid, usedGpuMemory=int(gpu.memory_used() / count * 1024 * 1024),
+                            gpuInstanceId=0, computeInstanceId=0) for pid in gpu.processes]
+
+
+def nvmlDeviceGetProcessUtilization(handle, timestamp):
+    gpu = device(handle)
+    samples = [sample for sample in gpu.process_samples if sample.timeStamp > timestamp]
+    if not samples:
+        raise NVMLError(NVML_ERROR_NOT_FOUND)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the worker's NVML collector against synthetic GPUs")
+    parser.add_argument('--gpus', type=int, default=8, help='Number of synthetic GPUs')
+    parser.add_argument('--ticks', type=int, default=1000, help='Collections to run')
+    args = parser.parse_args()
+
+    from worker import NVMLCollector
+
+    nvml = configure(args.gpus)
+    nvml.nvmlInit()
+    collector = NVMLCollector(nvml)
+    collector.collect()
+    state.calls = 0
+    started = time.perf_counter()
+    for _ in range(args.ticks):
+        gpus = collector.collect()
+    elapsed = time.perf_counter() - started
+    print(f"{args.ticks} collections of {len(gpus)} GPUs: {elapsed / args.ticks * 1000:.3f} ms per tick, "
+          f"{state.calls / args.ticks:.1f} NVML calls per tick")
+
+
+if __name__ == "__main__":
+    main()
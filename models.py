@@ -0,0 +1,191 @@
+"""Database models of the master and the queries shared with the Cockpit bridge.
+
+db is not bound to an application: master.create_app() binds it with
+db.init_app(app), and so does any other Flask app that serves the same
+database. Importing this module is cheap, so tools that only need the tables
+do not pay for building the master's app.
+"""
+from datetime import datetime
+import sqlite3
+import json
+import zlib
+import os
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import deferred, undefer
+
+db = SQLAlchemy()
+
+# Relative SQLite paths resolve against this instance folder, whichever app binds db
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+def init_db(app):
+    """Bind db to app with the master's database settings"""
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///workers.db'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.instance_path = INSTANCE_PATH
+    db.init_app(app)
+
+# Use write-ahead logging on SQLite so long reads such as exports don't block metrics ingest
+@event.listens_for(Engine, 'connect')
+def set_sqlite_journal_mode(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.close()
+
+# Worker model
+class Worker(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    worker_id = db.Column(db.String(50), unique=True, nullable=False)
+    token = db.Column(db.String(100), nullable=False)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    metrics = db.Column(db.Text)  # Store metrics as JSON string
+    report_interval = db.Column(db.Float, nullable=True)  # Upload interval the worker last reported, in seconds
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Set while a deleted worker's data is being purged
+
+    def get_metrics_json(self):
+        if self.metrics:
+            return json.loads(self.metrics)
+        return None
+
+# Command model
+class Command(db.Model):
+    # The command poll filters on (worker_id, status) by id every tick; listings page by (worker_id, id)
+    __table_args__ = (
+        db.Index('ix_command_worker_status_id', 'worker_id', 'status', 'id'),
+        db.Index('ix_command_worker_id', 'worker_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    worker_id = db.Column(db.Integer, db.ForeignKey('worker.id'), nullable=False)
+    command_text = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
+    # Output, or only its tail when the full output is kept in command_output; loaded on first access
+    output = deferred(db.Column(db.Text))
+    output_size = db.Column(db.Integer, nullable=True)  # Length of the full output in characters
+    output_external = db.Column(db.Boolean, nullable=True)  # Full output is stored in command_output
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    worker = db.relationship('Worker', backref=db.backref('commands', lazy=True))
+
+# Full text of large command outputs, compressed and kept out of the command table
+class CommandOutput(db.Model):
+    __tablename__ = 'command_output'
+    command_id = db.Column(db.Integer, db.ForeignKey('command.id'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib compressed UTF-8
+
+# GPU Metrics History model
+class GPUMetricsHistory(db.Model):
+    __tablename__ = 'gpu_metrics_history'  # Explicitly define table name
+    __table_args__ = (db.Index('ix_gpu_metrics_history_worker_gpu_time', 'worker_id', 'gpu_index', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    worker_id = db.Column(db.Integer, db.ForeignKey('worker.id'), nullable=False)
+    gpu_index = db.Column(db.Integer, nullable=False)  # Index of the GPU in the worker's system
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    temperature = db.Column(db.Float)  # GPU temperature in Celsius
+    utilization = db.Column(db.Float)  # GPU utilization percentage
+    memory_used = db.Column(db.Float)  # Memory used in MB
+    memory_total = db.Column(db.Float)  # Total memory in MB
+    power_usage = db.Column(db.Float, nullable=True)  # Power usage in Watts (if available)
+    sample_interval = db.Column(db.Float, nullable=True)  # Seconds this sample stands for (None: worker did not say)
+    # Extended telemetry; None where the GPU or collector does not report it
+    sm_clock = db.Column(db.Float, nullable=True)  # SM clock in MHz
+    memory_clock = db.Column(db.Float, nullable=True)  # Memory clock in MHz
+    fan_speed = db.Column(db.Float, nullable=True)  # Fan speed percentage
+    throttle_reasons = db.Column(db.Integer, nullable=True)  # NVML clock throttle reason bitmask
+    ecc_corrected = db.Column(db.Integer, nullable=True)  # Corrected ECC errors since driver load
+    ecc_uncorrected = db.Column(db.Integer, nullable=True)  # Uncorrected ECC errors since driver load
+    pcie_tx = db.Column(db.Float, nullable=True)  # PCIe throughput in KB/s
+    pcie_rx = db.Column(db.Float, nullable=True)
+    nvlink_tx = db.Column(db.Float, nullable=True)  # NVLink throughput in KB/s, summed over links
+    nvlink_rx = db.Column(db.Float, nullable=True)
+    
+    @property
+    def memory_utilization(self):
+        """Calculate memory utilization as a percentage"""
+        if self.memory_total and self.memory_total > 0:
+            return (self.memory_used / self.memory_total) * 100
+        return 0
+    
+    worker = db.relationship('Worker', backref=db.backref('metrics_history', lazy=True))
+
+# History columns the metrics history API returns with ?extended=1
+EXTENDED_SERIES = ('sm_clock', 'memory_clock', 'fan_speed', 'throttle_reasons', 'ecc_corrected', 'ecc_uncorrected',
+                   'pcie_tx', 'pcie_rx', 'nvlink_tx', 'nvlink_rx')
+
+# Per-process GPU usage, for accounting which jobs use which GPUs
+class GPUProcessHistory(db.Model):
+    __tablename__ = 'gpu_process_history'
+    __table_args__ = (db.Index('ix_gpu_process_history_worker_time', 'worker_id', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    worker_id = db.Column(db.Integer, db.ForeignKey('worker.id'), nullable=False)
+    gpu_index = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    pid = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(100), nullable=True)  # Process name, if the worker could see it
+    memory_used = db.Column(db.Float, nullable=True)  # GPU memory used by the process in MB
+    sm_utilization = db.Column(db.Float, nullable=True)  # Share of the GPU's SMs used by the process
+    sample_interval = db.Column(db.Float, nullable=True)
+
+def live_workers():
+    """Query for workers that are not deleted"""
+    return Worker.query.filter(Worker.deleted_at.is_(None))
+
+# Command outputs longer than this many characters are kept compressed in command_output,
+# with only their tail in the command row
+command_output_inline_chars = int(os.environ.get('COMMAND_OUTPUT_INLINE_CHARS', 16384))
+
+# Commands per page in command listings, and the most a client may ask for
+COMMAND_PAGE_SIZE = 20
+MAX_COMMAND_PAGE_SIZE = 200
+
+def set_command_output(command, output):
+    """Store a command's output, moving it out of the command row when it is too long to keep inline"""
+    output = output or ''
+    command.output_size = len(output)
+    if len(output) <= command_output_inline_chars:
+        if command.output_external:
+            CommandOutput.query.filter_by(command_id=command.id).delete()
+        command.output = output
+        command.output_external = False
+        return
+    db.session.merge(CommandOutput(command_id=command.id, data=zlib.compress(output.encode('utf-8'))))
+    command.output = output[-command_output_inline_chars:]
+    command.output_external = True
+
+def command_output_text(command, tail=None):
+    """Return a command's full output, or only its last tail characters"""
+    output = command.output
+    # The inline tail answers short tail requests without touching command_output
+    if command.output_external and not (tail and tail <= len(output or '')):
+        blob = db.session.get(CommandOutput, command.id)
+        if blob:
+            output = zlib.decompress(blob.data).decode('utf-8')
+    if tail and output:
+        return output[-tail:]
+    return output
+
+def command_page(worker_db_id, before=None, limit=COMMAND_PAGE_SIZE, status=None, with_output=False):
+    """Return a worker's commands newest first, starting below command ID before (keyset pagination)"""
+    query = Command.query.filter(Command.worker_id == worker_db_id)
+    if status:
+        query = query.filter(Command.status == status)
+    if before:
+        query = query.filter(Command.id < before)
+    if with_output:
+        query = query.options(undefer(Command.output))
+    return query.order_by(Command.id.desc()).limit(limit).all()
+
+def command_summary(command):
+    """A command as listed by the API, without its output"""
+    return {
+        'id': command.id,
+        'command_text': command.command_text,
+        'status': command.status,
+        'output_size': command.output_size,
+        'created_at': command.created_at.isoformat(),
+        'updated_at': command.updated_at.isoformat(),
+    }
@@ -0,0 +1,160 @@
+"""Background purge of deleted workers.
+
+Deleting a worker only marks it deleted, which is one short transaction. A
+background thread then removes the worker's rows table by table in batches of
+batch_size, committing after every batch so metrics ingest never waits behind
+one long delete, and finally removes the worker row itself. Each deletion is a
+job whose progress can be polled while it runs.
+"""
+import time
+import uuid
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import delete, func, select
+
+from instrumentation import logger
+
+# Rows deleted per transaction, and the pause between batches that lets ingest writes in
+PURGE_BATCH_SIZE = 5000
+PURGE_PAUSE_SECONDS = 0.05
+
+# Finished jobs kept for status queries
+JOB_HISTORY = 100
+
+
+class PurgeJob:
+    """Deletion of a set of workers, with per-table progress"""
+
+    def __init__(self, workers, tables):
+        self.id = uuid.uuid4().hex
+        self.workers = workers  # [(worker database id, worker ID it had)]
+        self.status = 'queued'  # queued, running, completed, failed
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.workers_purged = 0
+        self.rows_total = dict.fromkeys(tables, 0)
+        self.rows_deleted = dict.fromkeys(tables, 0)
+
+    def to_dict(self):
+        total = sum(self.rows_total.values())
+        deleted = sum(self.rows_deleted.values())
+        return {
+            'job_id': self.id,
+            'type': 'purge_workers',
+            'status': self.status,
+            'error': self.error,
+            'workers': [worker_id for _, worker_id in self.workers],
+            'workers_purged': self.workers_purged,
+            'rows_total': dict(self.rows_total),
+            'rows_deleted': dict(self.rows_deleted),
+            'progress': round(deleted / total, 4) if total else (1.0 if self.status == 'completed' else 0.0),
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class WorkerPurger:
+    """Runs purge jobs one at a time on a background thread.
+
+    steps is a list of (table name, primary key column, condition factory); the
+    factory takes a worker's database id and returns the condition selecting its
+    rows. Steps run in order, so tables referencing others come first. cleanups
+    are called with a worker's database id after its rows are gone, for data kept
+    outside the database; they run again if a restart interrupts the purge.
+    """
+
+    def __init__(self, db, Worker, steps, batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE_SECONDS, cleanups=()):
+        self.app = None
+        self.db = db
+        self.Worker = Worker
+        self.steps = steps
+        self.cleanups = list(cleanups)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self, app):
+        """Start the purge thread for app, resuming deletions a restart interrupted"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            self.app = app
+        threading.Thread(target=self.run, name='worker-purge', daemon=True).start()
+        with self.app.app_context():
+            pending = self.db.session.execute(
+                select(self.Worker.id, self.Worker.worker_id).where(self.Worker.deleted_at.isnot(None))
+            ).all()
+            self.db.session.remove()
+        if pending:
+            logger.info("Resuming purge of %d deleted workers", len(pending))
+            self.submit([tuple(row) for row in pending])
+
+    def submit(self, workers):
+        """Queue the purge of [(worker database id, worker ID)] and return the job"""
+        job = PurgeJob(workers, [name for name, _, _ in self.steps])
+        with self.lock:
+            self.jobs[job.id] = job
+            finished = [j.id for j in self.jobs.values() if j.finished_at]
+            for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[job_id]
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            with self.app.app_context():
+                try:
+                    self.purge(job)
+                except Exception as e:
+                    self.db.session.rollback()
+                    job.status = 'failed'
+                    job.error = str(e)
+                    logger.exception("Purge job %s failed", job.id)
+                finally:
+                    job.finished_at = datetime.utcnow()
+                    self.db.session.remove()
+
+    def purge(self, job):
+        session = self.db.session
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        for name, key, condition in self.steps:
+            for worker_db_id, _ in job.workers:
+                job.rows_total[name] += session.execute(
+                    select(func.count()).select_from(key.table).where(condition(worker_db_id))
+                ).scalar()
+        session.commit()
+
+        for worker_db_id, worker_id in job.workers:
+            for name, key, condition in self.steps:
+                while True:
+                    ids = session.execute(
+                        select(key).where(condition(worker_db_id)).limit(self.batch_size)
+                    ).scalars().all()
+                    if not ids:
+                        break
+                    session.execute(delete(key.table).where(key.in_(ids)))
+                    session.commit()
+                    job.rows_deleted[name] += len(ids)
+                    time.sleep(self.pause)
+            for cleanup in self.cleanups:
+                cleanup(worker_db_id)
+            session.execute(delete(self.Worker.__table__).where(self.Worker.id == worker_db_id))
+            session.commit()
+            job.workers_purged += 1
+            logger.info("Purged deleted worker %s", worker_id)
+        job.status = 'completed'
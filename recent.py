@@ -0,0 +1,135 @@
+"""Recent GPU samples kept in memory for the history charts.
+
+Every GPU gets a fixed-size ring buffer of preallocated NumPy arrays: int64
+timestamps in microseconds and one float32 row per metric. Metrics uploads
+append to it, and history requests whose whole window the ring covers are
+answered from it without touching the database. A ring holds every sample from
+its valid_from on; anything older (overwritten, or from before the master
+started) is left to the database.
+"""
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Metrics kept per sample; the extended telemetry series are read from the database
+COLUMNS = ('temperature', 'utilization', 'memory_used', 'memory_total', 'power_usage', 'sample_interval')
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(timestamp):
+    """Convert a naive UTC datetime to microseconds since the epoch"""
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class SampleRing:
+    """The most recent samples of one GPU in preallocated arrays"""
+
+    __slots__ = ('timestamps', 'values', 'head', 'size', 'valid_from')
+
+    def __init__(self, capacity):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((len(COLUMNS), capacity), np.nan, dtype=np.float32)
+        self.head = 0  # Next slot to write
+        self.size = 0
+        self.valid_from = None  # No sample at or after this time (in microseconds) is missing
+
+    def append(self, micros, row):
+        capacity = len(self.timestamps)
+        if self.valid_from is None:
+            self.valid_from = micros
+        elif self.size == capacity:
+            # The oldest sample is overwritten, so the ring now starts just after it
+            self.valid_from = max(self.valid_from, int(self.timestamps[self.head]) + 1)
+        self.timestamps[self.head] = micros
+        self.values[:, self.head] = row
+        self.head = (self.head + 1) % capacity
+        self.size = min(self.size + 1, capacity)
+
+    def window(self, start):
+        """Copies of the samples at or after start in time order, or None if some may be missing"""
+        if self.valid_from is None or start < self.valid_from:
+            return None
+        if self.size < len(self.timestamps):
+            timestamps, values = self.timestamps[:self.size], self.values[:, :self.size]
+        else:
+            timestamps = np.concatenate((self.timestamps[self.head:], self.timestamps[:self.head]))
+            values = np.concatenate((self.values[:, self.head:], self.values[:, :self.head]), axis=1)
+        first = np.searchsorted(timestamps, start)
+        return timestamps[first:].copy(), values[:, first:].copy()
+
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + sys.getsizeof(self)
+
+
+class RecentSamples:
+    """Ring buffers of recent samples for every GPU in the fleet"""
+
+    def __init__(self, capacity=800):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # worker_id -> {gpu_index: SampleRing}
+        self.workers = {}
+
+    def add(self, worker_id, timestamp, rows):
+        """Append one upload, given as the rows built for gpu_metrics_history"""
+        if not self.capacity:
+            return
+        micros = to_micros(timestamp)
+        samples = [(row['gpu_index'], [as_float(row[name]) for name in COLUMNS]) for row in rows]
+        with self.lock:
+            rings = self.workers.setdefault(worker_id, {})
+            for gpu_index, values in samples:
+                ring = rings.get(gpu_index)
+                if ring is None:
+                    ring = rings[gpu_index] = SampleRing(self.capacity)
+                ring.append(micros, values)
+
+    def late(self, worker_id, timestamp):
+        """Note a sample stored out of order; windows reaching back to it are left to the database"""
+        micros = to_micros(timestamp)
+        with self.lock:
+            for ring in self.workers.get(worker_id, {}).values():
+                if ring.valid_from is not None and micros >= ring.valid_from:
+                    ring.valid_from = micros + 1
+
+    def window(self, worker_id, gpu_index, start_time, columns=COLUMNS):
+        """Return (timestamps as datetime64[us], {metric: float32 values}) since start_time,
+        or None if the ring cannot answer for the whole window or does not keep all of columns"""
+        if not set(columns) <= set(COLUMNS):
+            return None
+        with self.lock:
+            ring = self.workers.get(worker_id, {}).get(gpu_index)
+            window = ring.window(to_micros(start_time)) if ring else None
+        if window is None:
+            return None
+        timestamps, values = window
+        return timestamps.astype('datetime64[us]'), {name: values[i] for i, name in enumerate(COLUMNS)}
+
+    def forget(self, worker_id):
+        with self.lock:
+            self.workers.pop(worker_id, None)
+
+    def stats(self):
+        """Memory used by the rings, in total and per GPU"""
+        with self.lock:
+            rings = [ring for rings in self.workers.values() for ring in rings.values()]
+        total = sum(ring.nbytes() for ring in rings)
+        return {
+            'capacity': self.capacity,
+            'columns': list(COLUMNS),
+            'gpus': len(rings),
+            'samples': sum(ring.size for ring in rings),
+            'bytes': total,
+            'bytes_per_gpu': round(total / len(rings)) if rings else SampleRing(self.capacity).nbytes(),
+        }
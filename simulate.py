@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""Load generator that drives a master with thousands of simulated GPU workers.
+
+Every virtual worker is a GPUWorker whose metrics come from a synthetic
+collector instead of NVML, so the full registration, metrics, command polling
+and command output paths are exercised exactly as a real fleet would.
+"""
+import os
+import sys
+import time
+import json
+import re
+import math
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from worker import GPUWorker, Scheduler, AdaptiveInterval
+
+# GPU models handed out to virtual workers: (name, memory MB, idle W, TDP W)
+GPU_MODELS = [
+    ("NVIDIA A100-SXM4-80GB", 81920, 60, 400),
+    ("NVIDIA H100 80GB HBM3", 81559, 70, 700),
+    ("NVIDIA GeForce RTX 4090", 24564, 20, 450),
+    ("NVIDIA RTX A6000", 49140, 25, 300),
+]
+
+# Commands virtual workers are asked to run when a command workload is enabled
+SYNTHETIC_COMMANDS = [
+    "nvidia-smi",
+    "uptime",
+    "df -h",
+    "python train.py --epochs 1",
+]
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values using linear interpolation"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return ordered[int(rank)]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_latencies(latencies):
+    """Summarize a list of latencies in seconds as milliseconds"""
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+class LoadStats:
+    """Thread-safe collector of per-endpoint request outcomes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.gpu_samples = 0
+        self.started = time.perf_counter()
+
+    def record(self, endpoint, elapsed, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def add_gpu_samples(self, count):
+        with self.lock:
+            self.gpu_samples += count
+
+    def report(self):
+        """Build the throughput and latency report"""
+        with self.lock:
+            duration = time.perf_counter() - self.started
+            endpoints = {}
+            total_requests = 0
+            total_errors = 0
+            for endpoint, latencies in sorted(self.latencies.items()):
+                errors = self.errors.get(endpoint, 0)
+                summary = summarize_latencies(latencies)
+                summary["errors"] = errors
+                summary["error_rate"] = round(errors / len(latencies), 4)
+                summary["throughput_rps"] = round(len(latencies) / duration, 2)
+                endpoints[endpoint] = summary
+                total_requests += len(latencies)
+                total_errors += errors
+
+            return {
+                "duration_s": round(duration, 2),
+                "requests": total_requests,
+                "errors": total_errors,
+                "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+                "throughput_rps": round(total_requests / duration, 2),
+                "gpu_samples": self.gpu_samples,
+                "ingest_gpu_samples_per_s": round(self.gpu_samples / duration, 2),
+                "endpoints": endpoints,
+            }
+
+
+class TimedSession(requests.Session):
+    """Session that records the latency and outcome of every request"""
+
+    def __init__(self, stats):
+        super().__init__()
+        self.stats = stats
+
+    def request(self, method, url, *args, **kwargs):
+        # Collapse /command_output/<id> style paths into one endpoint unless one is given
+        endpoint = kwargs.pop('endpoint', None) or f"{method} {re.sub(r'/[0-9]+$', '/<id>', urlsplit(url).path)}"
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self.stats.record(endpoint, time.perf_counter() - start, False)
+            raise
+        self.stats.record(endpoint, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+
+class SyntheticGPUWorker(GPUWorker):
+    """GPUWorker whose GPUs are random walks rather than real devices"""
+
+    def __init__(self, master_url, worker_id, token_file, stats, gpu_count=8, rng=None):
+        super().__init__(master_url, worker_id=worker_id, token_file=token_file)
+        self.session = TimedSession(stats)
+        self.stats = stats
+        self.rng = rng or random.Random(worker_id)
+        model, memory_total, idle_power, tdp = self.rng.choice(GPU_MODELS)
+        self.gpus = []
+        for _ in range(gpu_count):
+            self.gpus.append({
+                "model": model,
+                "memory_total": float(memory_total),
+                "idle_power": float(idle_power),
+                "tdp": float(tdp),
+                "ambient": self.rng.uniform(28, 38),
+                "util": 0.0,
+                "target_util": 0.0,
+                "temp": self.rng.uniform(30, 40),
+                "memory_used": self.rng.uniform(300, 800),
+            })
+
+    def collect_gpu_metrics(self):
+        """Advance every GPU's random walk by one tick and report it"""
+        metrics = {"gpus": []}
+        for gpu in self.gpus:
+            # Jobs start and finish at random, moving the utilization target
+            if self.rng.random() < 0.02:
+                gpu["target_util"] = self.rng.choice([0.0, 0.0, 35.0, 80.0, 98.0])
+            gpu["util"] += (gpu["target_util"] - gpu["util"]) * 0.3 + self.rng.gauss(0, 2)
+            gpu["util"] = min(100.0, max(0.0, gpu["util"]))
+
+            # Temperature lags utilization like a heatsink would
+            target_temp = gpu["ambient"] + gpu["util"] * 0.5
+            gpu["temp"] += (target_temp - gpu["temp"]) * 0.15 + self.rng.gauss(0, 0.3)
+
+            power = gpu["idle_power"] + (gpu["tdp"] - gpu["idle_power"]) * gpu["util"] / 100.0
+            power = max(0.0, power + self.rng.gauss(0, gpu["tdp"] * 0.01))
+
+            target_memory = 500 + gpu["memory_total"] * 0.9 * gpu["util"] / 100.0
+            gpu["memory_used"] += (target_memory - gpu["memory_used"]) * 0.2
+            memory_used = min(gpu["memory_total"], max(0.0, gpu["memory_used"]))
+
+            metrics["gpus"].append({
+                "model": gpu["model"],
+                "temp": int(round(gpu["temp"])),
+                "util": int(round(gpu["util"])),
+                "power_usage": round(power, 2),
+                "memory": {
+                    "total": gpu["memory_total"],
+                    "used": round(memory_used, 2),
+                    "free": round(gpu["memory_total"] - memory_used, 2),
+                    "percent_used": round(memory_used / gpu["memory_total"] * 100, 2)
+                }
+            })
+        return metrics
+
+    def execute_command(self, command_id, command, output_bytes=2048):
+        """Produce synthetic command output without running anything"""
+        line = f"[{self.worker_id}] {command}: synthetic output line\n"
+        lines = max(1, output_bytes // len(line))
+        return "completed", line * lines
+
+    def tick(self, scheduler):
+        """Collect and send one round of metrics, returning the pending command"""
+        metrics = self.collect_gpu_metrics()
+        metrics["timestamp"] = datetime.now(timezone.utc).isoformat()
+        metrics["hostname"] = self.worker_id
+        if self.upload(metrics, scheduler):
+            self.stats.add_gpu_samples(len(metrics["gpus"]))
+        return self.check_commands()
+
+
+def parse_gpu_counts(value):
+    """Parse a GPU count such as '8' or a range such as '1-8'"""
+    if "-" in value:
+        low, high = value.split("-", 1)
+        return int(low), int(high)
+    return int(value), int(value)
+
+
+async def run_virtual_worker(worker, loop, pool, args, deadline):
+    """Drive one virtual worker until the deadline"""
+    if not await loop.run_in_executor(pool, worker.select_master):
+        return
+
+    # The worker's own scheduler spreads ticks by worker ID unless lockstep bursts were requested
+    scheduler = Scheduler(args.interval, worker.worker_id, spread=not args.sync_start)
+    if args.max_interval and args.max_interval > args.interval:
+        worker.sampling = AdaptiveInterval(args.interval, args.max_interval)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(scheduler.delay(), max(0.0, deadline - time.monotonic())))
+        if time.monotonic() >= deadline:
+            break
+        command_id, command = await loop.run_in_executor(pool, worker.tick, scheduler)
+        if command_id and command:
+            await loop.run_in_executor(
+                pool, worker.send_command_output, command_id, "running", "Command started...\n"
+            )
+            await asyncio.sleep(worker.rng.expovariate(1.0 / args.command_runtime))
+            status, output = worker.execute_command(command_id, command, args.command_output_bytes)
+            await loop.run_in_executor(pool, worker.send_command_output, command_id, status, output)
+
+
+async def run_command_workload(master_url, worker_ids, args, deadline, stats):
+    """Submit commands to random workers at the configured fleet-wide rate"""
+    session = TimedSession(stats)
+    loop = asyncio.get_running_loop()
+    rng = random.Random(0)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(rng.expovariate(args.command_rate))
+        await loop.run_in_executor(None, lambda: session.post(
+            f"{master_url}/submit_command",
+            data={"worker_id": rng.choice(worker_ids), "command": rng.choice(SYNTHETIC_COMMANDS)},
+            allow_redirects=False,
+            timeout=10
+        ))
+
+
+async def run_aggregator_queries(aggregator_url, worker_ids, deadline, stats):
+    """Read the fleet through the federation aggregator once a second"""
+    session = TimedSession(stats)
+    loop = asyncio.get_running_loop()
+    rng = random.Random(0)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(1.0)
+        await loop.run_in_executor(None, lambda: session.get(
+            f"{aggregator_url}/api/workers", endpoint="GET aggregator /api/workers", timeout=10
+        ))
+        await loop.run_in_executor(None, lambda: session.get(
+            f"{aggregator_url}/api/metrics/history/{rng.choice(worker_ids)}/0?hours=1",
+            endpoint="GET aggregator /api/metrics/history", timeout=10
+        ))
+
+
+async def run_simulation(master_urls, args, stats, token_dir, aggregator_url=None):
+    """Spin up all virtual workers and wait for them to finish"""
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    low, high = parse_gpu_counts(args.gpus)
+    rng = random.Random(args.seed)
+
+    workers = []
+    for i in range(args.workers):
+        worker_id = f"{args.prefix}-{i:05d}"
+        # Every worker gets the full master list and picks its owner by consistent hashing
+        workers.append(SyntheticGPUWorker(
+            master_urls,
+            worker_id,
+            os.path.join(token_dir, f"{worker_id}.token"),
+            stats,
+            gpu_count=rng.randint(low, high),
+            rng=random.Random(f"{args.seed}-{worker_id}")
+        ))
+
+    deadline = time.monotonic() + args.ramp_up + args.duration
+    tasks = []
+    for i, worker in enumerate(workers):
+        # Ramp registrations up linearly instead of all at once
+        delay = args.ramp_up * i / len(workers) if args.ramp_up else 0
+        tasks.append(asyncio.ensure_future(
+            _delayed(delay, run_virtual_worker(worker, loop, pool, args, deadline))
+        ))
+
+    # With several masters, commands go through the aggregator to whichever master owns the worker
+    if args.command_rate > 0:
+        tasks.append(asyncio.ensure_future(
+            run_command_workload(aggregator_url or master_urls[0], [w.worker_id for w in workers], args, deadline, stats)
+        ))
+    if aggregator_url:
+        tasks.append(asyncio.ensure_future(
+            run_aggregator_queries(aggregator_url, [w.worker_id for w in workers], deadline, stats)
+        ))
+
+    await asyncio.gather(*tasks)
+    pool.shutdown(wait=True)
+
+
+async def _delayed(delay, coroutine):
+    """Await coroutine after delay seconds"""
+    await asyncio.sleep(delay)
+    await coroutine
+
+
+def find_free_port():
+    """Ask the OS for an unused local TCP port"""
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_master(db_path, port=None):
+    """Start a throwaway master in a subprocess and wait until it answers"""
+    port = port or find_free_port()
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path}")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    master_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{master_url}/", timeout=1)
+            return process, master_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Local master did not start")
+
+
+def start_local_aggregator(master_urls):
+    """Start a federation aggregator over the given masters in a subprocess"""
+    port = find_free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "aggregator.py"),
+         "--masters", ",".join(master_urls), "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    aggregator_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{aggregator_url}/api/workers", timeout=1)
+            return process, aggregator_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Local aggregator did not start")
+
+
+def schedule_outage(processes, master_url, db_path, args):
+    """Stop (and optionally restart) the first local master while the simulation runs"""
+    def stop():
+        processes[0].terminate()
+        processes[0].wait()
+        print(f"Stopped master {master_url}", file=sys.stderr)
+
+    def restart():
+        processes[0], _ = start_local_master(db_path, port=urlsplit(master_url).port)
+        print(f"Restarted master {master_url}", file=sys.stderr)
+
+    threading.Timer(args.ramp_up + args.fail_master, stop).start()
+    if args.recover_master:
+        threading.Timer(args.ramp_up + args.recover_master, restart).start()
+
+
+def print_ownership(master_urls):
+    """Print how many workers last reported to each master"""
+    latest = {}
+    for master_url in master_urls:
+        try:
+            workers = requests.get(f"{master_url}/api/workers", timeout=10).json()
+        except requests.RequestException:
+            continue
+        for worker in workers:
+            if worker['last_seen'] > latest.get(worker['worker_id'], ('', None))[0]:
+                latest[worker['worker_id']] = (worker['last_seen'], master_url)
+    for master_url in master_urls:
+        count = sum(1 for _, owner in latest.values() if owner == master_url)
+        print(f"Workers currently reporting to {master_url}: {count}")
+
+
+def serve_master(port):
+    """Run the master on the given port (used for the local master subprocess)"""
+    from master import app, create_tables
+    with app.app_context():
+        create_tables()
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def print_report(report, stream):
+    """Print a human-readable version of the report"""
+    print(f"Duration: {report['duration_s']}s, requests: {report['requests']}, "
+          f"throughput: {report['throughput_rps']} req/s, "
+          f"errors: {report['errors']} ({report['error_rate'] * 100:.2f}%)", file=stream)
+    print(f"GPU samples ingested: {report['gpu_samples']} "
+          f"({report['ingest_gpu_samples_per_s']} samples/s)", file=stream)
+    print(f"{'endpoint':<38}{'count':>9}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}",
+          file=stream)
+    for endpoint, summary in report["endpoints"].items():
+        print(f"{endpoint:<38}{summary['count']:>9}{summary['throughput_rps']:>10}"
+              f"{summary['p50_ms']:>10}{summary['p99_ms']:>10}{summary['max_ms']:>10}{summary['errors']:>8}",
+              file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of GPU workers against a master')
+    parser.add_argument('--master', help='Master server URL (defaults to starting a local master)')
+    parser.add_argument('--masters', type=int, default=1,
+                        help='Number of local masters to start; with more than one, workers are spread '
+                             'across them and the fleet is also read through a local aggregator')
+    parser.add_argument('--workers', type=int, default=100, help='Number of virtual workers')
+    parser.add_argument('--gpus', default='8', help='GPUs per worker, either a count or a range like 1-8')
+    parser.add_argument('--interval', type=float, default=5, help='Interval between metric updates in seconds')
+    parser.add_argument('--max-interval', type=float,
+                        help='Let workers slow down to this interval while their GPUs are idle (adaptive sampling)')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run after ramp-up')
+    parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which workers register')
+    parser.add_argument('--sync-start', action='store_true', help='Tick all workers in lockstep instead of at per-worker phases')
+    parser.add_argument('--fail-master', type=float, metavar='SECONDS',
+                        help='Stop the first local master this many seconds after ramp-up to exercise failover')
+    parser.add_argument('--recover-master', type=float, metavar='SECONDS',
+                        help='Restart the stopped master this many seconds after ramp-up')
+    parser.add_argument('--command-rate', type=float, default=0, help='Commands submitted per second fleet-wide')
+    parser.add_argument('--command-runtime', type=float, default=2, help='Mean synthetic command runtime in seconds')
+    parser.add_argument('--command-output-bytes', type=int, default=2048, help='Size of synthetic command output')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum concurrent HTTP requests')
+    parser.add_argument('--prefix', default='sim', help='Prefix for virtual worker IDs')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show output from the virtual workers')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_master(args.serve)
+        return
+
+    stats = LoadStats()
+    processes = []
+    with tempfile.TemporaryDirectory() as scratch:
+        master_urls = [args.master.rstrip('/')] if args.master else []
+        aggregator_url = None
+        try:
+            if not master_urls:
+                for i in range(max(1, args.masters)):
+                    process, master_url = start_local_master(os.path.join(scratch, f"simulate-{i}.db"))
+                    processes.append(process)
+                    master_urls.append(master_url)
+                    print(f"Started local master at {master_url}")
+                if len(master_urls) > 1:
+                    process, aggregator_url = start_local_aggregator(master_urls)
+                    processes.append(process)
+                    print(f"Started local aggregator at {aggregator_url}")
+
+            print(f"Simulating {args.workers} workers against {', '.join(master_urls)} "
+                  f"for {args.duration}s (ramp-up {args.ramp_up}s)")
+            if args.fail_master and len(processes) > 1:
+                schedule_outage(processes, master_urls[0], os.path.join(scratch, "simulate-0.db"), args)
+            stats.started = time.perf_counter()
+            # Virtual workers are chatty; keep their output out of the report
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                    asyncio.run(run_simulation(master_urls, args, stats, scratch, aggregator_url))
+            if len(master_urls) > 1:
+                print_ownership(master_urls)
+        except KeyboardInterrupt:
+            print("Interrupted, reporting partial results")
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+    report = stats.report()
+    report["config"] = {
+        "masters": len(master_urls),
+        "workers": args.workers,
+        "gpus": args.gpus,
+        "interval": args.interval,
+        "max_interval": args.max_interval,
+        "duration": args.duration,
+        "command_rate": args.command_rate,
+        "sync_start": args.sync_start,
+    }
+    print_report(report, sys.stdout)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,44 +3,457 @@ import os
 import sys
 import time
 import json
+import gzip
+import bisect
+import random
 import socket
+import hashlib
 import requests
 import subprocess
 import argparse
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
 
 # Try to import NVML for GPU monitoring
 try:
-    from pynvml import *
+    import pynvml
     NVML_AVAILABLE = True
 except ImportError:
+    pynvml = None
     NVML_AVAILABLE = False
     print("NVIDIA Management Library (NVML) not available. Will attempt to use nvidia-smi directly.")
 
+# zstd compresses uploads better and faster than gzip when available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Uploads smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+# Points per master on the hash ring; more points spread workers more evenly
+RING_REPLICAS = 100
+
+# A failed master is retried after an exponential backoff between these bounds (seconds)
+FAILOVER_MIN_BACKOFF = 10
+FAILOVER_MAX_BACKOFF = 300
+
+# Uploads that could not be delivered are kept and resent in batches once a master answers
+BACKLOG_SIZE = 720
+BACKLOG_BATCH = 60
+
+# NVML field values read in one batched call per GPU each tick: (key, field id, scope id).
+# Field ids are stable across NVML versions; scope 0xFFFFFFFF sums NVLink counters over all links
+NVML_FIELDS = (
+    ('ecc_corrected', 3, 0),            # NVML_FI_DEV_ECC_SBE_VOL_TOTAL
+    ('ecc_uncorrected', 4, 0),          # NVML_FI_DEV_ECC_DBE_VOL_TOTAL
+    ('nvlink_tx', 138, 0xFFFFFFFF),     # NVML_FI_DEV_NVLINK_THROUGHPUT_DATA_TX, KiB since driver load
+    ('nvlink_rx', 139, 0xFFFFFFFF),     # NVML_FI_DEV_NVLINK_THROUGHPUT_DATA_RX
+)
+NVML_VALUE_FIELDS = ('dVal', 'uiVal', 'ulVal', 'ullVal', 'sllVal')
+
+# NVML error codes meaning a query will never work on a GPU, so it is not retried
+NVML_UNSUPPORTED_ERRORS = (2, 3, 4, 13)  # invalid argument, not supported, no permission, function not found
+
+# nvmlDeviceGetPcieThroughput samples the bus for 20 ms per call, so it is refreshed only this often
+PCIE_REFRESH_SECONDS = 30
+
+# Clock throttle reason bits reported by NVML
+THROTTLE_REASONS = (
+    (0x1, 'gpu_idle'),
+    (0x2, 'applications_clocks'),
+    (0x4, 'sw_power_cap'),
+    (0x8, 'hw_slowdown'),
+    (0x10, 'sync_boost'),
+    (0x20, 'sw_thermal'),
+    (0x40, 'hw_thermal'),
+    (0x80, 'hw_power_brake'),
+    (0x100, 'display_clocks'),
+)
+
+def process_name(pid):
+    """Return a process's command name, or None if it is not visible (e.g. from a container)"""
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def smi_number(value, cast=int):
+    """Parse an nvidia-smi field, returning None for unsupported or missing values"""
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+class NVMLDevice:
+    """Cached handle, static properties and counter state of one GPU"""
+    
+    def __init__(self, index, handle):
+        self.index = index
+        self.handle = handle
+        self.name = None
+        self.uuid = None
+        self.nvlink_links = 0
+        # Queries that failed with a permanent error on this GPU
+        self.unsupported = set()
+        # Previous cumulative counters for rates: (time, {key: value})
+        self.counters = None
+        self.pcie = (0.0, None, None)
+        self.process_timestamp = 0
+
+class NVMLCollector:
+    """Extended per-GPU telemetry through NVML with cached handles and batched field queries
+    
+    Handles, names and NVLink topology are looked up once; each tick reads the
+    dynamic values with a few calls per GPU plus one field-value batch, and queries
+    a GPU does not support are skipped after their first failure.
+    """
+    
+    def __init__(self, nvml):
+        self.nvml = nvml
+        self.devices = None
+        self.process_names = {}
+    
+    def reset(self):
+        """Drop cached handles, e.g. after NVML was re-initialized"""
+        self.devices = None
+    
+    def query(self, device, name, fn, *args):
+        """Call an NVML query, returning None if it fails and remembering permanent failures"""
+        if name in device.unsupported:
+            return None
+        try:
+            return fn(device.handle, *args)
+        except self.nvml.NVMLError as e:
+            if getattr(e, 'value', None) in NVML_UNSUPPORTED_ERRORS:
+                device.unsupported.add(name)
+            else:
+                print(f"NVML {name} failed for GPU {device.index}: {e}")
+            return None
+    
+    def open_devices(self):
+        nvml = self.nvml
+        devices = []
+        for i in range(nvml.nvmlDeviceGetCount()):
+            device = NVMLDevice(i, nvml.nvmlDeviceGetHandleByIndex(i))
+            name = nvml.nvmlDeviceGetName(device.handle)
+            device.name = name.decode('utf-8') if isinstance(name, bytes) else name
+            uuid = self.query(device, 'uuid', nvml.nvmlDeviceGetUUID)
+            device.uuid = uuid.decode('utf-8') if isinstance(uuid, bytes) else uuid
+            for link in range(nvml.NVML_NVLINK_MAX_LINKS):
+                try:
+                    if nvml.nvmlDeviceGetNvLinkState(device.handle, link):
+                        device.nvlink_links += 1
+                except nvml.NVMLError:
+                    break
+            devices.append(device)
+        return devices
+    
+    def field_values(self, device):
+        """Read NVML_FIELDS in one call, returning {key: value} for the fields that succeeded"""
+        if 'fields' in device.unsupported:
+            return {}
+        fields = NVML_FIELDS if device.nvlink_links else NVML_FIELDS[:2]
+        values = self.query(device, 'fields', self.nvml.nvmlDeviceGetFieldValues,
+                            [(field_id, scope) for _, field_id, scope in fields])
+        result = {}
+        for (key, _, _), value in zip(fields, values or []):
+            if value.nvmlReturn == 0 and value.valueType < len(NVML_VALUE_FIELDS):
+                result[key] = getattr(value.value, NVML_VALUE_FIELDS[value.valueType])
+        return result
+    
+    def rates(self, device, now, counters):
+        """Turn cumulative KiB counters into KB/s since the previous tick"""
+        previous, device.counters = device.counters, (now, counters)
+        if not previous or now <= previous[0]:
+            return {}
+        elapsed = now - previous[0]
+        return {key: round((value - previous[1][key]) * 1.024 / elapsed, 1)
+                for key, value in counters.items()
+                if key in previous[1] and value >= previous[1][key]}
+    
+    def pcie_throughput(self, device, now):
+        if now - device.pcie[0] >= PCIE_REFRESH_SECONDS:
+            nvml = self.nvml
+            device.pcie = (now,
+                           self.query(device, 'pcie', nvml.nvmlDeviceGetPcieThroughput, nvml.NVML_PCIE_UTIL_TX_BYTES),
+                           self.query(device, 'pcie', nvml.nvmlDeviceGetPcieThroughput, nvml.NVML_PCIE_UTIL_RX_BYTES))
+        return device.pcie[1], device.pcie[2]
+    
+    def processes(self, device):
+        """Compute processes on the GPU with their memory and SM utilization since the last tick"""
+        running = self.query(device, 'processes', self.nvml.nvmlDeviceGetComputeRunningProcesses) or []
+        if not running:
+            return []
+        
+        # Utilization samples newer than the last ones seen, averaged per process
+        sm_util = {}
+        if 'process_utilization' not in device.unsupported:
+            try:
+                samples = self.nvml.nvmlDeviceGetProcessUtilization(device.handle, device.process_timestamp)
+            except self.nvml.NVMLError as e:
+                # NOT_FOUND just means no samples since the last tick
+                if getattr(e, 'value', None) in NVML_UNSUPPORTED_ERRORS:
+                    device.unsupported.add('process_utilization')
+                samples = []
+            totals = {}
+            for sample in samples:
+                device.process_timestamp = max(device.process_timestamp, sample.timeStamp)
+                total = totals.setdefault(sample.pid, [0, 0, 0])
+                total[0] += sample.smUtil
+                total[1] += sample.memUtil
+                total[2] += 1
+            sm_util = {pid: (sm / count, mem / count) for pid, (sm, mem, count) in totals.items()}
+        
+        processes = []
+        for process in running:
+            if process.pid not in self.process_names:
+                self.process_names[process.pid] = process_name(process.pid)
+            utilization = sm_util.get(process.pid)
+            processes.append({
+                "pid": process.pid,
+                "name": self.process_names[process.pid],
+                "memory_used": round(process.usedGpuMemory / 1024 / 1024, 2) if process.usedGpuMemory is not None else None,
+                "sm_util": round(utilization[0], 1) if utilization else None,
+                "mem_util": round(utilization[1], 1) if utilization else None,
+            })
+        return processes
+    
+    def collect(self):
+        """Return one metrics entry per GPU"""
+        nvml = self.nvml
+        if self.devices is None:
+            self.devices = self.open_devices()
+        now = time.monotonic()
+        gpus = []
+        live_pids = set()
+        for device in self.devices:
+            handle = device.handle
+            temp = nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU)
+            util = nvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            
+            memory = nvml.nvmlDeviceGetMemoryInfo(handle)
+            mem_total = memory.total / 1024 / 1024  # Convert to MB
+            mem_used = memory.used / 1024 / 1024
+            mem_free = memory.free / 1024 / 1024
+            
+            # Power usage might not be available on all GPUs
+            power_usage = self.query(device, 'power', nvml.nvmlDeviceGetPowerUsage)
+            throttle = self.query(device, 'throttle', nvml.nvmlDeviceGetCurrentClocksThrottleReasons)
+            fields = self.field_values(device)
+            rates = self.rates(device, now, {key: fields[key] for key in ('nvlink_tx', 'nvlink_rx') if key in fields})
+            pcie_tx, pcie_rx = self.pcie_throughput(device, now)
+            processes = self.processes(device)
+            live_pids.update(process["pid"] for process in processes)
+            
+            gpus.append({
+                "model": device.name,
+                "uuid": device.uuid,
+                "temp": temp,
+                "util": util,
+                "power_usage": round(power_usage / 1000.0, 2) if power_usage is not None else None,  # mW to W
+                "memory": {
+                    "total": round(mem_total, 2),
+                    "used": round(mem_used, 2),
+                    "free": round(mem_free, 2),
+                    "percent_used": round((mem_used / mem_total) * 100, 2)
+                },
+                "clocks": {
+                    "sm": self.query(device, 'sm_clock', nvml.nvmlDeviceGetClockInfo, nvml.NVML_CLOCK_SM),
+                    "memory": self.query(device, 'memory_clock', nvml.nvmlDeviceGetClockInfo, nvml.NVML_CLOCK_MEM),
+                },
+                "fan": self.query(device, 'fan', nvml.nvmlDeviceGetFanSpeed),
+                "throttle_mask": throttle,
+                "throttle_reasons": [name for bit, name in THROTTLE_REASONS if throttle and throttle & bit],
+                "ecc": {"corrected": fields.get('ecc_corrected'), "uncorrected": fields.get('ecc_uncorrected')},
+                "pcie": {"tx": pcie_tx, "rx": pcie_rx},
+                "nvlink": {"links": device.nvlink_links, "tx": rates.get('nvlink_tx'), "rx": rates.get('nvlink_rx')},
+                "processes": processes,
+            })
+        
+        # Forget names of processes that have exited, since PIDs are reused
+        for pid in [pid for pid in self.process_names if pid not in live_pids]:
+            del self.process_names[pid]
+        return gpus
+
+class HashRing:
+    """Consistent hash ring ordering masters by preference for each worker ID"""
+    
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted((self.hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.keys = [key for key, _ in points]
+        self.nodes = [node for _, node in points]
+        self.node_count = len(set(nodes))
+    
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+    
+    def preference(self, key):
+        """Return the masters in the order key should use them: owner first, then failover successors"""
+        order = []
+        start = bisect.bisect(self.keys, self.hash(key))
+        for i in range(len(self.nodes)):
+            node = self.nodes[(start + i) % len(self.nodes)]
+            if node not in order:
+                order.append(node)
+                if len(order) == self.node_count:
+                    break
+        return order
+
+# Bounds for the upload interval a master may suggest, in seconds
+MIN_SUGGESTED_INTERVAL = 1
+MAX_SUGGESTED_INTERVAL = 3600
+
+# Adaptive sampling: a GPU whose utilization or temperature moved at least this far
+# from the last active sample counts as active and drops the interval to the minimum
+ACTIVITY_UTILIZATION_DELTA = 5.0
+ACTIVITY_TEMPERATURE_DELTA = 2.0
+# Quiet samples in a row before the interval doubles towards the maximum
+QUIET_SAMPLES_BEFORE_SLOWDOWN = 3
+
+class AdaptiveInterval:
+    """Upload interval that is fast while GPUs are changing and backs off while they are idle"""
+    
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = float(min_interval)
+        self.max_interval = max(self.min_interval, float(max_interval))
+        self.interval = self.min_interval
+        self.reference = None
+        self.quiet = 0
+    
+    def is_active(self, gpus):
+        current = [(gpu.get('util'), gpu.get('temp')) for gpu in gpus]
+        reference, self.reference = self.reference, current
+        if reference is None or len(reference) != len(current):
+            return True
+        for (util, temp), (ref_util, ref_temp) in zip(current, reference):
+            if util is not None and ref_util is not None and abs(util - ref_util) >= ACTIVITY_UTILIZATION_DELTA:
+                return True
+            if temp is not None and ref_temp is not None and abs(temp - ref_temp) >= ACTIVITY_TEMPERATURE_DELTA:
+                return True
+        # Compare against the last active sample so that slow drifts still add up
+        self.reference = reference
+        return False
+    
+    def observe(self, gpus):
+        """Update the interval from one round of GPU metrics and return it"""
+        if self.is_active(gpus):
+            self.quiet = 0
+            self.interval = self.min_interval
+        else:
+            self.quiet += 1
+            if self.quiet >= QUIET_SAMPLES_BEFORE_SLOWDOWN:
+                self.quiet = 0
+                self.interval = min(self.max_interval, self.interval * 2)
+        return self.interval
+    
+    def set_min_interval(self, interval):
+        """Use a new fastest interval (e.g. one suggested by the master)"""
+        self.min_interval = float(interval)
+        self.max_interval = max(self.min_interval, self.max_interval)
+        self.interval = min(self.max_interval, max(self.min_interval, self.interval))
+
+class Scheduler:
+    """Fixed-rate ticks at a per-worker phase, with jittered backoff after failures
+    
+    Ticks fall on wall-clock times that are a whole number of intervals past a phase
+    derived from the worker ID, so a fleet started at the same moment still spreads
+    its uploads over the interval, and slow ticks don't make the schedule drift.
+    """
+    
+    def __init__(self, interval, key, spread=True, max_backoff=FAILOVER_MAX_BACKOFF):
+        self.interval = float(interval)
+        self.fraction = (HashRing.hash(key) % 1000000) / 1000000.0 if spread else 0.0
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.next_time = self.aligned(time.time())
+    
+    def aligned(self, now):
+        """Return the first tick at or after now"""
+        phase = self.fraction * self.interval
+        ticks = -(-(now - phase) // self.interval)
+        return phase + ticks * self.interval
+    
+    def delay(self):
+        """Seconds until the next tick"""
+        now = time.time()
+        # Re-anchor if the wall clock jumped backwards
+        if self.next_time - now > max(self.interval, self.max_backoff) * 2:
+            self.next_time = self.aligned(now)
+        return max(0.0, self.next_time - now)
+    
+    def wait(self):
+        time.sleep(self.delay())
+    
+    def success(self):
+        """Schedule the next regular tick, skipping any that were missed"""
+        self.failures = 0
+        self.next_time = self.aligned(max(time.time(), self.next_time + self.interval))
+    
+    def failure(self):
+        """Back off exponentially, with jitter so failing workers don't retry together"""
+        self.failures += 1
+        backoff = max(self.interval, min(self.max_backoff, self.interval * 2 ** (self.failures - 1)))
+        # Even the first retry is spread over half an interval; a range starting at
+        # the interval itself would be empty then and the whole fleet would retry at once
+        self.next_time = time.time() + random.uniform(self.interval / 2, backoff)
+    
+    def defer(self, seconds):
+        """Honor a master's Retry-After, plus jitter so deferred workers come back spread out"""
+        self.next_time = max(self.next_time, time.time() + seconds + random.uniform(0, self.interval))
+    
+    def set_interval(self, interval):
+        """Use a new interval from the next scheduled tick on, keeping this worker's phase"""
+        self.interval = float(interval)
+
 class GPUWorker:
-    def __init__(self, master_url, worker_id=None, token_file="token.txt"):
-        self.master_url = master_url.rstrip('/')
+    def __init__(self, master_url, worker_id=None, token_file="token.txt", compress=True, nvml=None):
+        # One or more masters (a list or comma separated URLs); the owner is picked by consistent hashing
+        masters = master_url.split(',') if isinstance(master_url, str) else master_url
+        self.masters = [url.strip().rstrip('/') for url in masters if url.strip()]
         self.worker_id = worker_id if worker_id else socket.gethostname()
         print(f"Worker ID set to: {self.worker_id}")
+        self.preference = HashRing(self.masters).preference(self.worker_id)
+        self.master_url = self.preference[0]
         self.token_file = token_file
+        self.tokens = {}
         self.token = None
         self.headers = None
+        # Failover state per master: consecutive failures and when to try it again
+        self.failures = {}
+        self.down_until = {}
+        self.master_unreachable = False
+        self.backlog = deque(maxlen=BACKLOG_SIZE)
+        # Scheduling hints from the last metrics response
+        self.retry_after = None
+        self.suggested_interval = None
+        # Adaptive upload interval; None keeps the scheduler's fixed interval
+        self.sampling = None
+        # Reuse connections to the master across requests
+        self.session = requests.Session()
+        # Upload encodings to try in order; one the master rejects is dropped
+        self.upload_encodings = ((['zstd'] if zstandard else []) + ['gzip']) if compress else []
         
-        # Initialize NVML if available
-        global NVML_AVAILABLE
-        if NVML_AVAILABLE:
+        # Initialize NVML if available (or the mock NVML layer passed in)
+        self.nvml = nvml or (pynvml if NVML_AVAILABLE else None)
+        self.collector = None
+        if self.nvml:
             try:
-                nvmlInit()
+                self.nvml.nvmlInit()
+                self.collector = NVMLCollector(self.nvml)
                 print(f"NVML initialized successfully")
             except Exception as e:
                 print(f"Failed to initialize NVML: {e}")
-                NVML_AVAILABLE = False
+                self.nvml = None
     
     def register(self):
         """Register with the master server and get a token"""
         try:
             print(f"Registering worker '{self.worker_id}' with master at {self.master_url}")
-            response = requests.post(
+            response = self.session.post(
                 f"{self.master_url}/register", 
                 json={"worker_id": self.worker_id},
                 timeout=10
@@ -50,8 +463,8 @@ class GPUWorker:
                 self.token = response.json().get("token")
                 if self.token:
                     print(f"Registration successful, token received")
-                    with open(self.token_file, "w") as f:
-                        f.write(self.token)
+                    self.tokens[self.master_url] = self.token
+                    self.save_tokens()
                     self.headers = {"Authorization": f"Bearer {self.token}"}
                     return True
                 else:
@@ -63,14 +476,26 @@ class GPUWorker:
         
         return False
     
+    def save_tokens(self):
+        """Save tokens: a plain token for a single master, a JSON map of master to token otherwise"""
+        with open(self.token_file, "w") as f:
+            if len(self.masters) == 1:
+                f.write(self.token)
+            else:
+                json.dump(self.tokens, f)
+    
     def load_token(self):
         """Load token from file if it exists"""
         if os.path.exists(self.token_file):
             try:
                 with open(self.token_file, "r") as f:
-                    self.token = f.read().strip()
+                    content = f.read().strip()
+                if content.startswith('{'):
+                    self.tokens = json.loads(content)
+                elif content and len(self.masters) == 1:
+                    self.tokens = {self.master_url: content}
+                self.use_master(self.master_url)
                 if self.token:
-                    self.headers = {"Authorization": f"Bearer {self.token}"}
                     print(f"Token loaded from {self.token_file}")
                     return True
             except Exception as e:
@@ -78,51 +503,71 @@ class GPUWorker:
         
         return False
     
+    def use_master(self, master_url):
+        """Point requests at master_url with the token registered there, if any"""
+        self.master_url = master_url
+        self.token = self.tokens.get(master_url)
+        self.headers = {"Authorization": f"Bearer {self.token}"} if self.token else None
+    
+    def mark_down(self, master_url):
+        """Stop using a failed master until its backoff expires"""
+        failures = self.failures.get(master_url, 0) + 1
+        self.failures[master_url] = failures
+        backoff = min(FAILOVER_MAX_BACKOFF, FAILOVER_MIN_BACKOFF * 2 ** (failures - 1))
+        # Jitter so workers that lost the same master don't all return to it at once
+        self.down_until[master_url] = time.time() + backoff * random.uniform(0.5, 1.5)
+        print(f"Master {master_url} unavailable, retrying it in about {backoff}s")
+    
+    def mark_up(self, master_url):
+        self.failures.pop(master_url, None)
+        self.down_until.pop(master_url, None)
+    
+    def select_master(self):
+        """Switch to the most preferred master that is not backing off, registering there if needed"""
+        now = time.time()
+        available = [url for url in self.preference if self.down_until.get(url, 0) <= now]
+        if not available:
+            return False
+        if available[0] != self.master_url:
+            print(f"Switching to master {available[0]}")
+            self.use_master(available[0])
+        if not self.token and not self.register():
+            self.mark_down(self.master_url)
+            return False
+        return True
+    
+    def deliver(self, metrics):
+        """Send metrics to this worker's master, failing over along the hash ring and keeping them if none answers"""
+        for _ in range(len(self.masters)):
+            if not self.select_master():
+                continue
+            if self.send_metrics(metrics):
+                self.mark_up(self.master_url)
+                return True
+            if self.retry_after:
+                # The master is shedding load; wait as asked rather than failing over
+                break
+            if self.master_unreachable:
+                self.mark_down(self.master_url)
+                continue
+            # The master answered but refused the upload, e.g. because it no longer knows our token
+            print("Re-registering with master...")
+            if self.register() and self.send_metrics(metrics):
+                return True
+            break
+        self.backlog.append(metrics)
+        return False
+    
     def collect_gpu_metrics_nvml(self):
         """Collect GPU metrics using NVML"""
         metrics = {"gpus": []}
         
         try:
-            device_count = nvmlDeviceGetCount()
-            for i in range(device_count):
-                handle = nvmlDeviceGetHandleByIndex(i)
-                name = nvmlDeviceGetName(handle)
-                if isinstance(name, bytes):
-                    name = name.decode('utf-8')
-                
-                temp = nvmlDeviceGetTemperature(handle, NVML_TEMPERATURE_GPU)
-                util = nvmlDeviceGetUtilizationRates(handle).gpu
-                
-                # Get memory info
-                memory = nvmlDeviceGetMemoryInfo(handle)
-                mem_total = memory.total / 1024 / 1024  # Convert to MB
-                mem_used = memory.used / 1024 / 1024
-                mem_free = memory.free / 1024 / 1024
-                
-                # Get power usage if available
-                power_usage = None
-                try:
-                    power_usage = nvmlDeviceGetPowerUsage(handle) / 1000.0  # Convert from milliwatts to watts
-                except Exception as e:
-                    # Power usage might not be available on all GPUs
-                    print(f"Could not get power usage for GPU {i}: {e}")
-                
-                gpu_info = {
-                    "model": name,
-                    "temp": temp,
-                    "util": util,
-                    "power_usage": round(power_usage, 2) if power_usage is not None else None,
-                    "memory": {
-                        "total": round(mem_total, 2),
-                        "used": round(mem_used, 2),
-                        "free": round(mem_free, 2),
-                        "percent_used": round((mem_used / mem_total) * 100, 2)
-                    }
-                }
-                
-                metrics["gpus"].append(gpu_info)
+            metrics["gpus"] = self.collector.collect()
         except Exception as e:
             print(f"Error collecting GPU metrics via NVML: {e}")
+            # Handles may be stale (e.g. after a GPU reset); look them up again next time
+            self.collector.reset()
         
         return metrics
     
@@ -132,7 +577,9 @@ class GPUWorker:
         
         try:
             # Run nvidia-smi to get GPU info
-            cmd = "sudo nvidia-smi --query-gpu=name,temperature.gpu,utilization.gpu,memory.total,memory.used,memory.free,power.draw --format=csv,noheader,nounits"
+            cmd = ("sudo nvidia-smi --query-gpu=name,temperature.gpu,utilization.gpu,memory.total,memory.used,memory.free,power.draw,"
+                   "uuid,clocks.sm,clocks.mem,fan.speed,clocks_throttle_reasons.active,"
+                   "ecc.errors.corrected.volatile.total,ecc.errors.uncorrected.volatile.total --format=csv,noheader,nounits")
             print(f"Running command: {cmd}")
             output = subprocess.check_output(cmd, shell=True).decode('utf-8').strip()
             print(f"nvidia-smi output: {output}")
@@ -144,6 +591,9 @@ class GPUWorker:
                 parts = [part.strip() for part in line.split(',')]
                 if len(parts) >= 7:  # Now we have 7 parts including power
                     model, temp, util, mem_total, mem_used, mem_free, power_draw = parts[:7]
+                    # Extended fields read "[N/A]" or "[Not Supported]" where a GPU lacks them
+                    extended = dict(zip(('uuid', 'sm_clock', 'memory_clock', 'fan', 'throttle',
+                                         'ecc_corrected', 'ecc_uncorrected'), parts[7:]))
                     
                     # Convert string values to appropriate types
                     try:
@@ -158,8 +608,10 @@ class GPUWorker:
                         if power_draw.lower() != 'n/a':
                             power_usage = float(power_draw)
                         
+                        throttle = smi_number(extended.get('throttle'), lambda value: int(value, 16))
                         gpu_info = {
                             "model": model,
+                            "uuid": extended.get('uuid'),
                             "temp": temp,
                             "util": util,
                             "power_usage": power_usage,
@@ -168,7 +620,18 @@ class GPUWorker:
                                 "used": mem_used,
                                 "free": mem_free,
                                 "percent_used": round((mem_used / mem_total) * 100, 2) if mem_total > 0 else 0
-                            }
+                            },
+                            "clocks": {
+                                "sm": smi_number(extended.get('sm_clock')),
+                                "memory": smi_number(extended.get('memory_clock')),
+                            },
+                            "fan": smi_number(extended.get('fan')),
+                            "throttle_mask": throttle,
+                            "throttle_reasons": [name for bit, name in THROTTLE_REASONS if throttle and throttle & bit],
+                            "ecc": {
+                                "corrected": smi_number(extended.get('ecc_corrected')),
+                                "uncorrected": smi_number(extended.get('ecc_uncorrected')),
+                            },
                         }
                         
                         metrics["gpus"].append(gpu_info)
@@ -182,11 +645,66 @@ class GPUWorker:
     
     def collect_gpu_metrics(self):
         """Collect GPU metrics using available method"""
-        if NVML_AVAILABLE:
+        if self.collector:
             return self.collect_gpu_metrics_nvml()
         else:
             return self.collect_gpu_metrics_nvidia_smi()
     
+    def encode_body(self, payload):
+        """Serialize a JSON payload, compressing it if it is large enough to be worth it"""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        headers = {"Content-Type": "application/json"}
+        if self.upload_encodings and len(body) >= COMPRESS_MIN_BYTES:
+            encoding = self.upload_encodings[0]
+            if encoding == 'zstd':
+                body = zstandard.ZstdCompressor(level=3).compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=6, mtime=0)
+            headers["Content-Encoding"] = encoding
+        return body, headers
+    
+    def post_json(self, path, payload):
+        """POST a JSON payload to the master, falling back to a plainer encoding if it is refused"""
+        while True:
+            body, headers = self.encode_body(payload)
+            headers.update(self.headers or {})
+            response = self.session.post(f"{self.master_url}{path}", data=body, headers=headers, timeout=10)
+            # Older masters cannot decode compressed uploads and reject them as bad JSON
+            encoding = headers.get("Content-Encoding")
+            refused = response.status_code == 415 or (
+                response.status_code == 400 and 'json' not in response.headers.get('Content-Type', '')
+            )
+            if encoding and refused:
+                print(f"Master refused {encoding} upload, falling back")
+                self.upload_encodings.remove(encoding)
+                continue
+            return response
+    
+    def upload(self, metrics, scheduler):
+        """Deliver one round of metrics and schedule the next tick from the outcome"""
+        # Each upload carries the interval it stands for so the master can weight it
+        if self.sampling:
+            scheduler.set_interval(self.sampling.observe(metrics.get('gpus', [])))
+        metrics["interval"] = scheduler.interval
+        delivered = self.deliver(metrics)
+        if delivered:
+            scheduler.success()
+        elif self.retry_after:
+            scheduler.defer(self.retry_after)
+        else:
+            print(f"No master accepted metrics, {len(self.backlog)} uploads kept for later")
+            scheduler.failure()
+        
+        # Follow the upload interval the master asks for, within sane bounds; with
+        # adaptive sampling it becomes the fastest interval used
+        if self.suggested_interval:
+            interval = min(MAX_SUGGESTED_INTERVAL, max(MIN_SUGGESTED_INTERVAL, float(self.suggested_interval)))
+            if self.sampling:
+                self.sampling.set_min_interval(interval)
+            else:
+                scheduler.set_interval(interval)
+        return delivered
+    
     def send_metrics(self, metrics):
         """Send metrics to the master server"""
         try:
@@ -195,22 +713,32 @@ class GPUWorker:
                 print("Warning: No GPU metrics data available to send")
                 return False
                 
-            # Add debug output to verify metrics structure
-            print(f"Sending metrics to master: {json.dumps(metrics, indent=2)}")
+            print(f"Sending metrics for {len(metrics['gpus'])} GPUs to master")
             
-            response = requests.post(
-                f"{self.master_url}/metrics", 
-                json={"metrics": metrics},
-                headers=self.headers,
-                timeout=10
-            )
+            # Earlier uploads that could not be delivered ride along with this one
+            payload = {"metrics": metrics}
+            backlog = [self.backlog[i] for i in range(min(BACKLOG_BATCH, len(self.backlog)))]
+            if backlog:
+                payload["backlog"] = backlog
+            
+            self.master_unreachable = False
+            self.retry_after = None
+            response = self.post_json("/metrics", payload)
             
             if response.status_code == 200:
                 print(f"Successfully sent metrics to master")
+                for _ in backlog:
+                    self.backlog.popleft()
+                self.suggested_interval = response.json().get("suggested_interval")
                 return True
+            elif response.status_code in (429, 503) and response.headers.get("Retry-After", "").isdigit():
+                self.retry_after = int(response.headers["Retry-After"])
+                print(f"Master asked to retry after {self.retry_after}s")
             else:
+                self.master_unreachable = response.status_code >= 500
                 print(f"Failed to send metrics: {response.status_code} - {response.text}")
         except Exception as e:
+            self.master_unreachable = True
             print(f"Error sending metrics: {e}")
         
         return False
@@ -218,7 +746,7 @@ class GPUWorker:
     def check_commands(self):
         """Check for commands from the master server"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.master_url}/commands",
                 headers=self.headers,
                 timeout=10
@@ -345,8 +873,10 @@ class GPUWorker:
     def check_command_status(self, command_id):
         """Check if a command should be stopped"""
         try:
-            response = requests.get(
+            # Only the status is needed; the output would be read (and decompressed) for nothing
+            response = self.session.get(
                 f"{self.master_url}/command_output/{command_id}",
+                params={"output": 0},
                 headers=self.headers,
                 timeout=5
             )
@@ -362,11 +892,9 @@ class GPUWorker:
     def send_command_output(self, command_id, status, output):
         """Send command output back to the master server"""
         try:
-            response = requests.post(
-                f"{self.master_url}/command_output",
-                json={"command_id": command_id, "status": status, "output": output},
-                headers=self.headers,
-                timeout=10
+            response = self.post_json(
+                "/command_output",
+                {"command_id": command_id, "status": status, "output": output}
             )
             
             if response.status_code == 200:
@@ -379,57 +907,81 @@ class GPUWorker:
         
         return False
     
-    def run(self, interval=5):
+    def run_pending_command(self):
+        """Run the next command the master has queued for this worker, if any"""
+        command_id, command = self.check_commands()
+        if command_id and command:
+            print(f"Executing command: {command}")
+            status, output = self.execute_command(command_id, command)
+            print(f"Command completed with status: {status}")
+            # Final update with complete output
+            self.send_command_output(command_id, status, output)
+    
+    def run(self, interval=5, max_interval=None):
         """Main worker loop"""
-        # Try to load token or register
-        if not self.load_token() and not self.register():
+        scheduler = Scheduler(interval, self.worker_id)
+        if max_interval and max_interval > interval:
+            self.sampling = AdaptiveInterval(interval, max_interval)
+        
+        # Even the first contact with the master happens at this worker's phase
+        scheduler.wait()
+        
+        # Try to load token or register with one of the masters
+        if not self.load_token() and not any(self.select_master() for _ in self.masters):
             print("Failed to register or load token. Exiting.")
             return
         
-        print(f"Worker '{self.worker_id}' running, sending metrics every {interval} seconds")
+        if self.sampling:
+            print(f"Worker '{self.worker_id}' running, sending metrics every {interval}-{max_interval} seconds "
+                  f"and checking for commands every {interval} seconds")
+        else:
+            print(f"Worker '{self.worker_id}' running, sending metrics every {interval} seconds")
+        
+        # Commands are checked at the fastest upload interval, so they are picked up as
+        # quickly while idle GPUs are sampled less often
+        command_checks = Scheduler(interval, self.worker_id)
         
         # Track consecutive failures
         consecutive_failures = 0
         last_nvml_reset = time.time()
         
         while True:
+            time.sleep(min(scheduler.delay(), command_checks.delay()))
             try:
+                if command_checks.delay() == 0:
+                    command_checks.set_interval(self.sampling.min_interval if self.sampling else scheduler.interval)
+                    command_checks.success()
+                    # Not while the master is failing or asked to be left alone
+                    if not scheduler.failures and not self.retry_after:
+                        self.run_pending_command()
+                if scheduler.delay() > 0:
+                    continue
+                
                 # Collect and send metrics
                 metrics = self.collect_gpu_metrics()
-                metrics["timestamp"] = datetime.now().isoformat()
+                metrics["timestamp"] = datetime.now(timezone.utc).isoformat()
                 metrics["hostname"] = self.worker_id
                 
                 # Check if we have valid GPU data
                 if metrics and metrics.get('gpus'):
-                    if self.send_metrics(metrics):
+                    if self.upload(metrics, scheduler):
                         consecutive_failures = 0
-                    else:
-                        # If sending metrics fails, try to re-register
-                        print("Re-registering with master...")
-                        if not self.register():
-                            print("Re-registration failed. Will try again later.")
-                            consecutive_failures += 1
+                    elif not self.retry_after:
+                        consecutive_failures += 1
                 else:
                     print("Warning: No GPU metrics collected or GPUs not detected")
                     consecutive_failures += 1
-                
-                # Check for commands
-                command_id, command = self.check_commands()
-                if command_id and command:
-                    print(f"Executing command: {command}")
-                    status, output = self.execute_command(command_id, command)
-                    print(f"Command completed with status: {status}")
-                    # Final update with complete output
-                    self.send_command_output(command_id, status, output)
+                    scheduler.success()
                 
                 # If we've had too many consecutive failures, try to re-initialize NVML
                 if consecutive_failures >= 5 and (time.time() - last_nvml_reset) > 300:  # 5 minutes
                     print("Too many consecutive failures, attempting to re-initialize NVML")
-                    if NVML_AVAILABLE:
+                    if self.collector:
                         try:
-                            nvmlShutdown()
+                            self.nvml.nvmlShutdown()
                             time.sleep(1)
-                            nvmlInit()
+                            self.nvml.nvmlInit()
+                            self.collector.reset()
                             print("NVML re-initialized successfully")
                             consecutive_failures = 0
                             last_nvml_reset = time.time()
@@ -441,9 +993,7 @@ class GPUWorker:
                 consecutive_failures += 1
                 import traceback
                 traceback.print_exc()
-            
-            # Wait for next iteration
-            time.sleep(interval)
+                scheduler.failure()
 
 def main():
     # Check for environment variables (for Docker deployment)
@@ -451,13 +1001,20 @@ def main():
     env_worker_id = os.environ.get('WORKER_ID')
     env_token_file = os.environ.get('TOKEN_FILE')
     env_interval = os.environ.get('UPDATE_INTERVAL')
+    env_max_interval = os.environ.get('MAX_UPDATE_INTERVAL')
     
     parser = argparse.ArgumentParser(description='GPU Worker Client')
     parser.add_argument('--master', required=not bool(env_master_url), 
-                      help='Master server URL (e.g., http://master-ip:5000)')
+                      help='Master server URL (e.g., http://master-ip:5000), or several comma separated URLs')
     parser.add_argument('--worker-id', help='Worker ID (defaults to hostname)')
     parser.add_argument('--token-file', default='token.txt', help='File to store authentication token')
     parser.add_argument('--interval', type=int, default=5, help='Interval between metric updates in seconds')
+    parser.add_argument('--max-interval', type=int,
+                        help='Slowest interval used while GPUs are idle (default 30; equal to --interval disables '
+                             'adaptive sampling)')
+    parser.add_argument('--no-compress', action='store_true', help='Send uploads to the master uncompressed')
+    parser.add_argument('--mock-gpus', type=int, metavar='N',
+                        help='Report N synthetic GPUs through the mock NVML layer (mock_nvml.py) instead of real GPUs')
     
     args = parser.parse_args()
     
@@ -466,6 +1023,7 @@ def main():
     worker_id = args.worker_id or env_worker_id
     token_file = args.token_file or env_token_file or 'token.txt'
     interval = args.interval or (int(env_interval) if env_interval else 5)
+    max_interval = args.max_interval or (int(env_max_interval) if env_max_interval else max(30, interval))
     
     if not master_url:
         print("Error: Master URL must be provided either via --master argument or MASTER_URL environment variable")
@@ -475,13 +1033,21 @@ def main():
     if worker_id:
         print(f"Worker ID provided: {worker_id} (via {'environment' if env_worker_id and worker_id == env_worker_id else 'command line'})")
     
+    # The mock NVML layer is only needed (and only shipped) for testing without GPUs
+    nvml = None
+    if args.mock_gpus:
+        import mock_nvml
+        nvml = mock_nvml.configure(args.mock_gpus)
+    
     worker = GPUWorker(
         master_url=master_url,
         worker_id=worker_id,
-        token_file=token_file
+        token_file=token_file,
+        compress=not args.no_compress,
+        nvml=nvml
     )
     
-    worker.run(interval=interval)
+    worker.run(interval=interval, max_interval=max_interval)
 
 if __name__ == "__main__":
     main()